@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+# Vectorized port of quota.pl: the same credit-based policy and App model,
+# with every per-app field held as a NumPy array so thousands of apps and
+# millions of seconds can be stepped per run.
+#
+#	./quota_sim.py 1				# quota.pl's test 1
+#	./quota_sim.py -a low-rate=3000 -a social=800 -a game=200 \
+#		-a malicious=5 -n 2000000 --csv-every 3600
+
+import argparse
+import sys
+import numpy
+
+BASE_CREDIT = 5
+MAX_NEW_APPS = 10
+SLK_RATE = 0.3
+MAX_TPUT = 100
+BURST_SECS = 6
+MAX_SMALL_BURST = 15
+NO_BURSTS = -1
+
+ACTIVE = 0
+BACKGROUND = 1
+IDLE = 2
+
+# <rate, sleepy, bg, bg_factor, burst>, as the init_* subs in quota.pl
+PROFILES = {
+    'low-rate': (0.1, 0.99, 0, 0.5, NO_BURSTS),
+    'social': (0.1, 0, 0.9, 0.2, NO_BURSTS),
+    'camera': (0.5, 0.95, 0, 0, 7),
+    'game': (0.5, 0.2, 0.9, 0.5, 60),
+    'malicious': (MAX_TPUT, 0.0, 1, 1, NO_BURSTS),
+}
+
+# Up to this many apps short of credit per second draw from the global
+# credit one by one in app order, exactly as quota.pl does.  Beyond that
+# the draw is a prefix sum with the io factor taken at the start of the
+# second, and the app that exhausts the pool takes what is left.  Either
+# way an app asks for its unscaled rate less its credit (getRate() -
+# balance()), even when MAX_TPUT scaled its demand down.
+EXACT_TOPUP_MAX = 32
+
+class Apps:
+    """quota.pl's App objects as parallel arrays, one slot per app."""
+
+    def __init__(self, names, w_max):
+        n = len(names)
+        params = numpy.array([PROFILES[name] for name in names], dtype=float).reshape(n, 5)
+        rate, sleepy, bg, bg_factor, burst = params.T
+        burst = burst.astype(int)
+        bursty = burst > 0
+        nonactive_slack = numpy.where(bursty, (burst - 1) / numpy.where(bursty, burst, 1), 0)
+        bg = bg + (1 - bg - sleepy) * nonactive_slack
+        sleepy = sleepy + (1 - sleepy) * nonactive_slack
+        for name in sorted(set(names)):
+            i = names.index(name)
+            if bursty[i]:
+                print("sleepy %f bg %f" % (sleepy[i], bg[i]))
+
+        self.names = names
+        self.w_max = w_max
+        self.orig_rate = rate
+        self.rate = rate.copy()
+        self.sleepy = sleepy
+        self.bg = bg
+        self.bg_factor = bg_factor
+        self.burst = burst
+        self.credit = numpy.full(n, float(BASE_CREDIT))
+        self.runtime = numpy.where(rate == 0.5, burst, NO_BURSTS)
+        self.unhappiness = numpy.zeros(n)
+        self.demand = numpy.zeros(n)
+        self.drag = numpy.zeros(n)
+        self.withdrawl = numpy.zeros(n)
+        self.bg_withdraw = numpy.zeros(n)
+        self.bgtime = numpy.zeros(n, dtype=int)
+        self.status = numpy.full(n, IDLE)
+
+    def __len__(self):
+        return len(self.names)
+
+    def next_second_rate(self, rng):
+        r_bg, r_sleepy = rng.random((2, len(self)))
+        in_bg = r_bg <= self.bg
+        idle = ~in_bg & (r_sleepy <= self.sleepy)
+        self.status = numpy.where(in_bg, BACKGROUND, numpy.where(idle, IDLE, ACTIVE))
+        self.bgtime += in_bg
+
+        # handle drag first
+        has_drag = self.drag > 0
+
+        # middle of active run, skip rate adjustment for background/idle
+        in_run = ~has_drag & (self.runtime < self.burst) & (self.runtime > 0)
+        settled = ~has_drag & ~in_run
+        rate = numpy.where(settled & in_bg, self.orig_rate * self.bg_factor, self.orig_rate)
+        rate = numpy.where(settled & idle, 0, rate)
+
+        # app is active! check for bursts
+        running = in_run | (settled & ~in_bg & ~idle)
+        bursting = running & (self.runtime != NO_BURSTS)
+        self.runtime = self.runtime - bursting
+        burst_sec = bursting & (self.runtime % BURST_SECS == 0)
+        rate = numpy.where(burst_sec, MAX_SMALL_BURST, rate)
+        self.runtime = numpy.where(burst_sec & (self.runtime == 0), self.burst, self.runtime)
+
+        self.rate = numpy.where(has_drag, self.drag, rate)
+        self.drag = numpy.zeros(len(self))
+        self.demand += self.rate
+
+    def io_factor(self, global_credit, idx=slice(None)):
+        return (self.w_max - global_credit - self.bg_withdraw[idx]) / (self.w_max - global_credit)
+
+    def adjusted_rate(self, global_credit):
+        # adjust for malicious apps, then penalize background I/O
+        ret = numpy.minimum(self.rate, 0.5) * self.io_factor(global_credit)
+        # small reward for idleness relative to I/O rate
+        return numpy.where(self.rate == 0, self.orig_rate / 20, ret)
+
+    def global_topup(self, needy, global_credit):
+        """Top needy apps up from the global credit; returns what is left."""
+        idx = numpy.flatnonzero(needy)
+        if len(idx) <= EXACT_TOPUP_MAX:
+            for i in idx:
+                draw = min(self.rate[i] - self.credit[i], global_credit)
+                draw *= self.io_factor(global_credit, i)
+                global_credit -= draw
+                self.credit[i] += draw
+            return global_credit
+
+        need = self.rate[idx] - self.credit[idx]
+        factor = self.io_factor(global_credit, idx)
+        draw = need * factor
+        # pool left when each app is reached, if all before it were served
+        before = global_credit - numpy.concatenate(([0], numpy.cumsum(draw)[:-1]))
+        full = need <= before
+        if full.all():
+            self.credit[idx] += draw
+            return global_credit - draw.sum()
+        k = numpy.argmin(full)
+        self.credit[idx[:k]] += draw[:k]
+        partial = before[k] * factor[k]
+        self.credit[idx[k]] += partial
+        return before[k] - partial
+
+    def write(self, real, global_credit):
+        """Withdraw this second's demand as scaled to MAX_TPUT (real); apps
+        short of credit top up from the global account (naively according
+        to app order for now) and write what they have.  Returns the
+        withdrawals and the global credit left."""
+        needy = (real != 0) & (real > self.credit)
+        if needy.any():
+            global_credit = self.global_topup(needy, global_credit)
+        # quota.pl dies ("bug") if a top-up of the unscaled rate left more
+        # than the scaled demand; that much is all that is written
+        withdraw = numpy.where(needy, numpy.minimum(self.credit, real), real)
+        short = real - withdraw
+        self.unhappiness += short
+        self.drag += short
+
+        # finally, make withdraw from app's account
+        self.credit -= withdraw
+        self.withdrawl += withdraw
+        in_bg = self.status == BACKGROUND
+        self.bg_withdraw[in_bg] += withdraw[in_bg]
+        return withdraw, global_credit
+
+def profile_mix(testnum):
+    """quota.pl's app_credit_based_dos() line-up for a test number."""
+    n_apps = 20
+    names = ['low-rate'] * (n_apps - 3) + ['social'] * 2 + ['game']
+    header = list(names)
+    if testnum == 1:
+        names[0] = 'malicious'
+        header.append('malicious')
+    elif testnum == 2:
+        names[0] = 'malicious'
+        names[1] = 'malicious'
+        header += ['malicious', 'malicious']
+    return names, header
+
+def simulate(names, header, nsecs, w_max, seed=None, csv_path='report.csv', csv_every=1,
+        rng=None):
+    """Run the line-up for nsecs seconds; returns the apps, W_t and the
+    global credit left.  rng, if given, replaces numpy's generator seeded
+    with seed: anything with random(shape)."""
+    t_start = 0
+    t_end = t_start + nsecs
+    slk = w_max * SLK_RATE
+    wtag_max = w_max - slk
+    b = w_max / nsecs
+    btag = wtag_max / nsecs
+    global_credit = 0
+    w_t = 0
+
+    if rng is None:
+        rng = numpy.random.default_rng(seed)
+    apps = Apps(names, w_max)
+    n_apps = len(apps)
+
+    fh = None
+    if csv_path:
+        fh = open(csv_path, 'w')
+        fh.write("".join("%s,,,," % name for name in header) + "\n")
+        fh.write("rate,withdraw,credit,," * n_apps + "\n")
+        row_fmt = "%.3f,%.3f,%.3f,," * n_apps + "\n"
+    print("W_max %d Btag %.3f SEC_SLACK %.3f" % (w_max, btag, slk / nsecs))
+
+    for t in range(t_start, t_end):
+        t_credit = b
+
+        # update rate for apps
+        apps.next_second_rate(rng)
+
+        # 1. calc app I/O demand of all running apps in the next second
+        adjusted_demand = apps.adjusted_rate(global_credit)
+        real_demand = apps.rate.copy()
+        total_demand = real_demand.sum()
+
+        # if demand > MAX_TPUT --> factor real demand
+        if total_demand > MAX_TPUT:
+            real_demand *= MAX_TPUT / total_demand
+
+        # whatever is left from Btag save to global credit.
+        if total_demand < btag:
+            global_save = btag - total_demand
+            t_credit -= global_save
+            global_credit += global_save
+
+        # 2. allocate remaining time-unit bandwidth proportionally according
+        #    to *adjusted* demand (to avoid over-allocating to malicious app)
+        apps.credit += t_credit * apps.adjusted_rate(global_credit) / adjusted_demand.sum()
+
+        # 3. now handle actual writing
+        withdraw, global_credit = apps.write(real_demand, global_credit)
+        w_t += withdraw.sum()
+
+        if fh is not None and (t - t_start) % csv_every == 0:
+            fh.write(row_fmt % tuple(numpy.column_stack(
+                (real_demand, withdraw, apps.credit)).ravel()))
+
+    if fh is not None:
+        fh.close()
+    print("W_t=%7.1f (GLOBAL_CREDIT %d)" % (w_t, global_credit))
+    print("done")
+    return apps, w_t, global_credit
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized credit-based quota simulator")
+    parser.add_argument('testnum', nargs='?', type=int, default=0,
+        help="quota.pl line-up: 0 benign, 1 or 2 malicious apps")
+    parser.add_argument('-a', '--apps', action='append', default=[],
+        help="PROFILE=COUNT, replaces the quota.pl line-up (%s)" % ", ".join(PROFILES))
+    parser.add_argument('-n', '--nsecs', type=int, default=3600)
+    parser.add_argument('-w', '--w-max', type=float,
+        default=5000 - MAX_NEW_APPS * BASE_CREDIT)
+    parser.add_argument('-s', '--seed', type=int)
+    parser.add_argument('-o', '--csv', default='report.csv', help="'' disables the CSV")
+    parser.add_argument('--csv-every', type=int, default=1, help="write every Nth second")
+    args = parser.parse_args()
+
+    if args.apps:
+        names = []
+        for item in args.apps:
+            name, count = item.split('=', 1)
+            if name not in PROFILES:
+                print("unknown profile %s" % name, file=sys.stderr)
+                sys.exit(1)
+            names += [name] * int(count)
+        header = names
+    else:
+        names, header = profile_mix(args.testnum)
+
+    simulate(names, header, args.nsecs, args.w_max, args.seed, args.csv, args.csv_every)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import subprocess
+import numpy
+import pytest
+import quota_sim
+from quota_sim import Apps
+
+HERE = os.path.dirname(os.path.abspath(quota_sim.__file__))
+W_MAX = 5000 - quota_sim.MAX_NEW_APPS * quota_sim.BASE_CREDIT
+
+class PerlRand:
+    """Perl's rand(1) after srand(seed), a drand48, drawn in quota.pl's
+    order: an app in the background draws no sleepy number."""
+
+    def __init__(self, seed, bg):
+        self.x = (seed << 16) + 0x330e
+        self.bg = bg
+
+    def next(self):
+        self.x = (0x5deece66d * self.x + 0xb) % (1 << 48)
+        return self.x / float(1 << 48)
+
+    def random(self, shape):
+        out = numpy.ones(shape)
+        for i in range(shape[1]):
+            out[0, i] = self.next()
+            if out[0, i] > self.bg[i]:
+                out[1, i] = self.next()
+        return out
+
+@pytest.mark.skipif(shutil.which('perl') is None, reason="needs perl")
+@pytest.mark.parametrize('testnum', [0, 1, 2])
+def test_same_report_as_quota_pl(tmp_path, testnum):
+    seed = 7
+    subprocess.run(['perl', '-e', 'srand(%d); @ARGV = (%d); do "%s/quota.pl"; die $@ if $@'
+        % (seed, testnum, HERE)], cwd=str(tmp_path), stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, check=True)
+    names, header = quota_sim.profile_mix(testnum)
+    bg = Apps(names, W_MAX).bg
+    csv = str(tmp_path / 'sim.csv')
+    quota_sim.simulate(names, header, 3600, W_MAX, csv_path=csv, rng=PerlRand(seed, bg))
+    assert open(csv).read() == (tmp_path / 'report.csv').read_text()
+
+def hand_worked(exact_max, monkeypatch):
+    monkeypatch.setattr(quota_sim, 'EXACT_TOPUP_MAX', exact_max)
+    apps = Apps(['game', 'malicious'], 1000)
+    apps.rate = numpy.array([15.0, 100.0])
+    apps.credit = numpy.array([3.0, 1.0])
+    # Scaled to MAX_TPUT: 13.04 and 86.96
+    real = apps.rate * quota_sim.MAX_TPUT / apps.rate.sum()
+    return apps, apps.write(real, 20)
+
+def test_topup_asks_for_the_unscaled_rate(monkeypatch):
+    apps, (withdraw, global_credit) = hand_worked(quota_sim.EXACT_TOPUP_MAX, monkeypatch)
+    # The game draws 15 - 3 and writes its scaled 13.04, the attacker
+    # gets the 8 left and writes 1 + 8
+    assert withdraw == pytest.approx([1500 / 115, 9])
+    assert global_credit == pytest.approx(0)
+    assert apps.credit == pytest.approx([15 - 1500 / 115, 0])
+    assert apps.drag == pytest.approx([0, 10000 / 115 - 9])
+
+def test_prefix_topup_matches_app_order(monkeypatch):
+    apps, (withdraw, global_credit) = hand_worked(0, monkeypatch)
+    assert withdraw == pytest.approx([1500 / 115, 9])
+    assert global_credit == pytest.approx(0)
+
+def test_io_factor_scales_the_draw(monkeypatch):
+    apps = Apps(['game'], 1000)
+    apps.rate = numpy.array([15.0])
+    apps.credit = numpy.array([3.0])
+    apps.bg_withdraw = numpy.array([490.0])
+    withdraw, global_credit = apps.write(numpy.array([15.0]), 20)
+    # (1000 - 20 - 490) / (1000 - 20) of the 12 asked for
+    assert withdraw == pytest.approx([3 + 6])
+    assert global_credit == pytest.approx(14)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import os
+from subprocess import call
+from adb_stream import adb_cmd
+from metrics import counters
+
+RL_ROOT = '/proc/ratelimit_uid'
+
+# Relative rate change below which an applied limit is left alone
+HYSTERESIS = 0.1
+# Ticks a UID must stay out of the prison before it is unleashed
+UNLEASH_HOLD = 3
+
+class NullBackend:
+    """Nothing to actuate (HOST_RATELIMIT_DUMB / CGROUP1).
+
+    cgroup2.Cgroup2Controller is the HOST_RATELIMIT_CGROUP2 backend.
+    """
+
+    def apply(self, changes):
+        pass
+
+class ProcBackend:
+    """Writes /proc/ratelimit_uid directly, one write() per entry."""
+
+    def __init__(self, path=RL_ROOT):
+        self.path = path
+
+    def apply(self, changes):
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            for uid, rate in changes:
+                # The kernel parses a single "uid rate" pair per write
+                os.write(fd, ("%s %d\n" % (uid, rate)).encode())
+        finally:
+            os.close(fd)
+
+class AdbProcBackend:
+    """Writes /proc/ratelimit_uid on the device in one adb round-trip."""
+
+    def __init__(self, serial=None, path=RL_ROOT):
+        self.serial = serial
+        self.path = path
+
+    def apply(self, changes):
+        script = "; ".join("echo %s %d > %s" % (uid, rate, self.path) for uid, rate in changes)
+        counters['spawns'] += 1
+        call(adb_cmd(self.serial) + ['shell', "su -c '%s'" % script])
+
+class RateActuator:
+    """Keeps the applied limit table in line with the desired one.
+
+    sync() takes the policy's prison (uid -> rate) as the desired table,
+    diffs it against what is applied and hands all changes of the tick to
+    the backend in a single apply().  Rate changes within HYSTERESIS are
+    not re-applied and an unleash only happens after the UID stayed out
+    of the prison for UNLEASH_HOLD ticks, so limits don't flap.
+    """
+
+    def __init__(self, backend, hysteresis=HYSTERESIS, unleash_hold=UNLEASH_HOLD):
+        self.backend = backend
+        self.hysteresis = hysteresis
+        self.unleash_hold = unleash_hold
+        self.applied = {}
+        self.released = {}
+        self.calls = 0
+        self.tick_calls = 0
+        self.entries = 0
+
+    def changes(self, desired):
+        changes = []
+        for uid, rate in desired.items():
+            self.released.pop(uid, None)
+            applied = self.applied.get(uid)
+            if applied is None or abs(rate - applied) > self.hysteresis * applied:
+                changes.append((uid, rate))
+        for uid in self.applied:
+            if uid in desired:
+                continue
+            held = self.released.get(uid, 0) + 1
+            if held >= self.unleash_hold:
+                changes.append((uid, -1))
+            else:
+                self.released[uid] = held
+        return changes
+
+    def plan(self, desired):
+        """Diff and take the changes as applied; the caller applies them."""
+        changes = self.changes(desired)
+        for uid, rate in changes:
+            if rate < 0:
+                del self.applied[uid]
+                self.released.pop(uid, None)
+            else:
+                self.applied[uid] = rate
+        return changes
+
+    def sync(self, desired):
+        changes = self.plan(desired)
+        self.tick_calls = 0
+        if changes:
+            self.backend.apply(changes)
+            self.count(changes)
+        return changes
+
+    def count(self, changes):
+        self.calls += 1
+        self.tick_calls = 1
+        self.entries += len(changes)
+
+    def retry(self, changes):
+        """Changes that did not make it; they are sent again next time."""
+        for uid, rate in changes:
+            if rate < 0:
+                # still applied as far as we know, unleash on the next diff
+                self.applied[uid] = -1
+                self.released[uid] = self.unleash_hold - 1
+            elif self.applied.get(uid) == rate:
+                del self.applied[uid]
+
+    def reset(self):
+        """Forget what is applied, e.g. after the device dropped all limits."""
+        self.applied = {}
+        self.released = {}
@@ -2,9 +2,9 @@
 
 #set -x
 
-adb shell dumpsys display | grep "mGlobalDisplayState=ON" >/dev/null || { echo -n -1; exit; }
+${ADB:-adb} shell dumpsys display | grep "mGlobalDisplayState=ON" >/dev/null || { echo -n -1; exit; }
 
-TASK_RECORD=`adb shell dumpsys activity activities | grep -A 1 -m 1 "* TaskRecord{"`
+TASK_RECORD=`${ADB:-adb} shell dumpsys activity activities | grep -A 1 -m 1 "* TaskRecord{"`
 
 APP_STRING=`echo "$TASK_RECORD" | grep -o "effectiveUid=u0a[[:digit:]]\+"`
 
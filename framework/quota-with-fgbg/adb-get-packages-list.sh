@@ -1,4 +1,4 @@
 #!/bin/bash
 
 
-adb shell "su -c 'cat /data/system/packages.list'" > packages.list
+${ADB:-adb} shell "su -c 'cat /data/system/packages.list'" > packages.list
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+import time
+from subprocess import Popen
+from subprocess import PIPE
+from subprocess import DEVNULL
+from metrics import counters
+
+# Point ADB at fake-adb.sh to run against a local stand-in
+ADB = os.environ.get('ADB', 'adb')
+
+RECONNECT_DELAY_MIN = 0.1
+RECONNECT_DELAY_MAX = 5
+
+# Printed by the device-side loop after every sample
+FRAME_END = '==EOF-DISKSTATS=='
+
+def adb_cmd(serial=None):
+    cmd = [ADB]
+    if serial:
+        cmd += ['-s', serial]
+    return cmd
+
+class AdbStream:
+    """Long-lived `adb exec-out` channel running one device-side command.
+
+    Every output line is passed to on_line() from a reader thread.  When
+    the channel drops it is respawned with exponential backoff.
+    """
+
+    def __init__(self, command, on_line, serial=None, on_connect=None):
+        self.command = command
+        self.on_line = on_line
+        self.on_connect = on_connect
+        self.serial = serial
+        self.proc = None
+        self.connects = 0
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def restart(self):
+        """Drop the current channel; it is respawned as if it had died."""
+        with self.lock:
+            proc = self.proc
+        if proc is not None:
+            proc.kill()
+
+    def stop(self):
+        self.running = False
+        self.restart()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def _run(self):
+        delay = RECONNECT_DELAY_MIN
+        while self.running:
+            started = time.monotonic()
+            try:
+                counters['spawns'] += 1
+                proc = Popen(adb_cmd(self.serial) + ['exec-out', self.command],
+                    stdout=PIPE, stderr=DEVNULL)
+            except OSError as e:
+                print("adb stream: cannot spawn %s: %s" % (ADB, e), file=sys.stderr)
+                proc = None
+
+            if proc is not None:
+                with self.lock:
+                    self.proc = proc
+                self.connects += 1
+                if self.on_connect is not None:
+                    self.on_connect()
+                for line in proc.stdout:
+                    self.on_line(line.decode('utf-8', 'replace'))
+                proc.wait()
+                with self.lock:
+                    self.proc = None
+
+            if not self.running:
+                break
+            if time.monotonic() - started > RECONNECT_DELAY_MAX:
+                delay = RECONNECT_DELAY_MIN
+            print("adb stream dropped, reconnecting in %.1fs" % delay, file=sys.stderr)
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+class StatsSampler:
+    """Streams framed snapshots of a proc file over one AdbStream.
+
+    The device-side loop cats the file every `interval` seconds and
+    terminates each snapshot with FRAME_END, so no adb client or device
+    shell is spawned per sample.  read() hands out the newest complete
+    frame; alternatively on_frame(lines, arrival time) is called from the
+    reader thread for every frame.
+    """
+
+    def __init__(self, path, interval, serial=None, on_frame=None):
+        command = "while true; do cat %s; echo %s || exit; sleep %g; done" % (
+            path, FRAME_END, interval)
+        self.stream = AdbStream(command, self._on_line, serial,
+            on_connect=self._on_connect)
+        self.cond = threading.Condition()
+        self.partial = []
+        self.on_frame = on_frame
+        self.frame = None
+        # Monotonic arrival time of the newest frame and of the one read
+        self.frame_time = None
+        self.read_time = None
+        self.frame_count = 0
+        self.read_count = 0
+
+    def start(self):
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
+
+    def _on_connect(self):
+        # Drop whatever half frame the previous channel left behind
+        self.partial = []
+
+    def _on_line(self, line):
+        if line.rstrip('\r\n') != FRAME_END:
+            self.partial.append(line)
+            return
+        with self.cond:
+            self.frame = self.partial
+            self.frame_time = time.monotonic()
+            self.frame_count += 1
+            self.cond.notify_all()
+        if self.on_frame is not None:
+            self.on_frame(self.frame, self.frame_time)
+        self.partial = []
+
+    def read(self, timeout=None):
+        """Return the lines of the newest unread frame, None on timeout."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frame_count > self.read_count, timeout):
+                return None
+            self.read_count = self.frame_count
+            self.read_time = self.frame_time
+            return self.frame
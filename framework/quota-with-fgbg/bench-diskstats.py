@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Per-snapshot cost of parsing /proc/diskstats_uid_global and computing
+# per-UID deltas, vectorized against the old line-by-line loop.
+#
+#	./bench-diskstats.py -u 4001 -r 200
+
+import argparse
+import random
+import time
+from diskstats import MAX_STATS_ENTRIES
+from diskstats import parse_snapshot
+from diskstats import DeltaEngine
+
+def make_snapshot(seq, uids, sectors):
+    lines = ["%u %lu %lu count %d / %d [sane]\n" % (seq, seq, 1, len(uids), MAX_STATS_ENTRIES)]
+    lines += ["\t%d %lu %lu\n" % (uid, s, 16) for uid, s in zip(uids, sectors)]
+    lines.append("\t-1 %lu\n" % sum(sectors))
+    return lines
+
+def parse_lines(lines):
+    """The monitor's parse loop before the vectorized parser."""
+    fields = lines[0].split()
+    timestamp_diff = int(fields[2])
+    uid_throughput = {}
+    for line in lines[1:]:
+        fields = line.split()
+        if int(fields[0]) == -1:
+            continue
+        uid_throughput[fields[0]] = int(fields[2]) / 2 / max(timestamp_diff, 1)
+    return uid_throughput
+
+def bench(name, func, snapshots):
+    started = time.perf_counter()
+    for snap in snapshots:
+        func(snap)
+    per = (time.perf_counter() - started) / len(snapshots)
+    print("%-28s %9.1f us/snapshot" % (name, per * 1000000))
+    return per
+
+def main():
+    parser = argparse.ArgumentParser(description="diskstats_uid_global parser microbenchmark")
+    parser.add_argument('-u', '--uids', type=int, default=MAX_STATS_ENTRIES)
+    parser.add_argument('-r', '--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    uids = rng.sample(range(10000, 10000 + 100 * args.uids), args.uids)
+    sectors = [rng.randrange(1 << 30) for _ in uids]
+    snapshots = []
+    for seq in range(args.rounds):
+        sectors = [s + rng.randrange(64) for s in sectors]
+        snapshots.append(make_snapshot(seq + 1, uids, sectors))
+    texts = ["".join(lines) for lines in snapshots]
+
+    print("%d UIDs, %d snapshots" % (args.uids, args.rounds))
+    old = bench("line-by-line split/int", parse_lines, snapshots)
+    bench("parse_snapshot (lines)", parse_snapshot, snapshots)
+    new = bench("parse_snapshot (text)", parse_snapshot, texts)
+    parsed = [parse_snapshot(text) for text in texts]
+    engine = DeltaEngine()
+    bench("DeltaEngine.update", engine.update, parsed)
+
+    # Slot order changing between snapshots defeats the same-order fast path
+    shuffled = []
+    for i, snap in enumerate(parsed):
+        lines = make_snapshot(snap.seq, snap.uids.tolist(), snap.sectors.tolist())
+        if i % 2:
+            lines = lines[:1] + lines[-2:0:-1] + lines[-1:]
+        shuffled.append(parse_snapshot(lines))
+    engine = DeltaEngine()
+    delta = bench("DeltaEngine.update (reorder)", engine.update, shuffled)
+    print("speedup parse+delta vs line-by-line: %.1fx" % (old / (new + delta)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# Control-loop benchmark: the monitor's per-tick path (DeviceMonitor.tick:
+# read the stats file, parse, deltas, policy step, actuation, trace and
+# rollups) driven by a DeviceModel with 10 to 4000 UIDs, attackers
+# starting mid-run and fast foreground switches.  Every scenario runs in a fresh process; results
+# go to a JSON file that --compare diffs against another run's.
+#
+#	./bench-monitor.py -o bench-$(git rev-parse --short HEAD).json
+#	./bench-monitor.py -u 4000 -t 600 --live 60 -o new.json --compare old.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+from subprocess import run
+from subprocess import Popen
+from subprocess import PIPE
+from subprocess import DEVNULL
+import metrics
+from device_model import DeviceModel
+from device_model import ModelBackend
+from device_monitor import DeviceMonitor
+from device_monitor import file_sampler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Benign apps are dealt from quota.pl's line-up
+BENIGN_MIX = ['low-rate'] * 16 + ['social'] * 2 + ['game', 'camera']
+# Budget small enough that an attacker is leashed within seconds
+BENCH_W_MAX = 88 * 1024 * 1024
+BENCH_LIFE_SEC = 2 * 365 * 24 * 3600
+
+# (key, lower is better) compared by --compare
+COMPARED = [
+    ('ticks_per_s', False),
+    ('cpu_per_tick_s.mean', True),
+    ('cpu_per_tick_s.p99', True),
+    ('max_rss_kib', True),
+    ('leash_latency_s.max', True),
+    ('benign_throttled_s', True),
+    ('spawns_per_min', True),
+]
+
+def app_mix(n, attackers):
+    names = ['malicious'] * attackers
+    names += [BENIGN_MIX[i % len(BENIGN_MIX)] for i in range(n - attackers)]
+    return names
+
+async def drive(model, monitor, ticks, interval, stats_path, attackers, attack_at):
+    """Tick the monitor on the model; returns the CPU per tick histogram,
+    the host time, when the attackers were leashed and the seconds benign
+    UIDs spent leashed."""
+    cpu = metrics.Histogram()
+    leashed_at = {}
+    benign_throttled = 0
+    host_time = 0
+    for tick in range(ticks):
+        # Device side, not timed
+        model.advance(interval)
+        with open(stats_path, 'w') as out:
+            out.write(model.read_stats())
+
+        c = time.process_time()
+        started = metrics.now()
+        await monitor.tick()
+        cpu.observe(time.process_time() - c)
+        host_time += metrics.now() - started
+
+        for uid in monitor.actuator.applied:
+            if uid in attackers:
+                if uid not in leashed_at:
+                    leashed_at[uid] = model.now - attack_at
+            else:
+                benign_throttled += interval
+    return cpu, host_time, leashed_at, benign_throttled
+
+def run_scenario(task):
+    """One scenario in a fresh worker process; returns its results."""
+    n_uids, args = task
+    workdir = tempfile.mkdtemp(prefix='bench-monitor-')
+    names = app_mix(n_uids, args['attackers'])
+    model = DeviceModel(names, args['unit'], args['seed'], fg_session=args['fg_session'])
+    attack_at = args['ticks'] * args['interval'] * args['attack_at']
+    attackers = set()
+    for i, name in enumerate(names):
+        if name == 'malicious':
+            model.start[i] = attack_at
+            attackers.add(str(model.uids[i]))
+
+    stats_path = os.path.join(workdir, 'diskstats_uid_global')
+    open(stats_path, 'w').close()
+    monitor = DeviceMonitor('bench', args['interval'], policy_params={'W_max': args['w_max'],
+        'life_sec': args['life_sec']}, sample=file_sampler(stats_path, lambda: model.now),
+        fg_uid=model.fg_uid, backend=ModelBackend(model), clock=lambda: model.now,
+        start_time=0, trace=os.path.join(workdir, 'bench.qtr'))
+    stats = asyncio.run(drive(model, monitor, args['ticks'], args['interval'], stats_path,
+        attackers, attack_at))
+    monitor.stop()
+    shutil.rmtree(workdir)
+    cpu, host_time, leashed_at, benign_throttled = stats
+    latency = sorted(leashed_at.values())
+    cpu_stats = cpu.to_dict()
+    del cpu_stats['buckets_us_log2']
+    return {
+        'uids': n_uids,
+        'ticks': args['ticks'],
+        'ticks_per_s': args['ticks'] / host_time if host_time else 0,
+        'cpu_per_tick_s': cpu_stats,
+        'phases': {name: {k: v for k, v in hist.to_dict().items() if k != 'buckets_us_log2'}
+            for name, hist in monitor.stats.phases.items()},
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'attackers': len(attackers),
+        'leash_latency_s': {
+            'leashed': len(latency),
+            'max': latency[-1] if latency else None,
+            'mean': sum(latency) / len(latency) if latency else None,
+        },
+        'benign_throttled_s': benign_throttled,
+        'actuation_calls': monitor.actuator.calls,
+        'fg_changes': model.fg_changes,
+        'spawns_per_min': 0,
+    }
+
+def run_live(secs, args):
+    """The real monitor (monitor-multi.py through fake-adb.sh) against
+    device-model.py for secs of wall time: subprocess spawns, CPU and RSS
+    of the whole adb-driven path."""
+    root = tempfile.mkdtemp(prefix='bench-live-')
+    serial = 'bench'
+    env = dict(os.environ, ADB=os.path.join(HERE, 'fake-adb.sh'), FAKE_ADB_ROOT=root)
+    server = Popen([sys.executable, os.path.join(HERE, 'device-model.py'),
+        '-a', 'low-rate=16', '-a', 'social=2', '-a', 'game=1', '-a', 'malicious=1',
+        '-s', str(args['seed']), os.path.join(root, serial)], stdout=DEVNULL)
+    time.sleep(2)
+    monitor = Popen([sys.executable, os.path.join(HERE, 'monitor-multi.py'),
+        os.path.join(root, 'live'), '-s', serial, '-n', str(secs), '--fresh', '--no-json'],
+        cwd=HERE, env=env, stdout=DEVNULL)
+    # The monitor's own usage, with the adb processes it spawned and reaped
+    _, _, usage = os.wait4(monitor.pid, 0)
+    monitor.returncode = 0
+    server.terminate()
+    server.wait()
+
+    data = {}
+    for name in os.listdir(root):
+        if name.startswith('live-metrics-'):
+            with open(os.path.join(root, name)) as f:
+                data = json.load(f)
+    shutil.rmtree(root)
+    counters = data.get('counters', {})
+    tick = data.get('phases', {}).get('tick', {})
+    ticks = counters.get('ticks', 0)
+    cpu = usage.ru_utime + usage.ru_stime
+    return {
+        'secs': secs,
+        'ticks': ticks,
+        'tick_s': {k: v for k, v in tick.items() if k != 'buckets_us_log2'},
+        # Monitor plus the adb (here fake-adb) processes it spawned
+        'cpu_per_tick_s': cpu / ticks if ticks else None,
+        'max_rss_kib': usage.ru_maxrss,
+        'spawns_per_min': counters.get('spawns', 0) * 60 / secs,
+        'scheduler': data.get('scheduler'),
+        'devices': data.get('devices'),
+    }
+
+def git_head():
+    out = run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, stdout=PIPE, stderr=DEVNULL)
+    return out.stdout.decode('utf-8').strip() or None
+
+def lookup(result, key):
+    for part in key.split('.'):
+        if not isinstance(result, dict):
+            return None
+        result = result.get(part)
+    return result
+
+def compare(new, old):
+    """Print the COMPARED metrics of matching scenarios side by side."""
+    print("%s vs %s" % (new.get('commit'), old.get('commit')))
+    old_scenarios = {s['uids']: s for s in old.get('scenarios', [])}
+    rows = [("%d uids" % s['uids'], s, old_scenarios.get(s['uids'])) for s in new['scenarios']]
+    if new.get('live') and old.get('live'):
+        rows.append(('live', new['live'], old['live']))
+    for name, n, o in rows:
+        if o is None:
+            continue
+        for key, lower_better in COMPARED:
+            a = lookup(n, key)
+            b = lookup(o, key)
+            if a is None or b is None:
+                continue
+            change = (a - b) / b * 100 if b else 0
+            worse = change > 5 if lower_better else change < -5
+            print("%-10s %-22s %12.6g %12.6g %+7.1f%%%s" % (name, key, a, b, change,
+                "  worse" if worse else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Monitor control loop benchmark")
+    parser.add_argument('-u', '--uids', type=int, action='append',
+        help="active UIDs per scenario (default 10, 100, 1000, 4000)")
+    parser.add_argument('-t', '--ticks', type=int, default=1800)
+    parser.add_argument('-i', '--interval', type=float, default=1)
+    parser.add_argument('-A', '--attackers', type=int, default=1)
+    parser.add_argument('--attack-at', type=float, default=0.25,
+        help="fraction of the run after which the attackers start")
+    parser.add_argument('--fg-session', type=float, default=30, help="mean fg session, seconds")
+    parser.add_argument('--unit', type=float, default=10, help="KiB/s per quota.pl rate unit")
+    parser.add_argument('-W', '--w-max', type=float, default=BENCH_W_MAX, help="lifetime KiB")
+    parser.add_argument('-L', '--life-sec', type=float, default=BENCH_LIFE_SEC)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--live', type=float, default=0,
+        help="also run the real monitor via fake adb for this many seconds")
+    parser.add_argument('-o', '--out', help="results JSON (default bench-monitor-COMMIT.json)")
+    parser.add_argument('-c', '--compare', help="results JSON of another run to compare with")
+    args = parser.parse_args()
+
+    params = {
+        'ticks': args.ticks,
+        'interval': args.interval,
+        'attackers': args.attackers,
+        'attack_at': args.attack_at,
+        'fg_session': args.fg_session,
+        'unit': args.unit,
+        'w_max': args.w_max,
+        'life_sec': args.life_sec,
+        'seed': args.seed,
+    }
+    result = {
+        'commit': git_head(),
+        'time': time.time(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'scenarios': [],
+    }
+    for n in args.uids or [10, 100, 1000, 4000]:
+        # A fresh process per scenario, so RSS and metrics don't carry over
+        with Pool(1) as pool:
+            scenario = pool.apply(run_scenario, ((n, params),))
+        print("%5d uids: %8.0f ticks/s, cpu/tick mean %.2f ms p99 %.2f ms, rss %d KiB, "
+            "leash latency %s s, benign throttled %d s" % (n, scenario['ticks_per_s'],
+            scenario['cpu_per_tick_s']['mean'] * 1000, scenario['cpu_per_tick_s']['p99'] * 1000,
+            scenario['max_rss_kib'], scenario['leash_latency_s']['max'],
+            scenario['benign_throttled_s']))
+        result['scenarios'].append(scenario)
+    if args.live > 0:
+        result['live'] = run_live(args.live, params)
+        print(" live: %d ticks in %gs, %.1f spawns/min, cpu/tick %s s, rss %d KiB" % (
+            result['live']['ticks'], args.live, result['live']['spawns_per_min'],
+            result['live']['cpu_per_tick_s'], result['live']['max_rss_kib']))
+
+    out = args.out or "bench-monitor-%s.json" % (result['commit'] or "%.0f" % result['time'])
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=1)
+    print("Results: %s" % out)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
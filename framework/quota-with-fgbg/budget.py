@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Activities a tier can be charged by
+FG = 'fg'
+BG = 'bg'
+
+class Tier:
+    """One level of nested slack periods.
+
+    Each period of `period` seconds takes an even share of what is left
+    of its parent period's allotment (pool) over the parent's periods
+    left, and gives back what it did not spend when it ends (if recycle).  The tier charged by an activity
+    (fg: the phone is in use, bg: it is not) tracks the slack against
+    its b_tag every tick and holds the per-UID slack and watermark its
+    UIDs are leashed at: threshold_rate of the period's slack, growing
+    by half of what the device leaves unused.  An uncharged tier only
+    passes its parent's slack down to its children and takes back what
+    they leave; no UID is ever leashed at its watermark.
+    """
+
+    def __init__(self, name, period, threshold_rate, charged_by=None, recycle=True):
+        self.name = name
+        self.period = period
+        self.threshold_rate = threshold_rate
+        self.charged_by = charged_by
+        self.recycle = recycle
+
+        self.start = None
+        self.periods_left = 0
+        self.slack = 0
+        # What is left of the period's allotment to hand to its children
+        self.pool = 0
+        self.threshold = 0
+        self.b_tag = 0
+        self.uid_slack = {}
+        # The period's slack ran out; its writers are held at b_tag
+        self.spent = False
+
+    def state(self):
+        return {'start': self.start, 'periods_left': self.periods_left, 'slack': self.slack,
+            'pool': self.pool,
+            'threshold': self.threshold, 'b_tag': self.b_tag, 'uid_slack': dict(self.uid_slack),
+            'spent': self.spent}
+
+    def restore(self, state):
+        self.start = state['start']
+        self.periods_left = state['periods_left']
+        self.slack = state['slack']
+        self.pool = state['pool']
+        self.threshold = state['threshold']
+        self.b_tag = state['b_tag']
+        self.uid_slack = dict(state.get('uid_slack', {}))
+        self.spent = state.get('spent', False)
+
+class Budget:
+    """The lifetime write budget split over nested tiers of slack periods.
+
+    tiers are (name, period, threshold_rate, charged_by[, recycle]),
+    coarsest first, each period dividing its parent's; the lifetime is
+    the root.  Tiers charged by no activity have to sit above a charged
+    one: below the finest charged tier nothing would ever draw on them.
+    charge() is O(1) whatever the depth: only the tier charged
+    by this tick's activity is touched, and a child's balance reaches its
+    parent when the child's period ends.  advance() is one comparison per
+    tick; the rollovers it triggers walk the tiers only when a period
+    ends, the coarsest due tier and everything below it starting over.
+    b_tag of a tier is the write rate that lasts the rest of the lifetime
+    with the slack held at and above it set aside, as of its last
+    rollover or replan(), which takes a new estimate of the KiB left.
+    """
+
+    def __init__(self, W_max, life_sec, slk_rate, tiers):
+        self.tiers = [tier if isinstance(tier, Tier) else Tier(*tier) for tier in tiers]
+        self.charged = {}
+        for tier in self.tiers:
+            if tier.charged_by is not None:
+                if tier.charged_by in self.charged:
+                    raise ValueError("more than one tier charged by %s" % tier.charged_by)
+                self.charged[tier.charged_by] = tier
+        for activity in (FG, BG):
+            if activity not in self.charged:
+                raise ValueError("no tier charged by %s" % activity)
+        finest = max(self.tiers.index(tier) for tier in self.charged.values())
+        for tier in self.tiers[finest + 1:]:
+            if tier.charged_by is None:
+                raise ValueError("tier %s is charged by nothing and finer than %s" %
+                    (tier.name, self.tiers[finest].name))
+
+        self.life_sec = life_sec
+        self.w_left = W_max
+        # KiB charged since the start, whatever w_left was re-planned to
+        self.written = 0
+        # The root's slack, not handed out to a period yet
+        self.slack_left = W_max * slk_rate
+        self.start = None
+        self.next_rollover = None
+
+    def advance(self, now, log=None):
+        if self.next_rollover is None or now >= self.next_rollover:
+            self.rollover(now, log)
+
+    def rollover(self, now, log=None):
+        if self.start is None:
+            self.start = now
+        first = len(self.tiers)
+        for i, tier in enumerate(self.tiers):
+            if tier.start is None or now - tier.start >= tier.period:
+                first = i
+                break
+        for i in range(first, len(self.tiers)):
+            self.new_period(i, now)
+            if log is not None:
+                tier = self.tiers[i]
+                log("New %s slack period: periods_left %d slack %.2f threshold %.2f b_tag %.2f"
+                    % (tier.name, tier.periods_left, tier.slack, tier.threshold, tier.b_tag))
+        self.next_rollover = min(tier.start + tier.period for tier in self.tiers)
+
+    def new_period(self, i, now):
+        tier = self.tiers[i]
+        if tier.slack > 0 and tier.recycle and tier.start is not None:
+            # recycle remaining slack
+            if i == 0:
+                self.slack_left += tier.slack
+            else:
+                self.tiers[i - 1].slack += tier.slack
+        elif tier.slack < 0 and tier.start is not None:
+            # An overdrawn period is paid for by the ones after it
+            if i == 0:
+                self.slack_left += tier.slack
+            else:
+                self.tiers[i - 1].slack += tier.slack
+        # The last period (or any beyond the lifetime) gets all there is
+        if i == 0:
+            parent_end = self.start + self.life_sec
+            tier.periods_left = max((parent_end - now) / tier.period, 1)
+            tier.slack = max(self.slack_left, 0) / tier.periods_left
+            self.slack_left -= tier.slack
+        else:
+            parent = self.tiers[i - 1]
+            parent_end = parent.start + parent.period
+            tier.periods_left = max((parent_end - now) / tier.period, 1)
+            # An even share of the parent's allotment, drawn from its
+            # slack: what the parent's own charges have spent is not there
+            tier.slack = max(min(parent.pool, parent.slack), 0) / tier.periods_left
+            parent.pool -= tier.slack
+            parent.slack -= tier.slack
+        tier.pool = tier.slack
+        tier.start = now
+        tier.threshold = tier.slack * tier.threshold_rate
+        tier.uid_slack = {}
+        tier.spent = False
+
+        tier.b_tag = self.sustainable(i, now)
+
+    def sustainable(self, i, now):
+        """b_tag of tier i as of now."""
+        held = self.slack_left
+        for above in self.tiers[:i + 1]:
+            held += max(above.slack, 0)
+        life_left = max(self.start + self.life_sec - now, self.tiers[i].period)
+        return (self.w_left - held) / life_left
+
+    def replan(self, w_left, now):
+        """Take a new estimate of the KiB left.  The root's slack keeps
+        its share of the budget and every tier's b_tag follows; periods
+        and per-UID slack carry on."""
+        if self.w_left > 0:
+            self.slack_left *= max(w_left, 0) / self.w_left
+        self.w_left = w_left
+        if self.start is None:
+            return
+        for i in range(len(self.tiers)):
+            if self.tiers[i].start is not None:
+                self.tiers[i].b_tag = self.sustainable(i, now)
+
+    def charge(self, activity, total, dt):
+        """Account a tick of `total` KiB/s to the tier charged by activity."""
+        self.w_left -= total * dt
+        self.written += total * dt
+        tier = self.charged[activity]
+        tier.slack += (tier.b_tag - total) * dt
+        if total < tier.b_tag:
+            tier.threshold += (tier.b_tag - total) * 0.5 * dt
+        return tier
+
+    def state(self):
+        return {'w_left': self.w_left, 'slack_left': self.slack_left, 'start': self.start,
+            'written': self.written, 'tiers': {tier.name: tier.state() for tier in self.tiers}}
+
+    def restore(self, state):
+        """Take a saved budget; tiers not in it start a new period."""
+        self.w_left = state['w_left']
+        self.slack_left = state['slack_left']
+        self.start = state.get('start')
+        self.written = state.get('written', 0)
+        self.next_rollover = None
+        tiers = state.get('tiers', {})
+        for tier in self.tiers:
+            if tier.name in tiers:
+                tier.restore(tiers[tier.name])
+            else:
+                tier.start = None
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import argparse
+import errno
+import os
+
+# Defaults mirror cg2-env.sh
+CG2_ROOT = '/tmp/rl-cg2'
+BLOCK_DEV = '179:0'
+PROC_ROOT = '/proc'
+
+def read_uid(proc_root, pid):
+    """Effective UID of a process, as ps shows it, or None if it is gone."""
+    try:
+        status = open(os.path.join(proc_root, pid, 'status'), 'r')
+    except OSError:
+        return None
+    try:
+        for line in status:
+            if line.startswith('Uid:'):
+                return line.split()[2]
+    except OSError:
+        pass
+    finally:
+        status.close()
+    return None
+
+class UidPidIndex:
+    """UID -> PIDs of a /proc tree, kept up to date incrementally.
+
+    scan() lists the proc root once and reads the Uid: line of every live
+    PID, so a PID that exited and was reused by another UID, or a process
+    that changed its UID after the fork (as zygote children do), is
+    re-indexed under its current UID.  The index itself is only touched
+    for PIDs that appeared, went or changed UID.
+    """
+
+    def __init__(self, proc_root=PROC_ROOT):
+        self.proc_root = proc_root
+        self.pid_uid = {}
+        self.uid_pids = {}
+        self.scans = 0
+
+    def pids(self, uid):
+        return self.uid_pids.get(uid, ())
+
+    def add(self, pid, uid):
+        self.pid_uid[pid] = uid
+        self.uid_pids.setdefault(uid, set()).add(pid)
+
+    def remove(self, pid):
+        uid = self.pid_uid.pop(pid, None)
+        if uid is None:
+            return
+        pids = self.uid_pids[uid]
+        pids.discard(pid)
+        if not pids:
+            del self.uid_pids[uid]
+
+    def scan(self):
+        """Refresh the index; returns the (pid, uid) pairs that appeared
+        or changed UID."""
+        live = set(entry for entry in os.listdir(self.proc_root) if entry.isdigit())
+        for pid in [pid for pid in self.pid_uid if pid not in live]:
+            self.remove(pid)
+        new = []
+        for pid in live:
+            uid = read_uid(self.proc_root, pid)
+            old = self.pid_uid.get(pid)
+            if uid == old:
+                continue
+            if old is not None:
+                self.remove(pid)
+            if uid is not None:
+                self.add(pid, uid)
+                new.append((pid, uid))
+        self.scans += 1
+        return new
+
+class Cgroup2Controller:
+    """Per-UID io.max limits on a cgroup v2 hierarchy, without subprocesses.
+
+    Works as a RateActuator backend: apply() sets wbps in rl-UID/io.max and
+    moves the UID's processes into that group; an unleash sets wbps back to
+    max.  poll() moves processes that were forked by a leashed UID outside
+    its group since the last scan, or that changed to a leashed UID; a
+    reused PID is never taken for the process it replaced.  The cgroup
+    and proc roots can point at a plain directory tree for testing.
+    """
+
+    def __init__(self, root=CG2_ROOT, block_dev=BLOCK_DEV, proc_root=PROC_ROOT):
+        self.root = root
+        self.block_dev = block_dev
+        self.index = UidPidIndex(proc_root)
+        # uid -> limited rate
+        self.limits = {}
+        # uid -> pids already moved into its group
+        self.moved = {}
+
+    def group(self, uid):
+        path = os.path.join(self.root, 'rl-%s' % uid)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def set_io_max(self, uid, rate):
+        io_max = open(os.path.join(self.group(uid), 'io.max'), 'w')
+        io_max.write("%s wbps=%s\n" % (self.block_dev, rate))
+        io_max.close()
+
+    def move(self, uid, pids):
+        moved = self.moved.setdefault(uid, set())
+        pids = [pid for pid in pids if pid not in moved]
+        if not pids:
+            return
+        # Writing a PID moves all of its threads; one PID per write()
+        fd = os.open(os.path.join(self.group(uid), 'cgroup.procs'),
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            for pid in pids:
+                try:
+                    os.write(fd, ("%s\n" % pid).encode())
+                    moved.add(pid)
+                except OSError as e:
+                    if e.errno != errno.ESRCH:
+                        raise
+                    self.index.remove(pid)
+        finally:
+            os.close(fd)
+
+    def apply(self, changes):
+        self.poll()
+        for uid, rate in changes:
+            if rate < 0:
+                self.limits.pop(uid, None)
+                self.moved.pop(uid, None)
+                self.set_io_max(uid, 'max')
+                continue
+            self.limits[uid] = rate
+            self.set_io_max(uid, "%d" % rate)
+            self.move(uid, self.index.pids(uid))
+
+    def poll(self):
+        """Move new processes of leashed UIDs; returns how many moved."""
+        count = 0
+        for pid, uid in self.index.scan():
+            if uid in self.limits:
+                self.move(uid, [pid])
+                count += 1
+        for uid in self.moved:
+            self.moved[uid].intersection_update(self.index.pids(uid))
+        return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Limit a UID through cgroup v2 (cg2-limit-uid.sh)")
+    parser.add_argument('uid')
+    parser.add_argument('rate', type=int, help="bytes/s, -1 to lift the limit")
+    parser.add_argument('--root', default=CG2_ROOT)
+    parser.add_argument('--dev', default=BLOCK_DEV)
+    parser.add_argument('--proc', default=PROC_ROOT)
+    args = parser.parse_args()
+
+    cg2 = Cgroup2Controller(args.root, args.dev, args.proc)
+    cg2.apply([(args.uid, args.rate)])
+    print("UID %s: %d processes in %s" % (args.uid, len(cg2.moved.get(args.uid, ())),
+        cg2.group(args.uid)))
+
+if __name__ == '__main__':
+    main()
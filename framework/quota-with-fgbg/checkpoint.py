@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import json
+import os
+
+# The journal is folded into a new snapshot once it outgrows the snapshot
+# and this many bytes
+MIN_JOURNAL_BYTES = 64 * 1024
+
+_MISSING = object()
+
+def diff_state(old, new, path=(), sets=None, dels=None):
+    """(sets, dels) turning `old` into `new`: [(path, value)] and [path].
+
+    Nested dicts are compared key by key, so a changed UID entry costs
+    one item rather than the whole table.
+    """
+    if sets is None:
+        sets = []
+        dels = []
+    for key, value in new.items():
+        before = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(before, dict):
+            diff_state(before, value, path + (key,), sets, dels)
+        elif before is _MISSING or before != value:
+            sets.append((path + (key,), value))
+    for key in old:
+        if key not in new:
+            dels.append(path + (key,))
+    return sets, dels
+
+def apply_diff(state, sets, dels):
+    for path, value in sets:
+        node = state
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    for path in dels:
+        node = state
+        for key in path[:-1]:
+            node = node.get(key, {})
+        node.pop(path[-1], None)
+
+def fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Checkpoint:
+    """Crash-safe store of a JSON state: a snapshot plus a journal of diffs.
+
+    save() appends what changed since the previous save as one fsync'ed
+    journal line.  Once the journal outgrows the snapshot, the whole state
+    goes to a temporary file renamed over the snapshot and the journal
+    starts over.  Journal lines carry the snapshot generation, so lines
+    from before a compaction that crashed half way are ignored, and a
+    torn last line ends the replay.  The state handed to save() is kept
+    as the reference for the next diff and must not be changed after.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.gen = 0
+        self.written = None
+        self.journal = None
+        self.snapshot_size = 0
+        self.journal_size = 0
+        self.saves = 0
+        self.compactions = 0
+
+    def load(self):
+        """The last saved state, or None if there is none."""
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print("Ignoring unreadable checkpoint %s: %s" % (self.path, e))
+            return None
+        self.gen = snapshot['gen']
+        state = snapshot['state']
+        self.snapshot_size = os.path.getsize(self.path)
+        try:
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if entry['gen'] == self.gen:
+                        apply_diff(state, entry['set'], entry['del'])
+        except FileNotFoundError:
+            pass
+        # The next save() compacts, dropping stale or torn journal lines
+        self.written = None
+        return state
+
+    def save(self, state):
+        self.saves += 1
+        if self.written is None or self.journal_size > max(self.snapshot_size, MIN_JOURNAL_BYTES):
+            self.compact(state)
+            return
+        sets, dels = diff_state(self.written, state)
+        self.written = state
+        if not sets and not dels:
+            return
+        line = json.dumps({'gen': self.gen, 'set': sets, 'del': dels}) + '\n'
+        self.journal.write(line)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_size += len(line)
+
+    def compact(self, state):
+        self.gen += 1
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'gen': self.gen, 'state': state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+            self.snapshot_size = f.tell()
+        os.replace(tmp, self.path)
+        fsync_dir(self.path)
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_path, 'w')
+        self.journal_size = 0
+        self.written = state
+        self.compactions += 1
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# The monitor's control path (DeviceMonitor: diskstats parsing, host-side
+# deltas, quota policy, actuator) in a closed loop with a DeviceModel on a
+# virtual clock: the limits it sets slow the model's apps, which shows in
+# the next snapshots.  By default the lifetime is compressed to the run,
+# with the two-year 88 GiB pro rata as W_max, so the guarantee is checked
+# at its end; at 1 s ticks the loop runs about 4000 virtual s per s.
+# Coarser ticks don't show the policy: a leashed app is let go at every
+# period rollover and writes a whole tick at full rate before it is
+# caught again.
+#
+#	./closed-loop.py -a low-rate=17 -a social=2 -a game=1 -a malicious=1 -d 1
+#
+# With -E the model's flash wears out after that many KiB and reports it
+# like an eMMC, which the policy re-plans its budget on (wear_planning).
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from device_model import DeviceModel
+from device_model import ModelBackend
+from device_model import PROFILES
+from device_model import BACKGROUND_ONLY
+from device_monitor import DeviceMonitor
+from quota_policy import LIFE_SEC
+from wear import parse_health
+
+GIB = 1024 * 1024
+# KiB written over LIFE_SEC, the rate -W defaults to
+LIFE_W_MAX = 88 * GIB
+
+def default_mix():
+    """quota.pl's line-up with one malicious app."""
+    return ['malicious'] + ['low-rate'] * 16 + ['social'] * 2 + ['game']
+
+def report(model, policy, w_max, life_sec):
+    elapsed = model.now
+    written = float(model.delivered_kib.sum())
+    allowed = w_max * elapsed / life_sec
+    summary = {
+        'days': elapsed / 86400,
+        'written_gib': written / GIB,
+        'pro_rata_gib': allowed / GIB,
+        'w_left_gib': policy.w_left / GIB,
+        # Lifetime at the rate written so far, in days
+        'projected_life_days': elapsed * w_max / written / 86400 if written else float('inf'),
+        'leashed': sorted(policy.uid_prison),
+        'profiles': model.summary(),
+    }
+    return summary
+
+def print_report(summary, life_sec):
+    print("day %.1f: written %.2f GiB (pro rata %.2f GiB), w_left %.2f GiB, "
+        "projected life %.0f days (target %.0f), %d leashed" % (summary['days'],
+        summary['written_gib'], summary['pro_rata_gib'], summary['w_left_gib'],
+        summary['projected_life_days'], life_sec / 86400, len(summary['leashed'])))
+    for name, p in sorted(summary['profiles'].items()):
+        print("\t%-10s x%-3d delivered %5.1f%% of %.2f GiB, in fg %5.1f%%" % (name, p['apps'],
+            100 * p['delivered_kib'] / max(p['demand_kib'], 1e-9), p['demand_kib'] / GIB,
+            100 * p['fg_delivered_kib'] / max(p['fg_demand_kib'], 1e-9)))
+
+async def run(model, monitor, args):
+    """Tick until args.days have passed; returns the wear re-plans."""
+    policy = monitor.policy
+    nsecs = args.days * 86400
+    next_report = args.report_days * 86400
+    next_wear = args.wear_interval
+    replans = 0
+    while model.now < nsecs:
+        model.advance(args.interval)
+        await monitor.tick()
+        if args.endurance and model.now >= next_wear:
+            if policy.observe_wear(parse_health(*model.read_health()), model.now) is not None:
+                replans += 1
+            next_wear += args.wear_interval
+        if next_report <= model.now < nsecs:
+            print_report(report(model, policy, args.w_max, args.life_sec), args.life_sec)
+            next_report += args.report_days * 86400
+    return replans
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop quota policy run against a device model")
+    parser.add_argument('-a', '--apps', action='append', default=[],
+        help="PROFILE=COUNT (%s); default quota.pl's line-up with one malicious app"
+            % ", ".join(PROFILES))
+    parser.add_argument('-d', '--days', type=float, default=0.5, help="virtual days to run")
+    parser.add_argument('-i', '--interval', type=float, default=1, help="tick in virtual seconds")
+    parser.add_argument('-u', '--unit', type=float, default=10,
+        help="KiB/s per quota.pl rate unit (malicious writes 100 units)")
+    parser.add_argument('-W', '--w-max', type=float,
+        help="lifetime KiB; default 88 GiB pro rata over the lifetime's share of two years")
+    parser.add_argument('-L', '--life-sec', type=float,
+        help="lifetime in virtual seconds; default the run's")
+    parser.add_argument('-p', '--param', action='append', default=[],
+        help="QuotaPolicy parameter, e.g. forecast_horizon=600")
+    parser.add_argument('-T', '--tiers',
+        help="JSON [[name, period, threshold_rate, charged_by], ...] budget tiers")
+    parser.add_argument('-E', '--endurance', type=float,
+        help="KiB the model's flash is rated for; reports wear to the policy")
+    parser.add_argument('--wear-interval', type=float, default=3600,
+        help="virtual seconds between wear readings")
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-r', '--report-days', type=float, default=30)
+    parser.add_argument('-t', '--trace', help="also record the run as a trace log")
+    parser.add_argument('-o', '--out', help="write the final summary as JSON")
+    args = parser.parse_args()
+    if args.life_sec is None:
+        args.life_sec = args.days * 86400
+    if args.w_max is None:
+        args.w_max = LIFE_W_MAX * args.life_sec / LIFE_SEC
+
+    names = []
+    for item in args.apps:
+        name, count = item.split('=', 1)
+        if name not in PROFILES:
+            print("unknown profile %s" % name, file=sys.stderr)
+            sys.exit(1)
+        names += [name] * int(count)
+    names = names or default_mix()
+
+    params = {}
+    for item in args.param:
+        name, value = item.split('=', 1)
+        params[name] = float(value)
+    if args.tiers:
+        params['tiers'] = json.loads(args.tiers)
+    if args.endurance:
+        params.setdefault('wear_planning', 1)
+    model = DeviceModel(names, args.unit, args.seed, endurance=args.endurance)
+    # The monitor's own per-tick path, fed by the model on its virtual clock
+    monitor = DeviceMonitor('model', args.interval, policy_params=dict(params, W_max=args.w_max,
+        life_sec=args.life_sec), sample=lambda: (model.read_stats(), model.now),
+        fg_uid=model.fg_uid, backend=ModelBackend(model), clock=lambda: model.now,
+        start_time=0, trace=args.trace, trace_meta={'model_apps': names}, rollup_keep=None)
+    policy = monitor.policy
+    print("%d apps (%s), %g KiB/s max, B %.2f KiB/s" % (len(names),
+        ", ".join("%s x%d" % (n, names.count(n)) for n in sorted(set(names))),
+        model.max_kib, args.w_max / args.life_sec))
+
+    started = time.perf_counter()
+    replans = asyncio.run(run(model, monitor, args))
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    summary = report(model, policy, args.w_max, args.life_sec)
+    summary.update({'ticks': monitor.ticks, 'elapsed_s': elapsed,
+        'actuation_calls': monitor.actuator.calls, 'fg_changes': model.fg_changes, 'wear_replans': replans})
+    summary['guarantee_held'] = (summary['projected_life_days'] * 86400 >= args.life_sec * 0.999
+        or summary['written_gib'] <= summary['pro_rata_gib'])
+    print_report(summary, args.life_sec)
+    benign = [p for name, p in summary['profiles'].items() if name not in BACKGROUND_ONLY]
+    if benign:
+        print("benign apps: %.1f%% of demand delivered, %.1f%% in the foreground" % (
+            100 * sum(p['delivered_kib'] for p in benign) / max(sum(p['demand_kib'] for p in benign), 1e-9),
+            100 * sum(p['fg_delivered_kib'] for p in benign) / max(sum(p['fg_demand_kib'] for p in benign), 1e-9)))
+    print("lifetime guarantee %s; %d ticks in %.1fs (%.0f virtual s per s), %d actuation calls" % (
+        "held" if summary['guarantee_held'] else "MISSED",
+        monitor.ticks, elapsed, model.now / max(elapsed, 1e-9), monitor.actuator.calls))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(summary, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Serves a DeviceModel in real time under a fake device root, for the
+# monitor to run against unchanged through fake-adb.sh:
+#
+#	./device-model.py -a low-rate=17 -a game=1 -a malicious=1 /tmp/phone &
+#	FAKE_ADB_ROOT=/tmp/phone ADB=./fake-adb.sh ./monitor-quota-fgbg.py
+#
+# ROOT/proc/diskstats_uid_global is rewritten every second (writing to it
+# resets the counters, as on the phone), ROOT/proc/ratelimit_uid is a FIFO
+# taking "uid rate" lines, the foreground app goes to ROOT/events.log for
+# logcat and to ROOT/fg for dumpsys.  With -E the flash's eMMC life time
+# and pre-EOL files are kept under ROOT/sys for WEAR_SOURCE.  The clock
+# runs at 1x since the monitor integrates over host time; closed-loop.py
+# runs it virtually.
+
+import argparse
+import os
+import shutil
+import signal
+import stat
+import sys
+import time
+from device_model import DeviceModel
+from device_model import PROFILES
+from wear import EMMC_LIFE_TIME
+from wear import EMMC_PRE_EOL
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Device tools (logcat, dumpsys) for fake-adb.sh
+FAKE_BIN = os.path.join(HERE, 'fake-device', 'bin')
+
+POLL_INTERVAL = 0.05
+
+running = True
+
+def stop(sig, frame):
+    global running
+    running = False
+
+class DeviceServer:
+    """Mirrors a DeviceModel into files under root."""
+
+    def __init__(self, model, root):
+        self.model = model
+        self.root = root
+        self.stats_path = os.path.join(root, 'proc', 'diskstats_uid_global')
+        self.rl_path = os.path.join(root, 'proc', 'ratelimit_uid')
+        self.events_path = os.path.join(root, 'events.log')
+        self.fg_path = os.path.join(root, 'fg')
+        self.life_time_path = root + EMMC_LIFE_TIME
+        self.pre_eol_path = root + EMMC_PRE_EOL
+        self.stats_id = None
+        self.rl_buf = ''
+        self.pid = os.getpid()
+
+        os.makedirs(os.path.join(root, 'proc'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'data', 'system'), exist_ok=True)
+        shutil.rmtree(os.path.join(root, 'bin'), ignore_errors=True)
+        shutil.copytree(FAKE_BIN, os.path.join(root, 'bin'))
+        with open(os.path.join(root, 'data', 'system', 'packages.list'), 'w') as f:
+            f.write("\n".join(model.packages()) + "\n")
+        open(self.events_path, 'a').close()
+        if model.endurance:
+            os.makedirs(os.path.dirname(self.life_time_path), exist_ok=True)
+
+        if os.path.exists(self.rl_path) and not stat.S_ISFIFO(os.stat(self.rl_path).st_mode):
+            os.unlink(self.rl_path)
+        if not os.path.exists(self.rl_path):
+            os.mkfifo(self.rl_path)
+        # Keep a writer open so the reader never sees EOF between writers
+        self.rl_fd = os.open(self.rl_path, os.O_RDONLY | os.O_NONBLOCK)
+        self.rl_keep = os.open(self.rl_path, os.O_WRONLY)
+
+        model.on_fg_change = self.on_fg_change
+        self.publish_fg(model.fg_uid())
+        self.publish_stats()
+
+    def close(self):
+        os.close(self.rl_keep)
+        os.close(self.rl_fd)
+
+    def on_fg_change(self, now, fg_uid):
+        lines = []
+        if fg_uid == '-1':
+            lines.append("I/screen_toggled(  %d): 0\n" % self.pid)
+        else:
+            package = self.model.packages()[self.model.uid_index[int(fg_uid)]].split()[0]
+            lines.append("I/screen_toggled(  %d): 1\n" % self.pid)
+            lines.append("I/am_focused_activity(  %d): [0,%s/.Main]\n" % (self.pid, package))
+        with open(self.events_path, 'a') as f:
+            f.write("".join(lines))
+        self.publish_fg(fg_uid)
+
+    def publish_fg(self, fg_uid):
+        with open(self.fg_path + '.tmp', 'w') as f:
+            f.write(fg_uid + "\n")
+        os.replace(self.fg_path + '.tmp', self.fg_path)
+
+    def publish_stats(self):
+        tmp = self.stats_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.model.read_stats())
+        os.replace(tmp, self.stats_path)
+        st = os.stat(self.stats_path)
+        self.stats_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self.model.endurance:
+            self.publish_health()
+
+    def publish_health(self):
+        life_time, pre_eol = self.model.read_health()
+        for path, text in ((self.life_time_path, life_time), (self.pre_eol_path, pre_eol)):
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+
+    def poll_stats_write(self):
+        """A write by anyone else resets the counters."""
+        try:
+            st = os.stat(self.stats_path)
+        except FileNotFoundError:
+            return False
+        if (st.st_ino, st.st_mtime_ns, st.st_size) == self.stats_id:
+            return False
+        self.model.write_stats()
+        return True
+
+    def poll_ratelimit(self):
+        try:
+            data = os.read(self.rl_fd, 65536)
+        except BlockingIOError:
+            return 0
+        self.rl_buf += data.decode('ascii', 'replace')
+        lines = self.rl_buf.split('\n')
+        self.rl_buf = lines.pop()
+        n = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                self.model.write_ratelimit(line)
+                n += 1
+            except ValueError as e:
+                print("ratelimit_uid: %s" % e, file=sys.stderr)
+        return n
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a device model under a fake device root")
+    parser.add_argument('root', help="FAKE_ADB_ROOT (or FAKE_ADB_ROOT/SERIAL) to serve")
+    parser.add_argument('-a', '--apps', action='append', default=[],
+        help="PROFILE=COUNT (%s)" % ", ".join(PROFILES))
+    parser.add_argument('-u', '--unit', type=float, default=10, help="KiB/s per quota.pl rate unit")
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-E', '--endurance', type=float,
+        help="KiB the flash is rated for; publishes its wear under ROOT/sys")
+    args = parser.parse_args()
+
+    names = []
+    for item in args.apps:
+        name, count = item.split('=', 1)
+        if name not in PROFILES:
+            print("unknown profile %s" % name, file=sys.stderr)
+            sys.exit(1)
+        names += [name] * int(count)
+    names = names or ['malicious'] + ['low-rate'] * 16 + ['social'] * 2 + ['game']
+
+    model = DeviceModel(names, args.unit, args.seed, endurance=args.endurance)
+    server = DeviceServer(model, args.root)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print("Serving %d apps under %s" % (len(names), args.root))
+
+    limits = 0
+    start = time.monotonic()
+    while running:
+        limits += server.poll_ratelimit()
+        if server.poll_stats_write():
+            server.publish_stats()
+        due = int(time.monotonic() - start) - model.now
+        if due > 0:
+            model.advance(due)
+            server.publish_stats()
+        time.sleep(POLL_INTERVAL)
+    server.close()
+    print("%d s, %d limit writes, %d fg changes" % (model.now, limits, model.fg_changes))
+
+if __name__ == '__main__':
+    main()
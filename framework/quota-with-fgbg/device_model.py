@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+import numpy
+from diskstats import MAX_STATS_ENTRIES
+from wear import LEVEL_STEPS
+from wear import LEVEL_EXCEEDED
+
+# App write profiles after quota.pl's init_* subs: <rate, sleepy, bg,
+# bg_factor, burst>.  Rates are in quota.pl units, MAX_TPUT being the
+# whole device; `unit` KiB/s per unit scales them to a phone.
+MAX_TPUT = 100
+BURST_SECS = 6
+MAX_SMALL_BURST = 15
+PROFILES = {
+    'low-rate': (0.1, 0.99, 0, 0.5, 0),
+    'social': (0.1, 0, 0.9, 0.2, 0),
+    'camera': (0.5, 0.95, 0, 0, 7),
+    'game': (0.5, 0.2, 0.9, 0.5, 60),
+    'malicious': (MAX_TPUT, 0.0, 1, 1, 0),
+}
+# Profiles that never come to the foreground
+BACKGROUND_ONLY = ('malicious',)
+
+# First app UID, as u0a100
+FIRST_APP_UID = 10100
+# Fraction of foreground sessions with the screen on, and their mean length
+SCREEN_ON = 0.3
+FG_SESSION = 300
+# Fractions of the endurance used at which the flash reports pre-EOL
+# warning (2) and urgent (3)
+PRE_EOL_WARNING = 0.9
+PRE_EOL_URGENT = 0.95
+
+class DeviceModel:
+    """A phone on a virtual clock, as the monitor sees it through /proc.
+
+    Apps write by their profile: the foreground app at its active rate
+    (every BURST_SECS-th second a burst for bursty profiles) unless
+    sleepy, the others at bg_factor of it with probability bg.  The
+    foreground app changes in sessions of fg_session seconds on average,
+    with the screen off for 1 - screen_on of them.  Apps write from their
+    start second on.
+
+    Accounting follows the kernel patch: read_stats() renders
+    /proc/diskstats_uid_global, seq advancing on reads a second or more
+    apart and diffs taken against the counters at the boundary before;
+    write_stats() resets it.  write_ratelimit() takes "uid rate" as
+    /proc/ratelimit_uid does: a UID then gets at most `rate` bytes per
+    second and the rest of that second's demand is dropped, not carried
+    over (it counts as demanded, not delivered); rate -1 lifts the
+    limit and a negative UID lifts all.
+    With an endurance (KiB the flash is rated for), read_health() renders
+    the eMMC life_time and pre_eol_info files from the KiB written.
+    advance() steps whole seconds, vectorized over the apps.
+    """
+
+    def __init__(self, names, unit=10, seed=None, max_tput=MAX_TPUT,
+            fg_session=FG_SESSION, screen_on=SCREEN_ON, endurance=None):
+        n = len(names)
+        params = numpy.array([PROFILES[name] for name in names], dtype=float).reshape(n, 5)
+        self.names = list(names)
+        self.uids = numpy.arange(FIRST_APP_UID, FIRST_APP_UID + n)
+        self.uid_index = {int(uid): i for i, uid in enumerate(self.uids)}
+        self.rate, self.sleepy, self.bg, self.bg_factor, burst = params.T
+        self.burst = burst.astype(int)
+        self.unit = unit
+        self.max_kib = max_tput * unit
+        self.foreground = numpy.array([name not in BACKGROUND_ONLY for name in names])
+        self.fg_session = fg_session
+        self.screen_on = screen_on
+        self.endurance = endurance
+        # Virtual second each app starts writing at, e.g. a late attacker
+        self.start = numpy.zeros(n)
+        self.rng = numpy.random.default_rng(seed)
+
+        # Virtual seconds since boot, and the part of a second not stepped yet
+        self.now = 0
+        self.carry = 0
+        self.fg = -1
+        self.session_left = 0
+        self.fg_changes = 0
+        self.on_fg_change = None
+
+        # uid -> bytes/s; per app cap in KiB/s
+        self.ratelimits = {}
+        self.cap = numpy.full(n, numpy.inf)
+        self.demand_kib = numpy.zeros(n)
+        self.delivered_kib = numpy.zeros(n)
+        self.fg_demand_kib = numpy.zeros(n)
+        self.fg_delivered_kib = numpy.zeros(n)
+
+        # Kernel side: sectors per app, slots in first-write order
+        self.sectors = numpy.zeros(n)
+        self.slots = []
+        self.slotted = numpy.zeros(n, bool)
+        self.seq = 0
+        self.ts_offset = 0
+        self.ts1 = 0
+        self.ts2 = 0
+        self.hist1 = numpy.zeros(n)
+        self.hist2 = numpy.zeros(n)
+
+    def __len__(self):
+        return len(self.names)
+
+    def packages(self):
+        """packages.list lines for the apps."""
+        return ["com.model.%s.app%d %d 0 /data/data/com.model.%s.app%d default 3003" %
+            (name.replace('-', '_'), i, uid, name.replace('-', '_'), i)
+            for i, (name, uid) in enumerate(zip(self.names, self.uids.tolist()))]
+
+    def fg_uid(self):
+        return str(self.uids[self.fg]) if self.fg >= 0 else '-1'
+
+    def fg_seconds(self, n):
+        """Foreground app index for each of the next n seconds."""
+        out = numpy.empty(n, int)
+        candidates = numpy.flatnonzero(self.foreground)
+        i = 0
+        while i < n:
+            if self.session_left <= 0:
+                fg = -1
+                if len(candidates) and self.rng.random() < self.screen_on:
+                    fg = int(self.rng.choice(candidates))
+                self.session_left = max(1, int(self.rng.exponential(self.fg_session)))
+                if fg != self.fg:
+                    self.fg = fg
+                    self.fg_changes += 1
+                    if self.on_fg_change is not None:
+                        self.on_fg_change(self.now + i, self.fg_uid())
+            k = min(self.session_left, n - i)
+            out[i:i + k] = self.fg
+            self.session_left -= k
+            i += k
+        return out
+
+    def advance(self, secs):
+        """Run the apps for secs virtual seconds (fractions carry over)."""
+        self.carry += secs
+        n = int(self.carry)
+        self.carry -= n
+        if n <= 0:
+            return
+        fg = self.fg_seconds(n)
+        is_fg = fg[:, None] == numpy.arange(len(self))[None, :]
+        r = self.rng.random((n, len(self)))
+        active = is_fg & (r >= self.sleepy)
+        in_bg = ~is_fg & (r < self.bg)
+        demand = numpy.where(active, self.rate, numpy.where(in_bg, self.rate * self.bg_factor, 0))
+        second = numpy.arange(self.now, self.now + n)[:, None]
+        burst = active & (self.burst > 0) & (second % BURST_SECS == 0)
+        demand = numpy.where(burst, MAX_SMALL_BURST, demand) * self.unit
+        demand[second < self.start] = 0
+
+        delivered = numpy.minimum(demand, self.cap)
+        total = delivered.sum(axis=1)
+        busy = total > self.max_kib
+        if busy.any():
+            delivered[busy] *= (self.max_kib / total[busy])[:, None]
+        self.demand_kib += demand.sum(axis=0)
+        self.delivered_kib += delivered.sum(axis=0)
+        self.fg_demand_kib += (demand * is_fg).sum(axis=0)
+        self.fg_delivered_kib += (delivered * is_fg).sum(axis=0)
+
+        written = delivered.sum(axis=0)
+        self.sectors += written * 2
+        new = numpy.flatnonzero((written > 0) & ~self.slotted)
+        if len(new):
+            self.slotted[new] = True
+            self.slots.extend(new.tolist())
+        self.now += n
+
+    def read_stats(self):
+        """/proc/diskstats_uid_global as the kernel patch prints it."""
+        uptime = self.now - self.ts_offset
+        new_iter = uptime - self.ts1 >= 1
+        if new_iter:
+            self.ts2 = self.ts1
+            self.ts1 = uptime
+            self.seq += 1
+        lines = ["%u %lu %lu count %d / %d [sane]\n" % (self.seq, uptime, uptime - self.ts2,
+            len(self.slots), MAX_STATS_ENTRIES)]
+        total = 0
+        slots = numpy.array(self.slots, int)
+        if len(slots):
+            sectors = numpy.floor(self.sectors[slots])
+            shown = sectors > 0
+            slots = slots[shown]
+            sectors = sectors[shown]
+            if new_iter:
+                self.hist2[slots] = self.hist1[slots]
+            self.hist1[slots] = sectors
+            diffs = sectors - self.hist2[slots]
+            lines += ["\t%d %lu %lu\n" % row for row in
+                zip(self.uids[slots].tolist(), sectors.astype(numpy.int64).tolist(),
+                    diffs.astype(numpy.int64).tolist())]
+            total = int(sectors.sum())
+        lines.append("\t-1 %lu\n" % total)
+        return "".join(lines)
+
+    def write_stats(self):
+        """Any write resets the counters, seq and clock of the stats file."""
+        self.seq = 0
+        self.ts_offset = self.now
+        self.ts1 = 0
+        self.ts2 = 0
+        self.sectors[:] = 0
+        self.hist1[:] = 0
+        self.hist2[:] = 0
+
+    def write_ratelimit(self, data):
+        """One write to /proc/ratelimit_uid: "uid rate"."""
+        fields = data.split()
+        if len(fields) < 2:
+            raise ValueError("invalid input %r" % data)
+        uid, rate = int(fields[0]), int(float(fields[1]))
+        if uid < 0:
+            self.ratelimits = {}
+            self.cap[:] = numpy.inf
+            return
+        self.ratelimits[uid] = rate
+        i = self.uid_index.get(uid)
+        if i is not None:
+            self.cap[i] = numpy.inf if rate < 0 else rate / 1024
+
+    def read_ratelimit(self):
+        return "".join("%d %d\n" % item for item in self.ratelimits.items())
+
+    def read_health(self):
+        """(life_time, pre_eol_info) as the eMMC driver prints them, None
+        without an endurance."""
+        if not self.endurance:
+            return None
+        used = float(self.delivered_kib.sum()) / self.endurance
+        level = min(int(used * LEVEL_STEPS) + 1, LEVEL_EXCEEDED)
+        pre_eol = 3 if used >= PRE_EOL_URGENT else 2 if used >= PRE_EOL_WARNING else 1
+        return "0x%02x 0x%02x\n" % (level, level), "0x%02x\n" % pre_eol
+
+    def summary(self):
+        """Demand and delivered KiB per profile, total and in the foreground."""
+        out = {}
+        for name in sorted(set(self.names)):
+            sel = numpy.array([n == name for n in self.names])
+            out[name] = {
+                'apps': int(sel.sum()),
+                'demand_kib': float(self.demand_kib[sel].sum()),
+                'delivered_kib': float(self.delivered_kib[sel].sum()),
+                'fg_demand_kib': float(self.fg_demand_kib[sel].sum()),
+                'fg_delivered_kib': float(self.fg_delivered_kib[sel].sum()),
+            }
+        return out
+
+class ModelBackend:
+    """RateActuator backend writing a DeviceModel's /proc/ratelimit_uid."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def apply(self, changes):
+        for uid, rate in changes:
+            self.model.write_ratelimit("%s %d\n" % (uid, rate))
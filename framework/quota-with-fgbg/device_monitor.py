@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import threading
+import time
+from subprocess import run
+from subprocess import PIPE
+import metrics
+from actuator import RateActuator
+from actuator import AdbProcBackend
+from adb_stream import StatsSampler
+from checkpoint import Checkpoint
+from diskstats import parse_snapshot
+from diskstats import DeltaEngine
+from fg_tracker import FgTracker
+from pipeline import Latest
+from pipeline import Stage
+from pipeline import drain_actuations
+from quota_policy import QuotaPolicy
+from rollup import Rollups
+from rollup import KEEP_SECONDS
+from rollup import KEEP_MINUTES
+from rollup import KEEP_HOURS
+from trace_log import TraceWriter
+from wear import wear_source
+
+UID_DKSTATS = '/proc/diskstats_uid_global'
+FG_PROBE_CMD = './adb-get-fg-uid-screen.sh'
+
+def file_sampler(path, clock=time.monotonic):
+    """sample() reading a local stats file, for monitors on the device."""
+    f = open(path, 'r')
+
+    def sample():
+        f.seek(0)
+        return f.readlines(), clock()
+    return sample
+
+class DeviceMonitor:
+    """Quota monitoring of one phone, addressed by its adb serial.
+
+    Holds everything the monitor keeps for a device: the stats stream, fg
+    tracker, policy, actuator and a trace log tagged with the serial.
+    Devices share the caller's event loop and tick; tick() takes the
+    freshest frame and process() steps the policy on it and queues the
+    limit changes for this device's own actuation task, so a slow or hung
+    phone only delays itself.  Counters and phase timers are the device's
+    own (stats, a metrics.Metrics unless given).  With a checkpoint path
+    the policy state is saved every checkpoint_interval seconds, on a
+    thread once started, and resumed from it, leashes included, when the
+    monitor starts again.  With a rollup path the Rollups history is
+    saved there every rollup_interval seconds, on a thread once started,
+    and resumed from it.  With a wear source ('adb' or 'adb-ufs') the
+    flash's health is read every wear_interval seconds and the policy
+    re-plans its budget on it.
+
+    The stats source (sample, a function returning the lines and their
+    clock() time), foreground source (fg_uid), actuation backend and clock
+    can be swapped for local files or a DeviceModel.  Without start()
+    nothing runs in the background and process() applies the limit changes
+    itself, which is how the model runs drive it.
+    """
+
+    def __init__(self, serial, interval, prefix='', policy_params=None,
+            service_table=None, whitelist=(), sample_wait=None,
+            fg_timeout=5, actuate_timeout=2, verbose=False, checkpoint=None,
+            checkpoint_interval=10, rollup=None, rollup_interval=600, wear=None,
+            wear_interval=3600, policy=None, sample=None, sample_timeout=None,
+            fg_uid=None, fg_poll=None, backend=None, clock=time.monotonic,
+            start_time=None, trace=True, trace_meta=None, log_interval=0,
+            rollup_keep=(KEEP_SECONDS, KEEP_MINUTES, KEEP_HOURS), uid_written=None,
+            record_only=False, stats=None):
+        self.serial = serial
+        self.interval = interval
+        # This device's counters and phase timers; spawns are process-wide
+        self.stats = metrics.Metrics() if stats is None else stats
+        self.sample_wait = interval / 2 if sample_wait is None else sample_wait
+        self.sample_timeout = 5 * interval if sample_timeout is None else sample_timeout
+        self.whitelist = set(whitelist)
+        self.verbose = verbose
+        self.record_only = record_only
+        self.sample = sample
+        self.sampler = None
+        if sample is None:
+            self.sampler = StatsSampler(UID_DKSTATS, interval, serial)
+        self.fg_tracker = None
+        self.fg_uid = fg_uid
+        self.fg_poll = fg_poll
+        self.polled_fg_uid = '-1'
+        tag = '-%s' % serial if serial else ''
+        self.fg_stage = Stage('fg' + tag, fg_timeout)
+        self.actuate_stage = Stage('actuate' + tag, actuate_timeout)
+        self.wear_stage = Stage('wear' + tag, fg_timeout)
+        self.wear_source = wear_source(wear, serial) if wear else None
+        self.wear_interval = wear_interval
+        self.wear_replans = 0
+        if policy is None:
+            params = {'wear_planning': wear is not None}
+            params.update(policy_params or {})
+            policy = QuotaPolicy(service_table=service_table, verbose=verbose, **params)
+        self.policy = policy
+        self.actuator = RateActuator(AdbProcBackend(serial) if backend is None else backend)
+        # Cgroup2Controller catches forks into leashed UIDs before each apply
+        self.backend_poll = getattr(self.actuator.backend, 'poll', None)
+
+        self.clock = clock
+        self.start_time = time.time() if start_time is None else start_time
+        self.start_monotonic = clock()
+        self.trace_file = None
+        self.trace = None
+        if trace:
+            if trace is True:
+                trace = "%s%s-trace-%.0f.qtr" % (prefix, serial, self.start_time)
+            self.trace_file = trace
+            meta = dict(policy_params or {})
+            meta.update({'interval': interval, 'serial': serial,
+                'service_table': service_table or {}, 'clock': 'monotonic',
+                'start_time': self.start_time, 'wear_source': wear})
+            meta.update(trace_meta or {})
+            self.trace = TraceWriter(self.trace_file, meta)
+
+        self.latest = None
+        self.version = 0
+        self.queue = None
+        self.tasks = []
+        self.deltas = DeltaEngine()
+        self.uid_str = {}
+        # Last cumulative sectors of each UID, idle ones included
+        self.uid_sectors = {}
+        # KiB each UID wrote since it was first seen, if kept
+        self.uid_written = uid_written
+        self.last_sample_time = None
+        self.last_tick_time = None
+        self.restored_time = None
+        self.log_limiter = metrics.RateLimiter(log_interval)
+        self.checkpoint = None
+        self.checkpoint_limiter = metrics.RateLimiter(checkpoint_interval)
+        # Saves fsync; once started they run on a thread, one at a time
+        self.checkpoint_stage = Stage('checkpoint' + tag, max(checkpoint_interval, interval))
+        self.checkpoint_lock = threading.Lock()
+        self.checkpoint_task = None
+        if checkpoint:
+            self.checkpoint = Checkpoint(checkpoint)
+            state = self.checkpoint.load()
+            if state is not None:
+                self.policy.restore(state['policy'])
+                self.deltas.restore(state['deltas'])
+                if self.uid_written is not None:
+                    self.uid_written = state['uid_written']
+                self.restored_time = state['time']
+        self.rollup_file = rollup
+        self.rollup_limiter = metrics.RateLimiter(rollup_interval)
+        # A save still running when the next is due skips that one
+        self.rollup_stage = Stage('rollup' + tag, rollup_interval)
+        self.rollup_task = None
+        self.rollups = None
+        self.rollups_resumed = False
+        if rollup_keep:
+            self.rollups = Rollups(*rollup_keep)
+            if rollup:
+                self.rollups_resumed = self.rollups.load(rollup)
+        self.ticks = 0
+        self.missed = 0
+        self.policy_actions = 0
+
+    def probe_fg(self):
+        metrics.counters['spawns'] += 1
+        env = dict(os.environ)
+        if self.serial:
+            env['ANDROID_SERIAL'] = self.serial
+        return run([FG_PROBE_CMD], stdout=PIPE, env=env).stdout.decode('utf-8')
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.latest = Latest()
+        self.queue = asyncio.Queue()
+        # Leashes resumed from a checkpoint go out before the first tick
+        changes = self.actuator.plan(self.policy.uid_prison)
+        if changes:
+            self.queue.put_nowait(changes)
+        if self.sampler is not None:
+            self.sampler.on_frame = lambda lines, arrival: loop.call_soon_threadsafe(
+                self.latest.publish, (lines, arrival))
+            self.sampler.start()
+            self.tasks.append(asyncio.create_task(self.sample_watchdog()))
+        if self.fg_uid is None:
+            try:
+                initial_uid = await self.fg_stage.call(self.probe_fg)
+            except asyncio.TimeoutError:
+                initial_uid = '-1'
+            if self.fg_poll:
+                self.polled_fg_uid = initial_uid.strip() or '-1'
+                self.fg_uid = lambda: self.polled_fg_uid
+                self.tasks.append(asyncio.create_task(self.poll_fg()))
+            else:
+                self.fg_tracker = FgTracker(self.serial, initial_uid)
+                self.fg_tracker.start()
+                self.fg_uid = self.fg_tracker.current
+                if self.policy.services is not None:
+                    self.policy.services.hint_packages(self.fg_tracker.packages)
+        self.tasks.append(asyncio.create_task(drain_actuations(self.queue,
+            self.actuate_stage, self.actuator, self.backend_poll, self.stats)))
+        if self.wear_source is not None:
+            self.tasks.append(asyncio.create_task(self.poll_wear()))
+
+    async def sample_watchdog(self):
+        """Restart the adb stats stream when it stops delivering frames."""
+        version = 0
+        while True:
+            try:
+                _, version = await self.latest.wait_newer(version, self.sample_timeout)
+            except asyncio.TimeoutError:
+                self.stats.counters['sample_timeouts'] += 1
+                print("No stats frame from %s for %gs, restarting the stream" % (
+                    self.serial or 'the device', self.sample_timeout))
+                self.sampler.stream.restart()
+
+    async def poll_fg(self):
+        """Foreground UID by probing every fg_poll seconds, without events."""
+        while True:
+            await asyncio.sleep(self.fg_poll)
+            try:
+                self.polled_fg_uid = (await self.fg_stage.call(self.probe_fg)).strip() or '-1'
+            except asyncio.TimeoutError:
+                print("Foreground UID probe timed out, keeping %s" % self.polled_fg_uid)
+
+    async def poll_wear(self):
+        while True:
+            try:
+                reading = await self.wear_stage.call(self.wear_source.read)
+            except asyncio.TimeoutError:
+                print("Wear reading timed out")
+                reading = None
+            if reading is not None and self.last_tick_time is not None:
+                w_left = self.policy.observe_wear(reading, self.last_tick_time)
+                if w_left is not None:
+                    self.wear_replans += 1
+                    self.stats.counters['wear_replans'] += 1
+                    print("Wear level %d pre-EOL %d: re-planned w_left to %.2f GiB" %
+                        (reading[0], reading[1], w_left/1024/1024))
+            await asyncio.sleep(self.wear_interval)
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.sampler is not None:
+            self.sampler.on_frame = None
+            self.sampler.stop()
+        if self.fg_tracker is not None:
+            self.fg_tracker.stop()
+        if self.trace is not None:
+            self.trace.close()
+        if self.checkpoint is not None:
+            if self.last_tick_time is not None:
+                self.save_checkpoint()
+            self.checkpoint.close()
+        if self.rollup_file and self.rollups is not None:
+            self.rollups.save(self.rollup_file)
+
+    def checkpoint_state(self):
+        state = {
+            'time': self.last_tick_time,
+            'policy': self.policy.state(),
+            'deltas': self.deltas.state(),
+        }
+        if self.uid_written is not None:
+            state['uid_written'] = dict(self.uid_written)
+        return state
+
+    def save_checkpoint(self, state=None):
+        with self.checkpoint_lock:
+            self.checkpoint.save(self.checkpoint_state() if state is None else state)
+
+    async def write_checkpoint(self, state):
+        """save_checkpoint() off the loop; a slow fsync would stall every
+        device's tick."""
+        try:
+            await self.checkpoint_stage.call(self.save_checkpoint, state)
+        except (asyncio.TimeoutError, OSError) as e:
+            print("Saving the checkpoint to %s failed (%s)" % (self.checkpoint.path,
+                str(e) or "timeout"))
+
+    async def save_rollups(self, snapshot):
+        """Write a Rollups.snapshot() off the loop; the JSON of two years
+        of hours would stall every device's tick."""
+        try:
+            await self.rollup_stage.call(self.rollups.write, snapshot, self.rollup_file)
+        except (asyncio.TimeoutError, OSError) as e:
+            print("Saving rollups to %s failed (%s)" % (self.rollup_file, str(e) or "timeout"))
+
+    async def tick(self):
+        """One tick on the freshest stats frame; False if there was none."""
+        t = metrics.now()
+        if self.sample is not None:
+            lines, sample_time = self.sample()
+        else:
+            try:
+                (lines, sample_time), self.version = await self.latest.wait_newer(
+                    self.version, self.sample_wait)
+            except asyncio.TimeoutError:
+                self.missed += 1
+                return False
+        self.stats.lap('sample', t)
+        return self.process(lines, sample_time)
+
+    def process(self, lines, sample_time):
+        """Step the policy on one stats frame read at clock() sample_time."""
+        t = metrics.now()
+        try:
+            snap = parse_snapshot(lines)
+        except ValueError as e:
+            if self.verbose:
+                print(e)
+            self.missed += 1
+            return False
+        t = self.stats.lap('parse', t)
+        self.ticks += 1
+        log_tick = self.verbose and self.log_limiter.ready()
+        self.policy.verbose = log_tick
+        # Integrate over the host time between samples; the kernel's
+        # timestamp_diff only has whole seconds
+        now = self.start_time + sample_time - self.start_monotonic
+        if self.last_sample_time is not None:
+            dt = sample_time - self.last_sample_time
+        elif self.restored_time is not None:
+            # Writes while the monitor was down are charged now
+            dt = max(now - self.restored_time, self.interval)
+        else:
+            dt = self.interval
+        self.last_sample_time = sample_time
+        self.last_tick_time = now
+
+        delta = self.deltas.update(snap)
+        if self.deltas.status == 'first':
+            # No reference yet, the kernel's diffs cover its own window
+            bw = delta / 2 / max(snap.ts_diff, 1)
+        else:
+            bw = delta / 2 / dt
+        if log_tick:
+            print("seq %d timestamp %lu diff %lu %s" % (snap.seq, snap.uptime, snap.ts_diff,
+                self.deltas.status))
+            print("total %lu" % (snap.total or 0))
+        elif self.verbose and self.deltas.status == 'reset':
+            print("UID stats were reset")
+
+        # Only the UIDs that wrote or just showed up; the policy keeps
+        # track of the idle ones it still charges
+        uid_throughput = {}
+        uid_written = self.uid_written
+        rows = self.deltas.active_rows(delta)
+        for _uid, sectors, uid_bw, written in zip(snap.uids[rows].tolist(),
+                snap.sectors[rows].tolist(), bw[rows].tolist(), delta[rows].tolist()):
+            uid = self.uid_str.get(_uid)
+            if uid is None:
+                uid = self.uid_str[_uid] = str(_uid)
+            if uid_written is not None and written:
+                uid_written[uid] = uid_written.get(uid, 0) + written / 2
+            if uid in self.whitelist:
+                continue
+            self.uid_sectors[uid] = sectors
+            uid_throughput[uid] = uid_bw
+        self.stats.counters['uids'] += len(uid_throughput)
+        t = self.stats.lap('delta', t)
+
+        fg_uid = self.fg_uid()
+        if self.record_only:
+            # Throughput only, no policy and no limits
+            if self.trace is not None:
+                self.trace.add_tick((self.ticks, now, -1, sum(uid_throughput.values()),
+                    0, 0, 0, 0, 0, 0, self.policy.w_left, 0),
+                    [(int(uid), uid_bw, self.uid_sectors[uid], 0, 0, -1)
+                        for uid, uid_bw in uid_throughput.items()])
+            return True
+
+        self.policy_actions += len(self.policy.step(now, uid_throughput, fg_uid, dt))
+        t = self.stats.lap('policy', t)
+        if self.queue is None:
+            changes = self.actuator.sync(self.policy.uid_prison)
+        else:
+            changes = self.actuator.plan(self.policy.uid_prison)
+            if changes or self.backend_poll is not None and self.actuator.applied:
+                self.queue.put_nowait(changes)
+        t = self.stats.lap('actuate', t)
+        policy = self.policy
+        if self.trace is not None:
+            policy.trace_tick(self.trace, now, fg_uid, uid_throughput, self.uid_sectors)
+            t = self.stats.lap('trace', t)
+        if self.rollups is not None:
+            self.rollups.add(now, dt, policy.total_fg, policy.total_bg, policy.tick_state[2],
+                policy.tick_state[3], policy.w_left, policy.uid_active, policy.uid_prison)
+            if self.rollup_file and not self.rollup_stage.busy and self.rollup_limiter.ready():
+                if self.queue is None:
+                    self.rollups.save(self.rollup_file)
+                else:
+                    self.rollup_task = asyncio.get_running_loop().create_task(
+                        self.save_rollups(self.rollups.snapshot()))
+            t = self.stats.lap('rollup', t)
+        if self.checkpoint is not None and (self.checkpoint_task is None or
+                self.checkpoint_task.done()) and self.checkpoint_limiter.ready():
+            if self.queue is None:
+                self.save_checkpoint()
+            else:
+                self.checkpoint_task = asyncio.get_running_loop().create_task(
+                    self.write_checkpoint(self.checkpoint_state()))
+            t = self.stats.lap('checkpoint', t)
+        if log_tick:
+            print("Actuation: %d changes this tick; %d calls for %d policy actions so far"
+                % (len(changes), self.actuator.calls, self.policy_actions))
+            for tier in policy.budget.tiers:
+                print("Finished one cycle: %s periods_left %d slack %.2f threshold %.2f b_tag %.2f"
+                    % (tier.name, tier.periods_left, tier.slack, tier.threshold, tier.b_tag))
+            print("Finished one cycle: iter_total_throughput_fg %.2f iter_total_throughput_bg %.2f"
+                % (policy.total_fg, policy.total_bg))
+            self.stats.lap('log', t)
+        return True
+
+    def summary(self):
+        return {
+            'serial': self.serial,
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'stats_resets': self.deltas.resets,
+            'seq_gaps': self.deltas.gaps,
+            'w_left': self.policy.w_left,
+            'leashed': sorted(self.policy.uid_prison),
+            'policy_actions': self.policy_actions,
+            'actuation_calls': self.actuator.calls,
+            'stage_timeouts': self.fg_stage.timeouts + self.actuate_stage.timeouts +
+                self.wear_stage.timeouts + self.rollup_stage.timeouts +
+                self.checkpoint_stage.timeouts,
+            'wear_replans': self.wear_replans,
+            'trace': self.trace_file,
+            'resumed': self.restored_time is not None,
+            'rollups': self.rollups.sizes() if self.rollups is not None else None,
+            'services': self.policy.services.learned() if self.policy.services is not None else None,
+            'metrics': self.stats.snapshot(),
+        }
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import numpy
+
+MAX_STATS_ENTRIES = 4001
+
+class Snapshot:
+    """One read of /proc/diskstats_uid_global as arrays.
+
+    Header: seq, uptime and ts_diff in seconds since the last reset, the
+    allocated slot count and whether slots collided.  uids, sectors and
+    diffs hold one entry per UID in the kernel's slot order; sectors are
+    cumulative since the last reset, diffs the kernel's own per-second
+    window over ts_diff.
+    """
+
+    def __init__(self, seq, uptime, ts_diff, count, max_entries, sane,
+            uids, sectors, diffs, total):
+        self.seq = seq
+        self.uptime = uptime
+        self.ts_diff = ts_diff
+        self.count = count
+        self.max_entries = max_entries
+        self.sane = sane
+        self.uids = uids
+        self.sectors = sectors
+        self.diffs = diffs
+        self.total = total
+
+    def __len__(self):
+        return len(self.uids)
+
+def parse_snapshot(data):
+    """Parse a snapshot given as its text or as a list of lines.
+
+    The body is converted in a single numpy.array() pass over its fields.
+    Raises ValueError on a malformed or torn snapshot: the kernel ends
+    every read with a "-1 total" line, prints at most `count` rows (UIDs
+    with no sectors are left out) and the total is their sum, so a frame
+    cut off anywhere, trailer included, doesn't add up.  A frame with
+    nothing in it (the cat on the device failed) is malformed too.
+    """
+    if not data:
+        raise ValueError("empty diskstats_uid_global snapshot")
+    if isinstance(data, str):
+        header, _, body = data.partition('\n')
+    else:
+        header = data[0]
+        body = "".join(data[1:])
+    fields = header.split()
+    if len(fields) < 8 or fields[3] != 'count':
+        raise ValueError("bad diskstats_uid_global header: %r" % header)
+
+    values = numpy.array(body.split(), dtype=numpy.int64)
+    if len(values) % 3 != 2 or values[-2] != -1:
+        raise ValueError("torn diskstats_uid_global body")
+    total = int(values[-1])
+    rows = values[:-2].reshape(-1, 3)
+    count = int(fields[4])
+    if len(rows) > count:
+        raise ValueError("%d diskstats_uid_global rows for count %d" % (len(rows), count))
+    sectors = rows[:, 1].astype(numpy.uint64)
+    if int(sectors.sum()) != total:
+        raise ValueError("diskstats_uid_global total %d is not the sum of its rows" % total)
+    return Snapshot(int(fields[0]), int(fields[1]), int(fields[2]), count,
+        int(fields[6]), fields[7] == '[sane]',
+        rows[:, 0], sectors, rows[:, 2].astype(numpy.uint64), total)
+
+class DeltaEngine:
+    """Per-UID sectors written between consecutive snapshots.
+
+    Deltas come from the cumulative counters, so dropped samples or extra
+    readers (which bump seq) lose nothing.  A reset (the proc file was
+    written, seq and uptime start over) counts everything since it; a
+    counter that goes backwards is taken as a wrap of a wrap_bits wide
+    counter if that makes its delta less than half the range, otherwise
+    as a reset of that UID.
+    The first snapshot has no reference and yields the kernel's diffs.
+    new_rows are the rows of UIDs the reference did not have (all of them
+    after a reset); active_rows() adds the rows that wrote, which is all
+    a tick has to look at.
+    """
+
+    def __init__(self, wrap_bits=64):
+        self.mask = numpy.uint64((1 << wrap_bits) - 1)
+        self.half = numpy.uint64(1 << (wrap_bits - 1))
+        self.uids = None
+        self.sectors = None
+        self.order = None
+        self.next_order = None
+        self.seq = None
+        self.uptime = None
+        self.status = None
+        self.new_rows = numpy.zeros(0, dtype=numpy.int64)
+        self.gaps = 0
+        self.resets = 0
+        self.wraps = 0
+
+    def state(self):
+        """The reference snapshot as a JSON-able dict, None before the first."""
+        if self.seq is None:
+            return None
+        return {'seq': self.seq, 'uptime': self.uptime,
+            'sectors': dict(zip(map(str, self.uids.tolist()), self.sectors.tolist()))}
+
+    def restore(self, state):
+        """Take a saved reference, so the next delta covers the time since.
+
+        The UIDs come back sorted rather than in slot order; the first
+        update takes the merge path once.
+        """
+        if not state:
+            return
+        uids = sorted(state['sectors'], key=int)
+        self.uids = numpy.array([int(uid) for uid in uids], dtype=numpy.int64)
+        self.sectors = numpy.array([state['sectors'][uid] for uid in uids], dtype=numpy.uint64)
+        self.order = None
+        self.seq = state['seq']
+        self.uptime = state['uptime']
+
+    def previous(self, uids):
+        """Previous sectors of each UID, 0 for UIDs not seen then."""
+        if len(uids) == len(self.uids) and numpy.array_equal(uids, self.uids):
+            self.new_rows = numpy.zeros(0, dtype=numpy.int64)
+            return self.sectors
+        # Merge in sorted order; searching with sorted keys stays in cache
+        if self.order is None:
+            self.order = numpy.argsort(self.uids)
+        prev_uids = self.uids[self.order]
+        order = numpy.argsort(uids)
+        idx = numpy.searchsorted(prev_uids, uids[order])
+        idx[idx == len(prev_uids)] = 0
+        prev = numpy.zeros(len(uids), dtype=numpy.uint64)
+        if len(prev_uids):
+            found = prev_uids[idx] == uids[order]
+            prev[order[found]] = self.sectors[self.order[idx[found]]]
+            self.new_rows = numpy.sort(order[~found])
+        else:
+            self.new_rows = numpy.arange(len(uids))
+        self.next_order = order
+        return prev
+
+    def update(self, snap):
+        if self.seq is None:
+            self.status = 'first'
+            self.new_rows = numpy.arange(len(snap))
+            delta = snap.diffs
+        elif snap.seq < self.seq or snap.uptime < self.uptime:
+            self.status = 'reset'
+            self.resets += 1
+            self.new_rows = numpy.arange(len(snap))
+            delta = snap.sectors
+        else:
+            self.status = 'ok'
+            if snap.seq > self.seq + 1:
+                self.status = 'gap'
+                self.gaps += 1
+            prev = self.previous(snap.uids)
+            delta = (snap.sectors - prev) & self.mask
+            backwards = snap.sectors < prev
+            if backwards.any():
+                wrapped = backwards & (delta < self.half)
+                self.wraps += int(wrapped.sum())
+                delta = numpy.where(backwards & ~wrapped, snap.sectors, delta)
+
+        if self.uids is None or not numpy.array_equal(snap.uids, self.uids):
+            self.order = self.next_order
+        self.next_order = None
+        self.uids = snap.uids
+        self.sectors = snap.sectors
+        self.seq = snap.seq
+        self.uptime = snap.uptime
+        return delta
+
+    def active_rows(self, delta):
+        """Rows of the last update that wrote or are new, in slot order."""
+        rows = numpy.flatnonzero(delta)
+        if len(self.new_rows):
+            rows = numpy.union1d(rows, self.new_rows)
+        return rows
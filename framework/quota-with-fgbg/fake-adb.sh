@@ -0,0 +1,51 @@
+#!/bin/bash
+
+# Local stand-in for adb: runs "shell"/"exec-out" commands on the host,
+# with device /proc, /data and /sys paths redirected under $FAKE_ADB_ROOT
+# (per serial when -s is given).  Device tools such as logcat are looked up
+# in $FAKE_ADB_ROOT/bin first.
+#
+#	ADB=./fake-adb.sh ./monitor-quota-fgbg.py
+
+FAKE_ADB_ROOT=${FAKE_ADB_ROOT:-./fake-device}
+
+SERIAL=$ANDROID_SERIAL
+
+while [ $# -gt 0 ]
+do
+	case "$1" in
+	-s)
+		SERIAL=$2
+		shift 2
+		;;
+	shell|exec-out)
+		shift
+		break
+		;;
+	*)
+		echo "fake-adb: unsupported command $1" >&2
+		exit 1
+		;;
+	esac
+done
+
+DEVICE_ROOT=$FAKE_ADB_ROOT
+if [ -n "$SERIAL" ]
+then
+	DEVICE_ROOT=$FAKE_ADB_ROOT/$SERIAL
+fi
+
+CMD="$*"
+CMD=${CMD//\/proc\//$DEVICE_ROOT\/proc\/}
+CMD=${CMD//\/data\//$DEVICE_ROOT\/data\/}
+CMD=${CMD//\/sys\//$DEVICE_ROOT\/sys\/}
+CMD=${CMD//su -c /sh -c }
+
+export FAKE_DEVICE_ROOT=$DEVICE_ROOT
+export PATH=$DEVICE_ROOT/bin:$PATH
+
+if [ -z "$CMD" ]
+then
+	exec sh
+fi
+exec sh -c "$CMD"
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import time
+from subprocess import run
+from subprocess import PIPE
+from subprocess import DEVNULL
+from adb_stream import AdbStream
+from adb_stream import adb_cmd
+from metrics import counters
+
+PACKAGES_LIST = '/data/system/packages.list'
+
+# -T 1: start at the newest entry instead of replaying the whole buffer
+LOGCAT_CMD = ("logcat -b events -v brief -T 1 "
+    "am_focused_activity:I am_resume_activity:I screen_toggled:I *:S")
+
+# I/am_focused_activity(  875): [0,com.android.chrome/.Main]
+# Android 8+ adds a reason after the component, am_resume_activity has
+# the token and task before it: [0,123,45,com.android.chrome/.Main]
+EVENT_RE = re.compile(r'^\w/(\w+)\(\s*\d+\):\s*(.*)$')
+
+PER_USER_RANGE = 100000
+
+# Seconds between re-reads of packages.list for packages it doesn't have
+PACKAGES_REFETCH_INTERVAL = 30
+
+class FgTracker:
+    """Foreground UID fed by the activity manager's event log.
+
+    One logcat stream is parsed incrementally; am_focused_activity and
+    am_resume_activity move the focus, screen_toggled blanks it.  The
+    current value is a plain attribute, so current() costs no I/O.
+    initial_uid is the probe's answer: '-1' for screen off, empty when it
+    could not tell, which leaves the screen unknown until the first event.
+    A package missing from packages.list re-reads it at most every
+    PACKAGES_REFETCH_INTERVAL seconds.
+    """
+
+    def __init__(self, serial=None, initial_uid='-1'):
+        self.serial = serial
+        self.packages = {}
+        # Packages not in packages.list as of the last read
+        self.unknown = set()
+        self.fetch_time = None
+        initial_uid = initial_uid.strip()
+        if not initial_uid:
+            self.screen_on = None
+            initial_uid = '-1'
+        else:
+            self.screen_on = initial_uid != '-1'
+        self.fg_uid = initial_uid
+        self.focused_uid = initial_uid
+        self.events = 0
+        self.stream = AdbStream(LOGCAT_CMD, self._on_line, serial)
+
+    def start(self):
+        self.fetch_packages()
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
+
+    def current(self):
+        return self.fg_uid
+
+    def fetch_packages(self):
+        self.fetch_time = time.monotonic()
+        self.unknown = set()
+        counters['spawns'] += 1
+        out = run(adb_cmd(self.serial) + ['exec-out', "su -c 'cat %s'" % PACKAGES_LIST],
+            stdout=PIPE, stderr=DEVNULL).stdout.decode('utf-8', 'replace')
+        self.load_packages(out.splitlines())
+
+    def load_packages(self, lines):
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 2 or not fields[1].isdigit():
+                continue
+            self.packages[fields[0]] = int(fields[1])
+
+    def component_uid(self, payload):
+        fields = payload.strip().strip('[]').split(',')
+        if len(fields) < 2 or not fields[0].isdigit():
+            return None
+        components = [field for field in fields[1:] if '/' in field]
+        if not components:
+            return None
+        package = components[0].split('/')[0].strip()
+        if package not in self.packages:
+            # Installed after we started
+            if (self.fetch_time is None or
+                    time.monotonic() - self.fetch_time >= PACKAGES_REFETCH_INTERVAL):
+                self.fetch_packages()
+            if package not in self.packages:
+                if package not in self.unknown:
+                    self.unknown.add(package)
+                    print("fg tracker: unknown package %s" % package, file=sys.stderr)
+                return None
+        return str(int(fields[0]) * PER_USER_RANGE + self.packages[package] % PER_USER_RANGE)
+
+    def _on_line(self, line):
+        m = EVENT_RE.match(line)
+        if m is None:
+            return
+        tag, payload = m.groups()
+        if tag == 'screen_toggled':
+            self.screen_on = payload.strip() != '0'
+        else:
+            uid = self.component_uid(payload)
+            if uid is None:
+                return
+            self.focused_uid = uid
+            if self.screen_on is None:
+                # Something got the focus, so the screen is on
+                self.screen_on = True
+        self.events += 1
+        self.fg_uid = self.focused_uid if self.screen_on else '-1'
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import math
+
+# Time constants (seconds) of the fast and slow per-UID rate averages
+FAST_TAU = 5
+SLOW_TAU = 120
+
+class BurstForecaster:
+    """Per-UID write rate forecast from a fast and a slow EWMA.
+
+    The fast average catches a burst within a few samples, the slow one
+    keeps a steady writer's rate through short pauses; the forecast is the
+    larger of the two.  Averages decay by exp(-dt / tau), so uneven tick
+    intervals weigh samples by the time they stand for.  O(1) per sample.
+    Idle UIDs need no samples: tick() advances the clock and a UID's
+    averages are aged by the time since its last sample when it is next
+    observed or forecast, as if it had been fed zeros.
+    """
+
+    def __init__(self, fast_tau=FAST_TAU, slow_tau=SLOW_TAU):
+        self.fast_tau = fast_tau
+        self.slow_tau = slow_tau
+        self.now = 0
+        # uid -> [fast, slow] in KiB/s, time of its last sample
+        self.rates = {}
+
+    def tick(self, dt):
+        self.now += dt
+
+    def aged(self, avg, now):
+        """The averages decayed from their last sample up to now."""
+        idle = now - avg[2]
+        if idle <= 0:
+            return avg[0], avg[1]
+        return avg[0] * math.exp(-idle / self.fast_tau), avg[1] * math.exp(-idle / self.slow_tau)
+
+    def observe(self, uid, rate, dt):
+        """Add a sample of the dt seconds up to now; returns the forecast
+        rate of the UID."""
+        avg = self.rates.get(uid)
+        if avg is None:
+            avg = self.rates[uid] = [rate, rate, self.now]
+        else:
+            fast, slow = self.aged(avg, self.now - dt)
+            a = 1 - math.exp(-dt / self.fast_tau)
+            avg[0] = fast + a * (rate - fast)
+            a = 1 - math.exp(-dt / self.slow_tau)
+            avg[1] = slow + a * (rate - slow)
+            avg[2] = self.now
+        return max(avg[0], avg[1])
+
+    def forecast(self, uid):
+        avg = self.rates.get(uid)
+        return max(self.aged(avg, self.now)) if avg is not None else 0
+
+    def eta(self, uid, slack_left, charge_fraction):
+        """Seconds until the UID has been charged slack_left, at the
+        forecast rate with charge_fraction of it charged."""
+        charging = self.forecast(uid) * charge_fraction
+        if charging <= 0:
+            return float('inf')
+        return max(slack_left, 0) / charging
+
+    def state(self):
+        return {'now': self.now, 'rates': {uid: list(avg) for uid, avg in self.rates.items()}}
+
+    def restore(self, state):
+        self.now = state['now']
+        self.rates = {uid: list(avg) for uid, avg in state['rates'].items()}
+
+class DecayedRates:
+    """Per-UID write rate averaged over the last tau seconds or so.
+
+    One EWMA per UID, aged lazily like BurstForecaster's, but starting
+    from 0 rather than the first sample: a UID writing once weighs what
+    it wrote, not its rate of that second.  UIDs whose average fell
+    below floor (KiB/s) are forgotten by current().
+    """
+
+    def __init__(self, tau, floor):
+        self.tau = tau
+        self.floor = floor
+        self.now = 0
+        # uid -> [average in KiB/s, time of its last sample]
+        self.rates = {}
+
+    def tick(self, dt):
+        self.now += dt
+
+    def observe(self, uid, rate, dt):
+        """Add a sample of the dt seconds up to now."""
+        avg = self.rates.get(uid)
+        if avg is None:
+            avg = self.rates[uid] = [0, self.now - dt]
+        idle = self.now - dt - avg[1]
+        if idle > 0:
+            avg[0] *= math.exp(-idle / self.tau)
+        avg[0] += (1 - math.exp(-dt / self.tau)) * (rate - avg[0])
+        avg[1] = self.now
+
+    def current(self):
+        """{uid: average} as of now of the UIDs at or above the floor."""
+        out = {}
+        for uid, avg in list(self.rates.items()):
+            rate = avg[0] * math.exp(-(self.now - avg[1]) / self.tau)
+            if rate < self.floor:
+                del self.rates[uid]
+            else:
+                out[uid] = rate
+        return out
+
+    def state(self):
+        return {'now': self.now, 'rates': {uid: list(avg) for uid, avg in self.rates.items()}}
+
+    def restore(self, state):
+        self.now = state['now']
+        self.rates = {uid: list(avg) for uid, avg in state['rates'].items()}
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import collections
+import json
+import os
+import time
+
+# Histogram buckets are powers of two of microseconds: bucket i counts
+# durations in [2^(i-1), 2^i) us, bucket 0 those under 1 us
+BUCKETS = 32
+
+# Process-wide counters, e.g. counters['spawns'] += 1 next to a Popen
+counters = collections.Counter()
+
+class Histogram:
+    """Log2 latency histogram; observe() is a few integer operations."""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, seconds):
+        us = int(seconds * 1000000)
+        self.buckets[min(us.bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th fraction, in seconds."""
+        if not self.count:
+            return 0
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min((1 << i) / 1000000, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'buckets_us_log2': self.buckets,
+        }
+
+# Phase name -> Histogram
+phases = {}
+
+def now():
+    return time.perf_counter()
+
+def lap(phase, started):
+    """Account the time since `started` to a phase; returns the new start.
+
+        t = metrics.now()
+        sample()
+        t = metrics.lap('sample', t)
+    """
+    return observe(phases, phase, started)
+
+def observe(into, phase, started):
+    t = time.perf_counter()
+    hist = into.get(phase)
+    if hist is None:
+        hist = into[phase] = Histogram()
+    hist.observe(t - started)
+    return t
+
+class Metrics:
+    """Counters and phase timers of one device's monitor.
+
+    Has the module's counters and lap(), so code timing a monitor takes
+    either; the module's are process-wide, e.g. spawns.
+    """
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.phases = {}
+
+    def lap(self, phase, started):
+        return observe(self.phases, phase, started)
+
+    def snapshot(self):
+        return {
+            'phases': {name: hist.to_dict() for name, hist in self.phases.items()},
+            'counters': dict(self.counters),
+        }
+
+def snapshot(**extra):
+    data = {
+        'time': time.time(),
+        'phases': {name: hist.to_dict() for name, hist in phases.items()},
+        'counters': dict(counters),
+    }
+    data.update(extra)
+    return data
+
+def dump(path, **extra):
+    """Atomically replace `path` with the current metrics as JSON."""
+    tmp = "%s.tmp" % path
+    json_file = open(tmp, 'w')
+    json.dump(snapshot(**extra), json_file, indent=1)
+    json_file.close()
+    os.replace(tmp, path)
+
+class RateLimiter:
+    """ready() is true at most once per `interval` seconds (0: always)."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+        self.suppressed = 0
+
+    def ready(self):
+        if self.interval <= 0:
+            return True
+        t = time.monotonic()
+        if self.last is None or t - self.last >= self.interval:
+            self.last = t
+            return True
+        self.suppressed += 1
+        return False
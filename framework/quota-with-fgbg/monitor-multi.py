@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# Quota monitor for a lab of phones in one process: one DeviceMonitor per
+# adb serial, all ticking on a shared scheduler.  Try it on fake devices:
+#
+#	for i in 1 2 3; do cp -r fake-device /tmp/lab/emu-$i; done
+#	ADB=./fake-adb.sh FAKE_ADB_ROOT=/tmp/lab ./monitor-multi.py -s emu-1 -s emu-2 -s emu-3
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from subprocess import run
+from subprocess import PIPE
+import metrics
+from adb_stream import adb_cmd
+from device_monitor import DeviceMonitor
+from scheduler import TickScheduler
+from trace_log import export_json
+
+WHITELIST = [] # don't play with these uids
+
+SERVICE_TABLE = {
+    '10040': ['1013']
+}
+
+# Same policy parameters as monitor-quota-fgbg.py
+POLICY_PARAMS = {
+    'W_max': 88 * 1024 * 1024 * 1024,
+    'life_sec': 2 * 365 * 24 * 3600,
+    'slk_rate': 0.5,
+    'quota_period_fg': 3600 * 24,
+    'quota_period_bg': 3600,
+    'threshold_rate_fg': 0.5,
+    'threshold_rate_bg': 0.5,
+    'fair_weight_fg': 2,
+    'fair_weight_bg': 1,
+    'share_tau': 60,
+    'forecast_horizon': 0,
+    'service_learning': 1,
+    'tiers': None,
+}
+# Flash health to re-plan W_max on: 'adb' (eMMC), 'adb-ufs' or None
+WEAR_SOURCE = None
+
+HALT = False
+
+def list_serials():
+    """Serials of the devices adb sees, if none were given."""
+    if os.environ.get('ANDROID_SERIAL'):
+        return os.environ['ANDROID_SERIAL'].split(',')
+    out = run(adb_cmd() + ['devices'], stdout=PIPE).stdout.decode('utf-8')
+    return [line.split()[0] for line in out.splitlines()[1:]
+        if line.strip() and line.split()[-1] == 'device']
+
+def halt():
+    global HALT
+    HALT = True
+
+async def monitor(devices, interval, nsecs, metrics_file):
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, halt)
+    await asyncio.gather(*(device.start() for device in devices))
+    print("Monitoring %d devices: %s" % (len(devices), " ".join(d.serial for d in devices)))
+
+    scheduler = TickScheduler(interval)
+    dump_limiter = metrics.RateLimiter(10)
+    iteration_count = 0
+    while not HALT and not (nsecs > 0 and iteration_count * interval > nsecs):
+        await scheduler.wait_async()
+        t = metrics.now()
+        iteration_count += 1
+        await asyncio.gather(*(device.tick() for device in devices))
+        metrics.counters['ticks'] += 1
+        metrics.lap('tick', t)
+        if dump_limiter.ready():
+            metrics.dump(metrics_file, scheduler=scheduler.stats(),
+                devices=[device.summary() for device in devices])
+
+    for device in devices:
+        device.stop()
+    metrics.dump(metrics_file, scheduler=scheduler.stats(),
+        devices=[device.summary() for device in devices])
+
+def main():
+    parser = argparse.ArgumentParser(description="Quota monitor for several adb devices")
+    parser.add_argument('prefix', nargs='?', default='', help="output file prefix")
+    parser.add_argument('-s', '--serial', action='append', default=[],
+        help="adb serial (default: ANDROID_SERIAL, comma separated, or all in adb devices)")
+    parser.add_argument('-i', '--interval', type=float, default=1)
+    parser.add_argument('-n', '--nsecs', type=float, default=0, help="stop after this long (0: until SIGINT)")
+    parser.add_argument('--no-json', action='store_true', help="skip the hist_*.json export")
+    parser.add_argument('--fresh', action='store_true',
+        help="start over instead of resuming from the saved SERIAL-quota_state.json")
+    args = parser.parse_args()
+
+    serials = args.serial or list_serials()
+    if not serials:
+        print("no devices", file=sys.stderr)
+        sys.exit(1)
+    prefix = "%s-" % args.prefix if args.prefix else ""
+    devices = []
+    for serial in serials:
+        state_file = "%s%s-quota_state.json" % (prefix, serial)
+        if args.fresh:
+            for path in (state_file, state_file + '.journal'):
+                if os.path.exists(path):
+                    os.remove(path)
+        devices.append(DeviceMonitor(serial, args.interval, prefix, POLICY_PARAMS,
+            SERVICE_TABLE, WHITELIST, checkpoint=state_file,
+            rollup="%s%s-quota_rollups.json" % (prefix, serial), wear=WEAR_SOURCE))
+    metrics_file = "%smetrics-%.0f.json" % (prefix, devices[0].start_time)
+
+    asyncio.run(monitor(devices, args.interval, args.nsecs, metrics_file))
+
+    for device in devices:
+        summary = device.summary()
+        print(json.dumps(summary))
+        if not args.no_json:
+            export_json(device.trace_file, "%s%s-" % (prefix, device.serial),
+                "%.0f" % device.start_time)
+
+if __name__ == '__main__':
+    main()
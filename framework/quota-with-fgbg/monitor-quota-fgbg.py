@@ -5,37 +5,53 @@ import time
 import json
 import signal
 import os
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as pyplot
-import numpy
 from subprocess import call
-from subprocess import Popen
-from subprocess import PIPE
-from subprocess import run
 import time
+import asyncio
+from trace_log import export_json
+from quota_policy import QuotaPolicy
+from scheduler import TickScheduler
+import metrics
+from actuator import NullBackend
+from actuator import ProcBackend
+from actuator import AdbProcBackend
+from cgroup2 import Cgroup2Controller
+from device_monitor import DeviceMonitor
+from device_monitor import UID_DKSTATS
+from device_monitor import file_sampler
+from service_index import load_app_list
 
 KEEP_UID_STATS_HISTORY = False
 
 PLOT_ONLY = False
-PLOT_PER_UID = False
 PLOT_OUTPUT_JSON = True
-PLOT_UID_SLACK = True
 
 # Environment parameters
-UID_DKSTATS = '/proc/diskstats_uid_global'
 DB_FILE='uid_stats_data.json'
 #WHITELIST = ['0', '104', '105', '1000'] # don't play with these uids
 WHITELIST = [] # don't play with these uids
 
+# Services known to write for an app; more are learned with SERVICE_LEARNING
 SERVICE_TABLE = {
     '10040': ['1013']
 }
+SERVICE_LEARNING = 1
+# extract-apps.py output (or a packages.list) naming the UIDs, to hint
+# which are services; optional
+APP_LIST = 'app-list.json'
 
 # Policy parameters
+# Tick period in seconds, may be fractional (e.g. 0.1)
 INTERVAL = 1
 # sample length
 NSECS = 360
+# How long a tick waits for a fresh adb stats frame before it is skipped
+SAMPLE_WAIT = INTERVAL / 2
+# No frame for this long restarts the adb stats stream
+SAMPLE_TIMEOUT = 5 * INTERVAL
+# Give up on a foreground probe or a limit update after this many seconds
+FG_TIMEOUT = 5
+ACTUATE_TIMEOUT = 2
 # Estimated lifetime I/O in KiB
 W_max = 88 * 1024 * 1024 * 1024
 # Desired lifetime in seconds
@@ -45,18 +61,56 @@ QUOTA_PERIOD_BG = 3600
 QUOTA_PERIOD_FG = 3600 * 24
 RATELIMIT_THRESHOLD_RATE_FG = 0.5
 RATELIMIT_THRESHOLD_RATE_BG = 0.5
+# Weights of fg and bg writers when leashed UIDs share b_tag (max-min fair)
+FAIR_WEIGHT_FG = 2
+FAIR_WEIGHT_BG = 1
+# Seconds the other writers' rates are averaged over for those shares
+SHARE_TAU = 60
+# Nested slack periods, coarsest first: (name, period, watermark rate,
+# charged by 'fg'/'bg'/None[, recycle unused slack]), e.g.
+#	[('week', 7 * 86400, 0.5, None), ('day', 86400, 0.5, 'fg'),
+#	 ('hour', 3600, 0.5, 'bg')]
+# UIDs are only leashed at the watermarks of the fg and bg tiers; a tier
+# charged by None just hands slack down and has to be above one of them
+# None: a QUOTA_PERIOD_FG day charged by fg over a QUOTA_PERIOD_BG hour
+QUOTA_TIERS = None
+# Limit UIDs forecast to reach their watermark within this many seconds
+# (0: only at the watermark)
+FORECAST_HORIZON = 0
+# Re-plan W_max on the flash's life time estimate, read every
+# WEAR_INTERVAL seconds from WEAR_SOURCE: 'adb' (eMMC), 'adb-ufs' or a
+# local directory the eMMC sysfs paths are under (e.g. a device-model.py
+# root); None keeps the static W_max
+WEAR_SOURCE = None
+WEAR_INTERVAL = 3600
 
 SLK_RATE = 0.5
 SLK = W_max * SLK_RATE
 
 B = W_max / LIFE_SEC
 
-# Delay when update foreground uid
+# Follow foreground changes from the activity event log instead of polling
+FG_EVENT_TRACKING = True
+# Checkpoint the policy state (budgets, slack, leashes, stats reference)
+# every CHECKPOINT_INTERVAL seconds and resume from it on start
+WARM_RESTART = True
+CHECKPOINT_INTERVAL = 10
+# Per-tick state output: every tick (0) or at most once per this many
+# seconds; the policy's per-UID messages follow the same ticks
+LOG_INTERVAL = 0
+# Phase timings and counters, rewritten every METRICS_INTERVAL seconds
+METRICS_INTERVAL = 10
+# History for rollup-query.py: the last ROLLUP_SECONDS of ticks, then
+# ROLLUP_MINUTES per-minute and ROLLUP_HOURS per-hour aggregates, saved
+# every ROLLUP_SAVE_INTERVAL seconds and resumed on start
+ROLLUP_SECONDS = 600
+ROLLUP_MINUTES = 24 * 60
+ROLLUP_HOURS = 2 * 365 * 24
+ROLLUP_SAVE_INTERVAL = 600
+
+# Delay when update foreground uid (polling only)
 DELAY_UPDATE_FG_UID = 5
 
-current_fg_uid = '-1'
-current_fg_uid_delay = 0
-
 # Selector for host-side ratelimit mechanisms
 HOST_RATELIMIT_DUMB     = 0
 HOST_RATELIMIT_CGROUP1  = 1
@@ -64,56 +118,53 @@ HOST_RATELIMIT_CGROUP2  = 2
 HOST_RATELIMIT_RL       = 3
 HOST_RATELIMIT_RL_ADB       = 4
 
-# HOST_RATELIMIT_CGROUP2 related
-HOST_RATELIMIT_CGROUP2_CMD = "./cg2-limit-uid.sh"
+# HOST_RATELIMIT_CGROUP2 related, as in cg2-env.sh
+HOST_RATELIMIT_CGROUP2_ROOT = "/tmp/rl-cg2"
+HOST_RATELIMIT_CGROUP2_DEV = "179:0"
 
 # HOST_RATELIMIT_RL related
-HOST_RATELIMIT_RL_CTRL_CMD = "./rl-limit-uid.sh"
+HOST_RATELIMIT_RL_ROOT = "/proc/ratelimit_uid"
 
 # HOST_RATELIMIT_RL_ADB related
 
 host_ratelimit_type = HOST_RATELIMIT_DUMB
 
-if host_ratelimit_type == HOST_RATELIMIT_RL_ADB:
-    print("Skip opening local stats file for adb")
-elif host_ratelimit_type == HOST_RATELIMIT_DUMB:
+sample = None
+if host_ratelimit_type in (HOST_RATELIMIT_RL_ADB, HOST_RATELIMIT_DUMB):
     print("Skip opening local stats file for adb")
 else:
-    f = open(UID_DKSTATS, 'r')
+    sample = file_sampler(UID_DKSTATS)
+
+if host_ratelimit_type == HOST_RATELIMIT_CGROUP2:
+    backend = Cgroup2Controller(HOST_RATELIMIT_CGROUP2_ROOT, HOST_RATELIMIT_CGROUP2_DEV)
+elif host_ratelimit_type == HOST_RATELIMIT_RL:
+    backend = ProcBackend(HOST_RATELIMIT_RL_ROOT)
+elif host_ratelimit_type == HOST_RATELIMIT_RL_ADB:
+    backend = AdbProcBackend()
+else:
+    backend = NullBackend()
 
 if len(sys.argv) > 1:
     JSON_PREFIX="%s-" % (sys.argv[1])
 else:
     JSON_PREFIX=""
 
+# Tick times are monotonic, anchored to the wall clock at start
+START_TIME = time.time()
+
+TRACE_FILE = "%strace-%.0f.qtr" % (JSON_PREFIX, START_TIME)
+METRICS_FILE = "%smetrics-%.0f.json" % (JSON_PREFIX, START_TIME)
+# Not per run: the next run resumes from it
+CHECKPOINT_FILE = "%squota_state.json" % JSON_PREFIX
+ROLLUP_FILE = "%squota_rollups.json" % JSON_PREFIX
+
 previous_stats = {}
 uid_birthday = {}
 uid_name = {}
 
-hist_bw = {}
-hist_total_bw = []
-hist_total_bw_fg = []
-hist_total_bw_bg = []
-hist_stats = {}
-
-w_left = W_max
 iteration_count = 0
-num_uniq_uid = 0
-uid_prison = []
-uid_prison_rate = {}
-checkpoint_bg = 0
-slack_left = SLK
-
-checkpoint_fg = 0
-life_left_fg = LIFE_SEC
-
-hist_slack_period_fg = []
-hist_slack_period_bg = []
-hist_watermark_fg = []
-hist_watermark_bg = []
-hist_uid_slack_fg = {}
-hist_uid_slack_bg = {}
-hist_uid_limit = {}
+scheduler = TickScheduler(INTERVAL)
+metrics_limiter = metrics.RateLimiter(METRICS_INTERVAL)
 
 HALT=False
 
@@ -131,15 +182,47 @@ try:
         previous_stats[uid] = data[1]
         uid_birthday[uid] = data[0]
         uid_name[uid] = data[2]
-        num_uniq_uid += 1
 
 except IOError:
     print("no previous stats file found")
 
-# TODO: Apply previous_stats into future stats (need a working birthday management)
-print(previous_stats)
 
-current_stats_dict = {}
+policy = QuotaPolicy(W_max, LIFE_SEC, SLK_RATE, QUOTA_PERIOD_FG, QUOTA_PERIOD_BG,
+    RATELIMIT_THRESHOLD_RATE_FG, RATELIMIT_THRESHOLD_RATE_BG,
+    FAIR_WEIGHT_FG, FAIR_WEIGHT_BG, FORECAST_HORIZON, share_tau=SHARE_TAU,
+    service_learning=SERVICE_LEARNING, service_hints=load_app_list(APP_LIST), tiers=QUOTA_TIERS,
+    wear_planning=WEAR_SOURCE is not None, service_table=SERVICE_TABLE,
+    known_uids=uid_birthday.keys(), verbose=True)
+
+started = time.monotonic()
+# The per-tick path (deltas, policy, actuation, trace, rollups and
+# checkpoints) is DeviceMonitor's, for the one device adb talks to
+monitor = DeviceMonitor(None, INTERVAL, policy=policy, service_table=SERVICE_TABLE,
+    whitelist=WHITELIST, sample_wait=SAMPLE_WAIT, sample_timeout=SAMPLE_TIMEOUT,
+    fg_timeout=FG_TIMEOUT, actuate_timeout=ACTUATE_TIMEOUT, verbose=True,
+    checkpoint=CHECKPOINT_FILE if WARM_RESTART else None,
+    checkpoint_interval=CHECKPOINT_INTERVAL, rollup=ROLLUP_FILE,
+    rollup_interval=ROLLUP_SAVE_INTERVAL, wear=WEAR_SOURCE, wear_interval=WEAR_INTERVAL,
+    sample=sample, fg_poll=None if FG_EVENT_TRACKING else (DELAY_UPDATE_FG_UID + 1) * INTERVAL,
+    backend=backend, start_time=START_TIME, trace=TRACE_FILE, trace_meta={
+        'W_max': W_max, 'life_sec': LIFE_SEC,
+        'quota_period_fg': QUOTA_PERIOD_FG, 'quota_period_bg': QUOTA_PERIOD_BG,
+        'ratelimit_threshold_rate_fg': RATELIMIT_THRESHOLD_RATE_FG,
+        'ratelimit_threshold_rate_bg': RATELIMIT_THRESHOLD_RATE_BG,
+        'slk_rate': SLK_RATE, 'fair_weight_fg': FAIR_WEIGHT_FG, 'fair_weight_bg': FAIR_WEIGHT_BG,
+        'share_tau': SHARE_TAU,
+        'forecast_horizon': FORECAST_HORIZON, 'service_learning': SERVICE_LEARNING,
+        'quota_tiers': QUOTA_TIERS, 'host_ratelimit_type': host_ratelimit_type},
+    log_interval=LOG_INTERVAL, rollup_keep=(ROLLUP_SECONDS, ROLLUP_MINUTES, ROLLUP_HOURS),
+    uid_written=dict(previous_stats), record_only=PLOT_ONLY,
+    # The one device's counters and timings are the process's, in METRICS_FILE
+    stats=metrics)
+if monitor.restored_time is not None:
+    print("Resumed from %s in %.1f ms: w_left %.2f GiB, %d UIDs leashed, saved %.0fs ago" %
+        (CHECKPOINT_FILE, (time.monotonic() - started) * 1000, policy.w_left/1024/1024,
+        len(policy.uid_prison), START_TIME - monitor.restored_time))
+if monitor.rollups_resumed:
+    print("Rollups resumed from %s: %s" % (ROLLUP_FILE, monitor.rollups.sizes()))
 
 def uid_to_name(_uid):
     if _uid in uid_name:
@@ -153,194 +236,27 @@ def signal_handler(signal, frame):
     print(frame)
     if KEEP_UID_STATS_HISTORY:
         print('preparing uid stats data...')
+        for uid in monitor.uid_written:
+            if uid not in WHITELIST and uid not in uid_birthday:
+                uid_birthday[uid] = get_birthday(uid)
         new_uid_db = {}
         for uid, birthday in uid_birthday.items():
-            stats = previous_stats.get(uid, 0) + current_stats_dict.get(uid, 0)
-            new_uid_db[uid] = [birthday, stats, uid_to_name(uid)]
+            new_uid_db[uid] = [birthday, monitor.uid_written.get(uid, 0), uid_to_name(uid)]
         print('Writing out uid stats file...')
         json_file = open(DB_FILE, 'w')
         json.dump(new_uid_db, json_file)
         json_file.close()
         print('done')
 
-    if PLOT_OUTPUT_JSON:
-        timestamp = "%.0f" % time.time()
-        print('Outputing hist_bw...')
-        json_file = open("%shist_bw-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_bw, json_file)
-        json_file.close()
-        print('done')
-
-        print('Outputing hist_total_bw...')
-        json_file = open("%shist_total_bw-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_total_bw, json_file)
-        json_file.close()
-        print('done')
-
-        print('Outputing hist_total_bw_fg...')
-        json_file = open("%shist_total_bw_fg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_total_bw_fg, json_file)
-        json_file.close()
-        print('done')
-
-        print('Outputing hist_total_bw_bg...')
-        json_file = open("%shist_total_bw_bg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_total_bw_bg, json_file)
-        json_file.close()
-        print('done')
-
-        print('Outputing hist_stats...')
-        json_file = open("%shist_stats-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_stats, json_file)
-        json_file.close()
-        print('done')
-
-        json_file = open("%shist_uid_slack_fg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_uid_slack_fg, json_file)
-        json_file.close()
-        print('done')
-
-        json_file = open("%shist_uid_slack_bg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_uid_slack_bg, json_file)
-        json_file.close()
-        print('done')
-
-        json_file = open("%shist_uid_limit-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_uid_limit, json_file)
-        json_file.close()
-
-        json_file = open("%shist_slack_period_fg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_slack_period_fg, json_file)
-        json_file.close()
-
-        json_file = open("%shist_slack_period_bg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_slack_period_bg, json_file)
-        json_file.close()
-
-        json_file = open("%shist_watermark_fg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_watermark_fg, json_file)
-        json_file.close()
+    if monitor.checkpoint is not None and monitor.last_tick_time is not None:
+        print("Checkpoint saved to %s" % CHECKPOINT_FILE)
 
-        json_file = open("%shist_watermark_bg-%s.json" % (JSON_PREFIX, timestamp), 'w')
-        json.dump(hist_watermark_bg, json_file)
-        json_file.close()
-
-    print(hist_bw)
-    print(hist_stats)
-    x_intervals = numpy.arange(1, iteration_count+1)
-    fig, ax = pyplot.subplots()
-    for uid, bw in sorted(hist_bw.items()):
-        print(uid)
-        print(bw)
-        ax.plot(x_intervals, bw, label = uid_to_name(uid))
-    ax.set_ylim(bottom=0)
-    ax.set_xlim(left=0)
-    bottom, top = pyplot.ylim()
-    if '1005' in hist_uid_limit:
-        ax.axvline(hist_uid_limit['1005'], linestyle='dotted', color='y')
-        pyplot.text(1.05 * hist_uid_limit['1005'], 0.95 * top, 'Throttled')
-    #ax.legend(loc='upper right')
-    ax.legend(loc=9, bbox_to_anchor=(0.5, -0.3), ncol=5)
-    ax.set_xlabel('Time (seconds)')
-    #ax.set_xlabel('Interval count (%d s)' % INTERVAL)
-    ax.set_ylabel('Throughput (KiB/s)')
-    #ax.set_title('Plot for %d iterations' % iteration_count)
-    #ax.set_title('Plot for %d iterations' % iteration_count)
-    pyplot.tight_layout()
-    pyplot.savefig("%shist_bw-%s.pdf" % (JSON_PREFIX, timestamp))
-    pyplot.close()
-
-    fig, ax = pyplot.subplots()
-    ax.plot(x_intervals, hist_total_bw, label='Total')
-    ax.plot(x_intervals, hist_total_bw_bg, linestyle='dotted', label='Background')
-    ax.plot(x_intervals, hist_total_bw_fg, linestyle='dotted', label='Foreground')
-    ax.set_ylim(bottom=0)
-    ax.set_xlim(left=0)
-    bottom, top = pyplot.ylim()
-    ax.legend(loc=9, bbox_to_anchor=(0.5, -0.3), ncol=5)
-    ax.set_xlabel('Time (seconds)')
-    #ax.set_xlabel('Interval count (%d s)' % INTERVAL)
-    ax.set_ylabel('Throughput (KiB/s)')
-    #ax.set_title('Plot for %d iterations' % iteration_count)
-    #ax.set_title('Plot for %d iterations' % iteration_count)
-    pyplot.tight_layout()
-    pyplot.savefig("%shist_total_bw-%s.pdf" % (JSON_PREFIX, timestamp))
-    pyplot.close()
-
-    fig, ax = pyplot.subplots()
-    for uid, stats in sorted(hist_stats.items()):
-        ax.plot(x_intervals, stats, label = uid_to_name(uid))
-    ax.set_ylim(bottom=0)
-    ax.set_xlim(left=0)
-    if len(hist_slack_period_fg) > 0:
-        ax.plot(x_intervals, hist_slack_period_fg, linestyle='dashed', label='$Slack_{month}$')
-    if len(hist_watermark_fg) > 0:
-        ax.plot(x_intervals, hist_watermark_fg, linestyle='dotted', label='$W_{mark}')
-    #ax.legend(loc='upper right')
-    ax.legend(loc=9, bbox_to_anchor=(0.5, -0.3), ncol=5)
-    ax.set_xlabel('Interval count (%d s)' % INTERVAL)
-    ax.set_ylabel('Total write (KiB)')
-    ax.set_title('Plot for %d iterations' % iteration_count)
-    pyplot.tight_layout()
-    pyplot.savefig("%shist_stats-%s.pdf" % (JSON_PREFIX, timestamp))
-    pyplot.close()
-
-    fig, ax = pyplot.subplots()
-    for uid, stats in sorted(hist_uid_slack_fg.items()):
-        ax.plot(x_intervals, stats, label = uid_to_name(uid))
-    if len(hist_slack_period_fg) > 0:
-        ax.plot(x_intervals, hist_slack_period_fg, linestyle='dashed', label='$Slack_{hour}$')
-    if len(hist_watermark_fg) > 0:
-        ax.plot(x_intervals, hist_watermark_fg, linestyle='dashed', label='$W_{mark}$')
-    ax.set_ylim(bottom=0)
-    ax.set_xlim(left=0)
-    bottom, top = pyplot.ylim()
-    if '1005' in hist_uid_limit:
-        ax.axvline(hist_uid_limit['1005'], linestyle='dotted', color='y')
-        pyplot.text(1.05 * hist_uid_limit['1005'], 0.95 * top, 'Throttled')
-    #ax.legend(loc='upper right')
-    ax.legend(loc=9, bbox_to_anchor=(0.5, -0.3), ncol=5)
-    ax.set_xlabel('Time (second)')
-    ax.set_ylabel('Total write (KiB)')
-    #ax.set_title('Plot for %d iterations' % iteration_count)
-    pyplot.tight_layout()
-    pyplot.savefig("%shist_uid_slack_fg-%s.pdf" % (JSON_PREFIX, timestamp))
-    pyplot.close()
-
-    fig, ax = pyplot.subplots()
-    for uid, stats in sorted(hist_uid_slack_bg.items()):
-        ax.plot(x_intervals, stats, label = uid_to_name(uid))
-    if len(hist_slack_period_bg) > 0:
-        ax.plot(x_intervals, hist_slack_period_bg, linestyle='dashed', label='$Slack_{hour}$')
-    if len(hist_watermark_bg) > 0:
-        ax.plot(x_intervals, hist_watermark_bg, linestyle='dashed', label='$W_{mark}$')
-    ax.set_ylim(bottom=0)
-    ax.set_xlim(left=0)
-    bottom, top = pyplot.ylim()
-    if '1005' in hist_uid_limit:
-        ax.axvline(hist_uid_limit['1005'], linestyle='dotted', color='y')
-        pyplot.text(1.05 * hist_uid_limit['1005'], 0.95 * top, 'Throttled')
-    #ax.legend(loc='upper right')
-    ax.legend(loc=9, bbox_to_anchor=(0.5, -0.3), ncol=5)
-    ax.set_xlabel('Time (second)')
-    ax.set_ylabel('Total write (KiB)')
-    #ax.set_title('Plot for %d iterations' % iteration_count)
-    pyplot.tight_layout()
-    pyplot.savefig("%shist_uid_slack_bg-%s.pdf" % (JSON_PREFIX, timestamp))
-    pyplot.close()
-
-    if PLOT_PER_UID:
-        for uid, bw in hist_bw.items():
-            fig, ax1 = pyplot.subplots()
-            ax2 = ax1.twinx()
-            ax1.plot(x_intervals, bw, label = "bw", color='g')
-            ax2.plot(x_intervals, hist_stats[uid], label = "stats", color='b')
-            ax.legend(loc='upper right')
-            ax1.set_xlabel('Interval count (%d s)' % INTERVAL)
-            ax1.set_ylabel('Throughput (KiB/s)', color='g')
-            ax2.set_ylabel('Total write (KiB)', color='b')
-            pyplot.savefig("%s-%s-avg%.2f.png" % (uid, timestamp, numpy.mean(bw)))
-            pyplot.close()
+    print("Scheduler: %s" % json.dumps(scheduler.stats()))
+    dump_metrics()
+    timestamp = "%.0f" % time.time()
+    if PLOT_OUTPUT_JSON:
+        export_json(TRACE_FILE, JSON_PREFIX, timestamp)
+    print("Figures: ./quota-report.py %s %s" % (TRACE_FILE, sys.argv[1] if len(sys.argv) > 1 else ""))
 
     sys.exit(0)
 
@@ -349,246 +265,50 @@ signal.signal(signal.SIGINT, signal_handler)
 def get_birthday(uid):
     return 0
 
-def leash_uid(_uid_prison, _uid, _rate):
-    if _uid in _uid_prison:
-        print("Leashing leashed uid %s with rate %d" % (_uid, _rate))
-    else:
-        _uid_prison.append(_uid)
-        uid_prison_rate[_uid] = _rate
-
-    if host_ratelimit_type == HOST_RATELIMIT_CGROUP1:
-        return
-    elif host_ratelimit_type == HOST_RATELIMIT_CGROUP2:
-        call([HOST_RATELIMIT_CGROUP2_CMD, _uid, str(_rate)])
-        return
-    elif host_ratelimit_type == HOST_RATELIMIT_RL:
-        call([HOST_RATELIMIT_RL_CTRL_CMD, _uid, str(_rate)])
-        return
-    elif host_ratelimit_type == HOST_RATELIMIT_RL_ADB:
-        call(["adb", "shell", "su -c 'echo %s %d > /proc/ratelimit_uid'" % (_uid, _rate)])
-    return
-
-def unleash_uid(_uid_prison, _uid):
-    if _uid not in _uid_prison:
-        print("Unleashing non-leashed uid " + _uid)
-        return
-    _uid_prison.remove(_uid)
-    uid_prison_rate[_uid] = -1
-
-    if host_ratelimit_type == HOST_RATELIMIT_CGROUP1:
-        return
-    elif host_ratelimit_type == HOST_RATELIMIT_CGROUP2:
-        return
-    elif host_ratelimit_type == HOST_RATELIMIT_RL:
-        call([HOST_RATELIMIT_RL_CTRL_CMD, _uid, "-1"])
-        return
-    elif host_ratelimit_type == HOST_RATELIMIT_RL_ADB:
-        call(["adb", "shell", "echo %s -1 > /proc/ratelimit_uid" % (_uid)])
-        return
-    return
-
-def is_uid_ratelimited(_uid_prison, _uid):
-    return _uid in _uid_prison
-
-def update_foreground_app():
-    global current_fg_uid_delay
-    global current_fg_uid
-    if current_fg_uid_delay > 0:
-        current_fg_uid_delay -= 1
-    else:
-        current_fg_uid = run(['./adb-get-fg-uid-screen.sh'], stdout=PIPE).stdout.decode('utf-8')
-        current_fg_uid_delay = DELAY_UPDATE_FG_UID
-
-def is_fg_uid(_uid):
-    #print("checking %s with %s" %(_uid, current_fg_uid))
-    if _uid == current_fg_uid:
-        return True
-    if current_fg_uid in SERVICE_TABLE and _uid in SERVICE_TABLE[current_fg_uid]:
-        return True
-    return False
-
-slack_period_fg = 0
-slack_period_bg = 0
-
-while True:
-    if HALT == True:
-        break
-    if NSECS > 0 and iteration_count * INTERVAL > NSECS:
-        os.kill(os.getpid(), signal.SIGINT)
-        break
-
-    current_time = time.time()
-    # New foreground quota period
-    if current_time - checkpoint_fg >= QUOTA_PERIOD_FG:
-        checkpoint_fg = current_time
-        if slack_period_fg > 0:
-            # recycle remaining slack
-            slack_left += slack_period_fg
-        period_left_fg = life_left_fg / QUOTA_PERIOD_FG
-        slack_period_fg = slack_left / period_left_fg
-        slack_left -= slack_period_fg
-        ratelimit_threshold_fg = slack_period_fg * RATELIMIT_THRESHOLD_RATE_FG
-        life_left_fg -= QUOTA_PERIOD_FG
-        life_left_bg = QUOTA_PERIOD_FG
-        slack_left_bg = slack_period_fg
-        b_tag_fg = (w_left - slack_left) / life_left_fg
-        uid_slack_fg = {}
-        print("New foreground slack period: period_left_fg %d slack_period_fg %.2f ratelimit_threshold_fg %.2f b_tag_fg %.2f"
-            % (period_left_fg, slack_period_fg, ratelimit_threshold_fg, b_tag_fg))
-
-
-    if current_time - checkpoint_bg >= QUOTA_PERIOD_BG:
-        checkpoint_bg = current_time
-        if slack_period_bg > 0:
-            # recycle remaining slack
-            slack_period_fg += slack_period_bg
-        period_left_bg = life_left_bg / QUOTA_PERIOD_BG
-        slack_period_bg = slack_left_bg / period_left_bg
-        slack_period_fg -= slack_period_bg
-        ratelimit_threshold_bg = slack_period_bg * RATELIMIT_THRESHOLD_RATE_BG
-        life_left_bg -= QUOTA_PERIOD_BG
-        b_tag_bg = b_tag_fg # FIXME
-        uid_slack_bg = {}
-        print("New background slack period: period_left_bg %d slack_period_bg %.2f ratelimit_threshold_bg %.2f b_tag_bg %.2f"
-            % (period_left_bg, slack_period_bg, ratelimit_threshold_bg, b_tag_bg))
-
-    iteration_count += 1
-    update_foreground_app()
-    if host_ratelimit_type == HOST_RATELIMIT_RL_ADB:
-        f = Popen(["adb", "shell", "cat /proc/diskstats_uid_global"], stdout=PIPE).stdout
-    elif host_ratelimit_type == HOST_RATELIMIT_DUMB:
-        f = Popen(["adb", "shell", "cat /proc/diskstats_uid_global"], stdout=PIPE).stdout
-    else:
-        f.seek(0)
-    line = f.readline()
-    fields = line.split()
-
-    sample_seq = int(fields[0])
-    timestamp = int(fields[1])
-    timestamp_diff = int(fields[2])
-
-    # print(fields)
-    print("seq %d timestamp %lu diff %lu" % (sample_seq, timestamp, timestamp_diff))
-
-    iter_total_throughput = 0
-    iter_total_throughput_fg = 0
-    iter_total_throughput_bg = 0
-    iter_uid_throughput = {}
-
-    for line in f:
-        fields = line.split()
-        #print(fields)
-
-        if int(fields[0]) == -1:
-            print("total %lu" % int(fields[1]))
-        else:
-            uid = fields[0]
-            if host_ratelimit_type == HOST_RATELIMIT_RL_ADB:
-                uid = str(uid, "utf-8")
-            if host_ratelimit_type == HOST_RATELIMIT_DUMB:
-                uid = str(uid, "utf-8")
-            stats = int(fields[1]) / 2
-            stats_diff = int(fields[2]) / 2
-            current_stats_dict[uid] = stats
-            if uid in WHITELIST:
-                continue
-            if uid not in uid_birthday:
-                uid_birthday[uid] = get_birthday(uid)
-                num_uniq_uid += 1
-            if uid not in hist_bw:
-                hist_bw[uid] = [0] * (iteration_count - 1)
-            if uid not in hist_stats:
-                hist_stats[uid] = [0] * (iteration_count - 1)
-
-            this_bw = stats_diff / timestamp_diff
-
-            hist_bw[uid].append(this_bw)
-            hist_stats[uid].append(stats)
-            if uid in WHITELIST:
-                continue
-
-            iter_total_throughput += this_bw
-            iter_uid_throughput[uid] = this_bw
-
-    hist_total_bw.append(iter_total_throughput)
-    if PLOT_ONLY:
-        time.sleep(INTERVAL)
-        continue
-
-    # Deal with this second
-    w_left -= iter_total_throughput
-
-    hist_slack_period_fg.append(slack_period_fg)
-    hist_slack_period_bg.append(slack_period_bg)
-    hist_watermark_fg.append(ratelimit_threshold_fg)
-    hist_watermark_bg.append(ratelimit_threshold_bg)
-
-    is_phone_active = False
-    for _uid, _throughput in iter_uid_throughput.items():
-        if is_fg_uid(_uid):
-            # Foreground app
-            print("Foreground %s %s" % (_uid, current_fg_uid))
-            is_phone_active = True
-            iter_total_throughput_fg += _throughput
-            if _uid not in uid_slack_fg:
-                uid_slack_fg[_uid] = 0
-
-            if iter_total_throughput > b_tag_fg:
-                uid_slack_fg[_uid] += (iter_total_throughput - b_tag_fg) / iter_total_throughput * _throughput
-                if uid_slack_fg[_uid] >= 0.99 * ratelimit_threshold_fg:
-                    leash_uid(uid_prison, _uid, b_tag_fg / num_uniq_uid * 1024)
-                    if _uid not in hist_uid_limit:
-                        hist_uid_limit[_uid] = iteration_count
-                elif is_uid_ratelimited(uid_prison, _uid):
-                    unleash_uid(uid_prison, _uid)
-            elif is_uid_ratelimited(uid_prison, _uid):
-                unleash_uid(uid_prison, _uid)
-
-        else:
-            # background app
-            iter_total_throughput_bg += _throughput
-            if _uid not in uid_slack_bg:
-                uid_slack_bg[_uid] = 0
-
-            if iter_total_throughput > b_tag_bg:
-                uid_slack_bg[_uid] += (iter_total_throughput - b_tag_bg) / iter_total_throughput * _throughput
-                if uid_slack_bg[_uid] >= 0.99 * ratelimit_threshold_bg:
-                    leash_uid(uid_prison, _uid, b_tag_bg / num_uniq_uid * 1024)
-                    if _uid not in hist_uid_limit:
-                        hist_uid_limit[_uid] = iteration_count
-                elif is_uid_ratelimited(uid_prison, _uid):
-                    unleash_uid(uid_prison, _uid)
-            elif is_uid_ratelimited(uid_prison, _uid):
-                unleash_uid(uid_prison, _uid)
-
-        if PLOT_UID_SLACK:
-            if _uid not in uid_slack_fg:
-                uid_slack_fg[_uid] = 0
-            if _uid not in uid_slack_bg:
-                uid_slack_bg[_uid] = 0
-            if _uid not in hist_uid_slack_fg:
-                hist_uid_slack_fg[_uid] = [0] * (iteration_count - 1)
-            hist_uid_slack_fg[_uid].append(uid_slack_fg[_uid])
-            if _uid not in hist_uid_slack_bg:
-                hist_uid_slack_bg[_uid] = [0] * (iteration_count - 1)
-            hist_uid_slack_bg[_uid].append(uid_slack_bg[_uid])
-
-    if is_phone_active:
-        print("Phone active: %s" % (current_fg_uid))
-        slack_period_fg += b_tag_fg - iter_total_throughput
-        if iter_total_throughput < b_tag_fg:
-            ratelimit_threshold_fg += (b_tag_fg - iter_total_throughput) * 0.5
-    else:
-        slack_period_bg += b_tag_bg - iter_total_throughput
-        if iter_total_throughput < b_tag_bg:
-            ratelimit_threshold_bg += (b_tag_bg - iter_total_throughput) * 0.5
-
-    hist_total_bw_fg.append(iter_total_throughput_fg)
-    hist_total_bw_bg.append(iter_total_throughput_bg)
-
-    #print(current_stats_dict)
-    print("Finished one cycle: period_left_bg %d slack_period_bg %.2f ratelimit_threshold_bg %.2f b_tag_bg %.2f iter_total_throughput_bg %.2f"
-        % (period_left_bg, slack_period_bg, ratelimit_threshold_bg, b_tag_bg, iter_total_throughput_bg))
-    print("Finished one cycle: period_left_fg %d slack_period_fg %.2f ratelimit_threshold_fg %.2f b_tag_fg %.2f iter_total_throughput_fg %.2f"
-        % (period_left_fg, slack_period_fg, ratelimit_threshold_fg, b_tag_fg, iter_total_throughput_fg))
-    time.sleep(INTERVAL)
+def dump_metrics():
+    checkpoint = monitor.checkpoint
+    metrics.dump(METRICS_FILE, scheduler=scheduler.stats(),
+        log_suppressed_ticks=monitor.log_limiter.suppressed,
+        stage_timeouts={stage.name: stage.timeouts for stage in
+            (monitor.fg_stage, monitor.actuate_stage, monitor.wear_stage,
+            monitor.rollup_stage, monitor.checkpoint_stage)},
+        checkpoint={'saves': checkpoint.saves, 'compactions': checkpoint.compactions,
+            'journal_bytes': checkpoint.journal_size} if checkpoint is not None else None,
+        rollups=monitor.rollups.sizes(),
+        services=policy.services.learned() if policy.services is not None else None)
+
+async def control_loop():
+    global iteration_count
+    while True:
+        if HALT == True:
+            break
+        if NSECS > 0 and iteration_count * INTERVAL > NSECS:
+            break
+
+        await scheduler.wait_async()
+        iteration_count += 1
+        if not await monitor.tick():
+            print("No stats sample available, skipping")
+            iteration_count -= 1
+            scheduler.miss()
+            continue
+        metrics.counters['ticks'] += 1
+        metrics.counters['policy_actions'] = monitor.policy_actions
+        if metrics_limiter.ready():
+            dump_metrics()
+
+def halt():
+    global HALT
+    HALT = True
+
+async def main():
+    loop = asyncio.get_running_loop()
+    # Stop at the next tick; the report is written outside the loop
+    loop.add_signal_handler(signal.SIGINT, halt)
+    await monitor.start()
+    await control_loop()
+    # Saves the checkpoint and rollups and closes the trace
+    monitor.stop()
+
+asyncio.run(main())
+signal_handler(signal.SIGINT, None)
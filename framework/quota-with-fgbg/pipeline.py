@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import metrics
+
+class Latest:
+    """Newest value published by a producer; readers never queue up.
+
+    publish() must run on the event loop; threads go through
+    loop.call_soon_threadsafe(latest.publish, value).
+    """
+
+    def __init__(self):
+        self.value = None
+        self.version = 0
+        self.changed = asyncio.Event()
+
+    def publish(self, value):
+        self.value = value
+        self.version += 1
+        self.changed.set()
+
+    async def wait_newer(self, version, timeout=None):
+        """Wait for a value newer than `version`; raises asyncio.TimeoutError."""
+        while self.version == version:
+            self.changed.clear()
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        return self.value, self.version
+
+class Stage:
+    """Runs one blocking step (adb, a script, a proc write) off the loop.
+
+    Each call gets its own daemon thread and call() gives up after
+    `timeout` seconds.  A call that timed out keeps its thread until it
+    returns, and until then the stage refuses new calls with a timeout
+    too, so a hung adb can't pile up threads or block the loop.
+    """
+
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.busy = False
+        self.calls = 0
+        self.timeouts = 0
+
+    async def call(self, func, *args):
+        if self.busy:
+            self.timeouts += 1
+            raise asyncio.TimeoutError("%s still stuck in its previous call" % self.name)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def done(result, error):
+            self.busy = False
+            if future.cancelled():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run():
+            result = error = None
+            try:
+                result = func(*args)
+            except Exception as e:
+                error = e
+            try:
+                loop.call_soon_threadsafe(done, result, error)
+            except RuntimeError:
+                # the loop is gone, nobody waits for this any more
+                pass
+
+        self.busy = True
+        self.calls += 1
+        threading.Thread(target=run, name=self.name, daemon=True).start()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+async def drain_actuations(queue, stage, actuator, before=None, stats=metrics):
+    """Apply queued limit changes, merging whatever piled up meanwhile.
+
+    Changes that time out or fail, however the backend fails, go back to
+    the actuator to be re-sent on its next diff and draining goes on.
+    before(), if given, runs on the stage first.  Counts and timings go
+    to stats, the process-wide metrics unless given.
+    """
+    while True:
+        batch = dict(await queue.get())
+        while not queue.empty():
+            batch.update(queue.get_nowait())
+        t = metrics.now()
+        changes = list(batch.items())
+        try:
+            if before is not None:
+                await stage.call(before)
+            if not changes:
+                continue
+            await stage.call(actuator.backend.apply, changes)
+        except Exception as e:
+            print("Actuation of %s failed (%s), retrying" % (
+                ", ".join("uid %s rate %d" % (uid, rate) for uid, rate in changes),
+                str(e) or type(e).__name__))
+            stats.counters['actuation_failures'] += 1
+            actuator.retry(changes)
+            continue
+        actuator.count(changes)
+        stats.counters['actuations'] += 1
+        stats.counters['actuation_entries'] += len(changes)
+        stats.lap('actuate', t)
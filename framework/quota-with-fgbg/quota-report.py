@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+# Figures of a monitor run, drawn from its trace log after the fact so the
+# monitor itself never loads matplotlib.  Every series is cut down to about
+# the figure's pixel width before it is plotted: the min and max of each
+# pixel column by default (spikes survive), or LTTB with --lttb.  Figures
+# render in parallel, one worker per figure.
+#
+#	./quota-report.py trace-1560000000.qtr [PREFIX] [-w 1600] [-j 4] [--per-uid]
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import numpy
+from trace_log import TraceReader
+from trace_log import HELD_FIELDS
+
+# Ticks decoded per pass over the trace
+BATCH_TICKS = 1 << 16
+
+# Figure -> (tick fields, UID fields) it reads from the trace
+FIGURE_FIELDS = {
+    'hist_bw': ((), ('bw',)),
+    'hist_total_bw': (('total_bw', 'total_bw_fg', 'total_bw_bg'), ()),
+    'hist_stats': (('slack_period_fg', 'watermark_fg'), ('sectors',)),
+    'hist_uid_slack_fg': (('slack_period_fg', 'watermark_fg'), ('slack_fg',)),
+    'hist_uid_slack_bg': (('slack_period_bg', 'watermark_bg'), ('slack_bg',)),
+    'per_uid': ((), ('bw', 'sectors')),
+}
+
+def batches(reader):
+    """(position of the first tick, ticks, records) over runs of chunks."""
+    pos = 0
+    ticks = []
+    recs = []
+    n = 0
+    for chunk_ticks, chunk_recs in reader.chunks():
+        ticks.append(chunk_ticks)
+        recs.append(chunk_recs)
+        n += len(chunk_ticks)
+        if n >= BATCH_TICKS:
+            yield pos, numpy.concatenate(ticks), numpy.concatenate(recs)
+            pos += n
+            ticks = []
+            recs = []
+            n = 0
+    if ticks:
+        yield pos, numpy.concatenate(ticks), numpy.concatenate(recs)
+
+def trace_uids(reader):
+    uids = set()
+    for _, _, recs in batches(reader):
+        uids.update(numpy.unique(recs['uid']).tolist())
+    return sorted(uids)
+
+def envelope(x, lo, hi):
+    """Line through each column's min and max; draws like the raw series."""
+    return numpy.repeat(x, 2), numpy.column_stack((lo, hi)).ravel()
+
+def reduce_minmax(reader, width, tick_fields, uid_fields, uids=None):
+    """Min/max per pixel column in one streaming pass over the trace.
+
+    A UID missing from some ticks of a column counts as 0 there, as in
+    the dense series, except for HELD_FIELDS, which hold the value of the
+    UID's last record or are 0 after a rollover that cleared them: ticks
+    of a column before its first record or rollover have the value the
+    previous column ended with.  Memory is columns x UIDs, not ticks x
+    UIDs.
+    """
+    n = len(reader)
+    per = max(1, -(-n // max(width, 1)))
+    cols = max(-(-n // per), 1)
+    x = numpy.zeros(cols)
+    seen = numpy.zeros(cols, bool)
+    t_lo = {f: numpy.full(cols, numpy.inf) for f in tick_fields}
+    t_hi = {f: numpy.full(cols, -numpy.inf) for f in tick_fields}
+    rows = {}
+    u_lo = {f: numpy.zeros((0, cols)) for f in uid_fields}
+    u_hi = {f: numpy.zeros((0, cols)) for f in uid_fields}
+    u_sum = {f: numpy.zeros(0) for f in uid_fields}
+    count = numpy.zeros((0, cols), numpy.int64)
+    # First and last tick with a record per UID and column, and the
+    # values of the last one
+    u_first = numpy.zeros((0, cols), numpy.int64)
+    u_last = numpy.zeros((0, cols), numpy.int64)
+    u_end = {f: numpy.zeros((0, cols)) for f in uid_fields}
+    # Rollover bit -> first and last tick setting it and how many did,
+    # per column, and per UID and column the records on those ticks
+    bits = set(HELD_FIELDS[f] for f in uid_fields if HELD_FIELDS.get(f))
+    reset_first = {bit: numpy.full(cols, n) for bit in bits}
+    reset_last = {bit: numpy.full(cols, -1) for bit in bits}
+    reset_count = {bit: numpy.zeros(cols, numpy.int64) for bit in bits}
+    u_on_reset = {bit: numpy.zeros((0, cols), numpy.int64) for bit in bits}
+    throttled = {}
+    t0 = None
+
+    for pos, ticks, recs in batches(reader):
+        if not len(ticks):
+            continue
+        if t0 is None:
+            t0 = ticks['time'][0]
+        col = (pos + numpy.arange(len(ticks))) // per
+        starts = numpy.flatnonzero(numpy.r_[True, col[1:] != col[:-1]])
+        c = col[starts]
+        x[c] = numpy.where(seen[c], x[c], ticks['time'][starts] - t0)
+        seen[c] = True
+        for f in tick_fields:
+            v = ticks[f].astype(numpy.float64)
+            t_lo[f][c] = numpy.minimum(t_lo[f][c], numpy.minimum.reduceat(v, starts))
+            t_hi[f][c] = numpy.maximum(t_hi[f][c], numpy.maximum.reduceat(v, starts))
+        tick_pos = pos + numpy.arange(len(ticks))
+        for bit in bits:
+            reset = numpy.flatnonzero(ticks['rollover'] & bit)
+            numpy.minimum.at(reset_first[bit], col[reset], tick_pos[reset])
+            numpy.maximum.at(reset_last[bit], col[reset], tick_pos[reset])
+            numpy.add.at(reset_count[bit], col[reset], 1)
+        if not uid_fields or not len(recs):
+            continue
+
+        rec_col = numpy.repeat(col, ticks['n_uids'])
+        rec_time = numpy.repeat(ticks['time'], ticks['n_uids'])
+        rec_pos = numpy.repeat(tick_pos, ticks['n_uids'])
+        rec_rollover = numpy.repeat(ticks['rollover'], ticks['n_uids'])
+        if uids is not None:
+            keep = numpy.isin(recs['uid'], uids)
+            recs = recs[keep]
+            rec_col = rec_col[keep]
+            rec_time = rec_time[keep]
+            rec_pos = rec_pos[keep]
+            rec_rollover = rec_rollover[keep]
+        batch_uids, inv = numpy.unique(recs['uid'], return_inverse=True)
+        new = [uid for uid in batch_uids.tolist() if uid not in rows]
+        if new:
+            for uid in new:
+                rows[uid] = len(rows)
+            for f in uid_fields:
+                u_lo[f] = numpy.vstack((u_lo[f], numpy.full((len(new), cols), numpy.inf)))
+                u_hi[f] = numpy.vstack((u_hi[f], numpy.full((len(new), cols), -numpy.inf)))
+                u_sum[f] = numpy.r_[u_sum[f], numpy.zeros(len(new))]
+                u_end[f] = numpy.vstack((u_end[f], numpy.zeros((len(new), cols))))
+            count = numpy.vstack((count, numpy.zeros((len(new), cols), numpy.int64)))
+            u_first = numpy.vstack((u_first, numpy.full((len(new), cols), n)))
+            u_last = numpy.vstack((u_last, numpy.full((len(new), cols), -1)))
+            for bit in bits:
+                u_on_reset[bit] = numpy.vstack((u_on_reset[bit],
+                    numpy.zeros((len(new), cols), numpy.int64)))
+        row = numpy.array([rows[uid] for uid in batch_uids.tolist()])[inv]
+        key = row * cols + rec_col
+        numpy.add.at(count.reshape(-1), key, 1)
+        numpy.minimum.at(u_first.reshape(-1), key, rec_pos)
+        numpy.maximum.at(u_last.reshape(-1), key, rec_pos)
+        for bit in bits:
+            numpy.add.at(u_on_reset[bit].reshape(-1), key, (rec_rollover & bit) > 0)
+        # Records are in tick order: the last one of each key is its end
+        end_keys, end = numpy.unique(key[::-1], return_index=True)
+        end = len(key) - 1 - end
+        for f in uid_fields:
+            v = recs[f].astype(numpy.float64)
+            numpy.minimum.at(u_lo[f].reshape(-1), key, v)
+            numpy.maximum.at(u_hi[f].reshape(-1), key, v)
+            numpy.add.at(u_sum[f], row, v)
+            u_end[f].reshape(-1)[end_keys] = v[end]
+
+        limited = recs['limit'] >= 0
+        if limited.any():
+            first_uids, first = numpy.unique(recs['uid'][limited], return_index=True)
+            for uid, when in zip(first_uids.tolist(), rec_time[limited][first].tolist()):
+                throttled.setdefault(str(uid), when - t0)
+
+    col_ticks = numpy.full(cols, per)
+    col_ticks[-1] = n - (cols - 1) * per
+    series = {
+        'ticks': {f: envelope(x, t_lo[f], t_hi[f]) for f in tick_fields},
+        'uids': {f: {} for f in uid_fields},
+        'mean': {f: {} for f in uid_fields},
+        'throttled': throttled,
+        'length': n,
+    }
+    if per == 1:
+        series['ticks'] = {f: (x, t_lo[f]) for f in tick_fields}
+    missing = count < col_ticks
+    col_start = numpy.arange(cols) * per
+    for f in uid_fields:
+        if f in HELD_FIELDS:
+            bit = HELD_FIELDS[f]
+            end = u_end[f]
+            has_event = count > 0
+            first_event = u_first
+            zero = numpy.zeros(count.shape, bool)
+            if bit:
+                # A rollover after the last record clears the column's end
+                end = numpy.where(reset_last[bit] > u_last, 0, end)
+                has_event = has_event | (reset_count[bit] > 0)
+                first_event = numpy.minimum(u_first, reset_first[bit])
+                # Rollover ticks without a record of the UID are 0
+                zero = reset_count[bit] > u_on_reset[bit]
+            # What each column starts with: the end of the last one before
+            # it with a record or rollover
+            event_col = numpy.where(has_event, numpy.arange(cols), -1)
+            prev = numpy.maximum.accumulate(numpy.c_[numpy.full(len(count), -1),
+                event_col[:, :-1]], axis=1)
+            enter = numpy.where(prev >= 0,
+                numpy.take_along_axis(end, numpy.maximum(prev, 0), axis=1), 0)
+            entered = first_event > col_start
+            lo = numpy.minimum(u_lo[f], numpy.where(entered, enter, numpy.inf))
+            hi = numpy.maximum(u_hi[f], numpy.where(entered, enter, -numpy.inf))
+            lo = numpy.where(zero, numpy.minimum(lo, 0), lo)
+            hi = numpy.where(zero, numpy.maximum(hi, 0), hi)
+        else:
+            lo = numpy.where(missing, numpy.minimum(u_lo[f], 0), u_lo[f])
+            hi = numpy.where(missing, numpy.maximum(u_hi[f], 0), u_hi[f])
+        for uid, r in rows.items():
+            if per == 1:
+                series['uids'][f][str(uid)] = (x, lo[r])
+            else:
+                series['uids'][f][str(uid)] = envelope(x, lo[r], hi[r])
+            series['mean'][f][str(uid)] = u_sum[f][r] / max(n, 1)
+    return series
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points Largest-Triangle-Three-Buckets keeps."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return numpy.arange(n)
+    edges = numpy.linspace(1, n - 1, n_out - 1).astype(numpy.int64)
+    idx = numpy.empty(n_out, numpy.int64)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = numpy.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) -
+            (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+def reduce_lttb(reader, width, tick_fields, uid_fields, uids=None):
+    """LTTB over the dense series; needs ticks x UIDs memory."""
+    ticks = reader.ticks()
+    x = ticks['time'] - ticks['time'][0] if len(ticks) else numpy.zeros(0)
+    def pick(y):
+        y = y.astype(numpy.float64)
+        idx = lttb(x, y, width)
+        return x[idx], y[idx]
+    keep = None if uids is None else set(str(uid) for uid in uids)
+    series = {
+        'ticks': {f: pick(ticks[f]) for f in tick_fields},
+        'uids': {f: {} for f in uid_fields},
+        'mean': {f: {} for f in uid_fields},
+        'throttled': {},
+        'length': len(ticks),
+    }
+    for f in uid_fields:
+        for uid, y in reader.uid_series(f).items():
+            if keep is None or uid in keep:
+                series['uids'][f][uid] = pick(y)
+                series['mean'][f][uid] = float(y.mean())
+    if uid_fields:
+        for uid, limit in reader.uid_series('limit', fill=-1).items():
+            limited = numpy.flatnonzero(limit >= 0)
+            if len(limited) > 0 and (keep is None or uid in keep):
+                series['throttled'][uid] = x[limited[0]]
+    return series
+
+def mark_throttled(pyplot, ax, series, uid):
+    if uid not in series['throttled']:
+        return
+    bottom, top = pyplot.ylim()
+    when = series['throttled'][uid]
+    ax.axvline(when, linestyle='dotted', color='y')
+    pyplot.text(1.05 * when, 0.95 * top, 'Throttled')
+
+def finish(pyplot, ax, ylabel, path, title=None):
+    ax.legend(loc=9, bbox_to_anchor=(0.5, -0.3), ncol=5)
+    ax.set_xlabel('Time (seconds)')
+    ax.set_ylabel(ylabel)
+    if title:
+        ax.set_title(title)
+    pyplot.tight_layout()
+    pyplot.savefig(path)
+    pyplot.close()
+    return [path]
+
+def plot_uid_lines(ax, lines, names, scale=1):
+    for uid, (x, y) in sorted(lines.items()):
+        ax.plot(x, y * scale, label=names.get(uid, uid))
+
+def plot_figure(pyplot, figure, series, opts):
+    names = opts['names']
+    path = "%s%s-%s.pdf" % (opts['prefix'], figure, opts['timestamp'])
+    fig, ax = pyplot.subplots()
+    if figure == 'hist_bw':
+        plot_uid_lines(ax, series['uids']['bw'], names)
+        ax.set_ylim(bottom=0)
+        ax.set_xlim(left=0)
+        mark_throttled(pyplot, ax, series, opts['throttled_uid'])
+        return finish(pyplot, ax, 'Throughput (KiB/s)', path)
+    if figure == 'hist_total_bw':
+        ax.plot(*series['ticks']['total_bw'], label='Total')
+        ax.plot(*series['ticks']['total_bw_bg'], linestyle='dotted', label='Background')
+        ax.plot(*series['ticks']['total_bw_fg'], linestyle='dotted', label='Foreground')
+        ax.set_ylim(bottom=0)
+        ax.set_xlim(left=0)
+        return finish(pyplot, ax, 'Throughput (KiB/s)', path)
+    if figure == 'hist_stats':
+        plot_uid_lines(ax, series['uids']['sectors'], names, 0.5)
+        ax.set_ylim(bottom=0)
+        ax.set_xlim(left=0)
+        ax.plot(*series['ticks']['slack_period_fg'], linestyle='dashed', label='$Slack_{month}$')
+        ax.plot(*series['ticks']['watermark_fg'], linestyle='dotted', label='$W_{mark}$')
+        return finish(pyplot, ax, 'Total write (KiB)', path,
+            'Plot for %d iterations' % series['length'])
+    side = figure[-2:]
+    plot_uid_lines(ax, series['uids']['slack_' + side], names)
+    ax.plot(*series['ticks']['slack_period_' + side], linestyle='dashed', label='$Slack_{hour}$')
+    ax.plot(*series['ticks']['watermark_' + side], linestyle='dashed', label='$W_{mark}$')
+    ax.set_ylim(bottom=0)
+    ax.set_xlim(left=0)
+    mark_throttled(pyplot, ax, series, opts['throttled_uid'])
+    return finish(pyplot, ax, 'Total write (KiB)', path)
+
+def plot_per_uid(pyplot, series, opts):
+    outputs = []
+    for uid, (x, bw) in sorted(series['uids']['bw'].items()):
+        fig, ax1 = pyplot.subplots()
+        ax2 = ax1.twinx()
+        ax1.plot(x, bw, label="bw", color='g')
+        x_stats, stats = series['uids']['sectors'][uid]
+        ax2.plot(x_stats, stats * 0.5, label="stats", color='b')
+        ax1.set_xlabel('Time (seconds)')
+        ax1.set_ylabel('Throughput (KiB/s)', color='g')
+        ax2.set_ylabel('Total write (KiB)', color='b')
+        path = "%s%s-%s-avg%.2f.png" % (opts['prefix'], uid, opts['timestamp'],
+            series['mean']['bw'][uid])
+        pyplot.savefig(path)
+        pyplot.close()
+        outputs.append(path)
+    return outputs
+
+def render(job):
+    """Reduce and draw one figure (or one group of per-UID figures)."""
+    path, figure, opts = job
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as pyplot
+
+    tick_fields, uid_fields = FIGURE_FIELDS[figure]
+    reduce = reduce_lttb if opts['lttb'] else reduce_minmax
+    reader = TraceReader(path)
+    series = reduce(reader, opts['width'], tick_fields, uid_fields, opts.get('uids'))
+    reader.close()
+    if figure == 'per_uid':
+        return plot_per_uid(pyplot, series, opts)
+    return plot_figure(pyplot, figure, series, opts)
+
+def load_names(path):
+    """UID -> app name from the monitor's uid_stats_data.json."""
+    if not path:
+        return {}
+    with open(path) as f:
+        return {uid: data[2] for uid, data in json.load(f).items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot a quota monitor trace")
+    parser.add_argument('trace', help="trace log (.qtr) written by the monitor")
+    parser.add_argument('prefix', nargs='?', default='', help="output file prefix")
+    parser.add_argument('-w', '--width', type=int, default=1600,
+        help="points per series after downsampling (about the plot width in pixels)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help="figures rendered at once")
+    parser.add_argument('--lttb', action='store_true',
+        help="downsample with LTTB instead of per-column min/max (loads dense series)")
+    parser.add_argument('--per-uid', action='store_true', help="also one PNG per UID")
+    parser.add_argument('--throttled-uid', default='1005',
+        help="UID whose first limit is marked on the figures")
+    parser.add_argument('--names', help="uid_stats_data.json with app names")
+    args = parser.parse_args()
+
+    reader = TraceReader(args.trace)
+    timestamp = "%.0f" % reader.meta.get('start_time', time.time())
+    uids = trace_uids(reader) if args.per_uid else []
+    print("%s: %d ticks, %d chunks" % (args.trace, len(reader), len(reader.index)))
+    reader.close()
+
+    opts = {
+        'prefix': "%s-" % args.prefix if args.prefix else "",
+        'timestamp': timestamp,
+        'width': args.width,
+        'lttb': args.lttb,
+        'throttled_uid': args.throttled_uid,
+        'names': load_names(args.names),
+    }
+    jobs = [(args.trace, figure, opts) for figure in FIGURE_FIELDS if figure != 'per_uid']
+    groups = max(args.jobs, 1)
+    for i in range(min(groups, len(uids))):
+        jobs.append((args.trace, 'per_uid', dict(opts, uids=uids[i::groups])))
+
+    started = time.monotonic()
+    outputs = []
+    if args.jobs > 1:
+        with multiprocessing.Pool(min(args.jobs, len(jobs))) as pool:
+            for files in pool.imap_unordered(render, jobs):
+                outputs += files
+    else:
+        for job in jobs:
+            outputs += render(job)
+    for path in sorted(outputs):
+        print(path)
+    print("%d figures in %.1fs" % (len(outputs), time.monotonic() - started))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+
+from forecast import BurstForecaster
+from forecast import FAST_TAU
+from forecast import SLOW_TAU
+from forecast import DecayedRates
+from service_index import ServiceIndex
+from service_index import BURST_KIB
+from budget import Budget
+from budget import FG
+from budget import BG
+from wear import WearEstimate
+from trace_log import ROLLOVER_FG
+from trace_log import ROLLOVER_BG
+
+# Defaults mirror monitor-quota-fgbg.py
+W_MAX = 88 * 1024 * 1024 * 1024
+LIFE_SEC = 2 * 365 * 24 * 3600
+QUOTA_PERIOD_BG = 3600
+QUOTA_PERIOD_FG = 3600 * 24
+RATELIMIT_THRESHOLD_RATE_FG = 0.5
+RATELIMIT_THRESHOLD_RATE_BG = 0.5
+SLK_RATE = 0.5
+# Nested slack periods, coarsest first: (name, period, threshold_rate,
+# charged_by[, recycle]); None is a day charged by fg over an hour
+# charged by bg, from the quota_period and threshold_rate arguments
+QUOTA_TIERS = None
+# Shares of the sustainable rate a leashed fg / bg writer is weighted with
+FAIR_WEIGHT_FG = 2
+FAIR_WEIGHT_BG = 1
+# Leashed UIDs share b_tag with the other writers' rates averaged over
+# about this many seconds, not this tick's, so the shares don't follow
+# every sporadic write; writers below SHARE_FLOOR KiB/s drop out
+SHARE_TAU = 60
+SHARE_FLOOR = 0.01
+# Pre-emptive limits for UIDs forecast to reach their watermark within
+# this many seconds; 0 only leashes at the watermark
+FORECAST_HORIZON = 0
+# Learn which service UIDs write for the foreground app, on top of the
+# service_table entries
+SERVICE_LEARNING = 1
+# An idle UID is still charged every tick while its forecast (KiB/s) is
+# at least this
+FORECAST_FLOOR = 1
+# Re-plan the budget on the device's wear indicator (observe_wear())
+WEAR_PLANNING = 0
+
+# What state()/restore() carry across a monitor restart, besides the budget
+STATE_SCALARS = ('tick',)
+STATE_TABLES = ('uid_prison', 'hist_uid_limit', 'uid_graded')
+
+def water_fill(capacity, demands, weights):
+    """Weighted max-min fair split of capacity: {uid: share}.
+
+    A demand of None is unbounded.  UIDs are served in order of demand
+    per weight; each gets the smaller of its demand and its weight's
+    part of what is left, so whatever light writers leave goes to the
+    heavy ones in proportion to their weights.
+    """
+    order = sorted(demands, key=lambda uid: float('inf') if demands[uid] is None
+        else demands[uid] / weights[uid])
+    total_weight = sum(weights[uid] for uid in demands)
+    left = max(capacity, 0)
+    shares = {}
+    for uid in order:
+        fair = left * weights[uid] / total_weight
+        demand = demands[uid]
+        share = fair if demand is None or demand >= fair else demand
+        shares[uid] = share
+        left -= share
+        total_weight -= weights[uid]
+    return shares
+
+class QuotaPolicy:
+    """The fg/bg slack quota policy, independent of any clock or device.
+
+    step() is fed one sample: the current time in seconds, the per-UID
+    throughput in KiB/s, the foreground UID and the seconds the sample
+    stands for.  It advances the slack periods (a Budget of tiers, by
+    default a fg day over a bg hour), charges the UIDs and
+    returns the limit changes to apply as (uid, rate) pairs, rate -1
+    meaning unleash.  Units follow the monitor: KiB for budgets, bytes/s
+    for rates.  Leashed UIDs share the sustainable rate (b_tag) with the
+    other writers, at their rates averaged over share_tau, by weighted
+    max-min fairness, and are re-rated as those rates change.  With a forecast horizon, a UID whose
+    forecast rate would use up its slack within the horizon is limited
+    early, to the rate at which its slack would last the horizon; the
+    limit tightens as the slack runs out.  Service UIDs writing for the
+    foreground app are charged as foreground: those in service_table and,
+    with service learning, those a ServiceIndex attributes to it.
+
+    uid_throughput only needs the UIDs that wrote, plus new ones (at 0)
+    the tick they show up in the stats: UIDs left out are idle.  The
+    policy keeps the idle UIDs that still matter (leashed, at a watermark
+    or with a live forecast) in its active set and charges those along,
+    so a tick costs O(active UIDs), not O(known UIDs).  With wear
+    planning, observe_wear() re-plans the budget from the device's life
+    time estimate as readings come in (see WearEstimate).
+    """
+
+    def __init__(self, W_max=W_MAX, life_sec=LIFE_SEC, slk_rate=SLK_RATE,
+            quota_period_fg=QUOTA_PERIOD_FG, quota_period_bg=QUOTA_PERIOD_BG,
+            threshold_rate_fg=RATELIMIT_THRESHOLD_RATE_FG,
+            threshold_rate_bg=RATELIMIT_THRESHOLD_RATE_BG,
+            fair_weight_fg=FAIR_WEIGHT_FG, fair_weight_bg=FAIR_WEIGHT_BG,
+            forecast_horizon=FORECAST_HORIZON, forecast_fast_tau=FAST_TAU,
+            forecast_slow_tau=SLOW_TAU, share_tau=SHARE_TAU, share_floor=SHARE_FLOOR,
+            service_learning=SERVICE_LEARNING, service_hints=None,
+            tiers=QUOTA_TIERS, wear_planning=WEAR_PLANNING, service_table=None, known_uids=(),
+            verbose=False):
+        if tiers is None:
+            tiers = [('day', quota_period_fg, threshold_rate_fg, FG),
+                ('hour', quota_period_bg, threshold_rate_bg, BG)]
+        self.budget = Budget(W_max, life_sec, slk_rate, tiers)
+        self.fg_tier = self.budget.charged[FG]
+        self.bg_tier = self.budget.charged[BG]
+        self.wear = WearEstimate(W_max) if wear_planning else None
+        self.fair_weight_fg = fair_weight_fg
+        self.fair_weight_bg = fair_weight_bg
+        self.writers = DecayedRates(share_tau, share_floor)
+        self.forecast_horizon = forecast_horizon
+        self.forecaster = None
+        if forecast_horizon > 0:
+            self.forecaster = BurstForecaster(forecast_fast_tau, forecast_slow_tau)
+        self.services = None
+        if service_learning:
+            self.services = ServiceIndex(service_table, service_hints, verbose)
+            # fg uid -> set of service UIDs, kept up to date by the index
+            self.service_table = self.services.table
+        else:
+            self.service_table = service_table or {}
+        self.verbose = verbose
+
+        # uid -> applied rate
+        self.uid_prison = {}
+        # uid -> pre-emptive rate (KiB/s) of UIDs leashed on a forecast
+        self.uid_graded = {}
+        # uid -> tick of its first leash
+        self.hist_uid_limit = {}
+        self.uid_seen = set(known_uids)
+        self.num_uniq_uid = len(self.uid_seen)
+        # UIDs in the stats since the start, idle or not
+        self.uid_present = set()
+        # uid -> throughput of the UIDs charged this tick
+        self.uid_active = {}
+
+        self.tick = 0
+        self.total = 0
+        self.total_fg = 0
+        self.total_bg = 0
+        self.dt = 1
+        self.is_phone_active = False
+        # Slack periods and watermarks as they were before charging this tick
+        self.tick_state = (0, 0, 0, 0)
+        # Trace rollover bits of the tiers that started a period this tick
+        self.rollover = 0
+
+    def state(self):
+        """Budgets, periods, per-UID slack and leashes as a JSON-able dict.
+
+        The tables are copies, so the result stays valid as a reference
+        for the next checkpoint diff.
+        """
+        state = {name: getattr(self, name) for name in STATE_SCALARS}
+        state['budget'] = self.budget.state()
+        for name in STATE_TABLES:
+            state[name] = dict(getattr(self, name))
+        state['uid_seen'] = dict.fromkeys(self.uid_seen, 1)
+        state['uid_present'] = dict.fromkeys(self.uid_present, 1)
+        state['writers'] = self.writers.state()
+        if self.forecaster is not None:
+            state['forecast'] = self.forecaster.state()
+        if self.services is not None:
+            state['services'] = self.services.state()
+        if self.wear is not None:
+            state['wear'] = self.wear.state()
+        return state
+
+    def restore(self, state):
+        for name in STATE_SCALARS:
+            setattr(self, name, state[name])
+        for name in STATE_TABLES:
+            setattr(self, name, dict(state.get(name, {})))
+        self.budget.restore(state['budget'])
+        self.uid_seen = set(state['uid_seen'])
+        self.num_uniq_uid = len(self.uid_seen)
+        self.uid_present = set(state['uid_present'])
+        if 'writers' in state:
+            self.writers.restore(state['writers'])
+        # A forecaster turned on since the checkpoint starts out empty
+        if self.forecaster is not None and 'forecast' in state:
+            self.forecaster.restore(state['forecast'])
+        if self.services is not None:
+            self.services.restore(state.get('services', {}))
+        if self.wear is not None:
+            self.wear.restore(state.get('wear', {}))
+        # Candidates; the next step keeps those still held
+        self.uid_active = dict.fromkeys(self.uid_prison, 0)
+        for tier in (self.fg_tier, self.bg_tier):
+            self.uid_active.update(dict.fromkeys(tier.uid_slack, 0))
+        if self.forecaster is not None:
+            self.uid_active.update(dict.fromkeys(self.forecaster.rates, 0))
+
+    def log(self, msg):
+        if self.verbose:
+            print(msg)
+
+    @property
+    def w_left(self):
+        return self.budget.w_left
+
+    @property
+    def uid_slack_fg(self):
+        return self.fg_tier.uid_slack
+
+    @property
+    def uid_slack_bg(self):
+        return self.bg_tier.uid_slack
+
+    def observe_wear(self, reading, now):
+        """Re-plan the budget on a (level, pre_eol) wear reading; returns
+        the new KiB left, None if the plan stands."""
+        if self.wear is None or reading is None:
+            return None
+        w_left = self.wear.observe(reading, self.budget.written, self.budget.w_left)
+        if w_left is not None:
+            self.log("Wear level %d pre-EOL %d: w_left %.2f -> %.2f GiB" % (reading[0], reading[1],
+                self.budget.w_left / 1024 / 1024, w_left / 1024 / 1024))
+            self.budget.replan(w_left, now)
+        return w_left
+
+    def is_fg_uid(self, uid, fg_uid):
+        if uid == fg_uid:
+            return True
+        if fg_uid in self.service_table and uid in self.service_table[fg_uid]:
+            return True
+        return False
+
+    def is_uid_ratelimited(self, uid):
+        return uid in self.uid_prison
+
+    def is_fg_present(self, fg_uid):
+        """True if the fg app or one of its services is in the stats."""
+        if fg_uid in self.uid_present:
+            return True
+        for uid in self.service_table.get(fg_uid, ()):
+            if uid in self.uid_present:
+                return True
+        return False
+
+    def holds(self, uid):
+        """True if an idle UID has to stay in the active set."""
+        if uid in self.uid_prison:
+            return True
+        # Slack only grows with writes and watermarks only rise, so an idle
+        # UID below both of its watermarks stays below them
+        for tier in (self.fg_tier, self.bg_tier):
+            if tier.uid_slack.get(uid, 0) >= 0.99 * tier.threshold:
+                return True
+        return self.forecaster is not None and self.forecaster.forecast(uid) >= FORECAST_FLOOR
+
+    def leash(self, actions, uid, rate):
+        if uid in self.uid_prison:
+            self.log("Leashing leashed uid %s with rate %d" % (uid, rate))
+        self.uid_prison[uid] = rate
+        if uid not in self.hist_uid_limit:
+            self.hist_uid_limit[uid] = self.tick
+        actions.append((uid, rate))
+
+    def unleash(self, actions, uid):
+        del self.uid_prison[uid]
+        self.uid_graded.pop(uid, None)
+        actions.append((uid, -1))
+
+    def charge(self, actions, uid, throughput, tier):
+        """Charge the UID's slack on the tier; True if it has to be leashed.
+
+        The per-UID watermarks together may promise more than the period
+        has: once it is spent, whoever writes over b_tag is leashed and
+        stays so until the period ends.
+        """
+        uid_slack = tier.uid_slack
+        threshold = tier.threshold
+        if uid not in uid_slack:
+            uid_slack[uid] = 0
+        # An overdrawn budget (b_tag < 0) charges writes in full
+        b_tag = max(tier.b_tag, 0)
+        if self.total > b_tag:
+            fraction = (self.total - b_tag) / self.total
+            uid_slack[uid] += fraction * throughput * self.dt
+            if throughput > 0 and (tier.spent or tier.slack <= (self.total - b_tag) * self.dt):
+                tier.spent = True
+                self.uid_graded.pop(uid, None)
+                return True
+            if uid_slack[uid] >= 0.99 * threshold:
+                self.uid_graded.pop(uid, None)
+                return True
+            elif self.forecaster is not None and self.grade(uid,
+                    0.99 * threshold - uid_slack[uid], fraction):
+                return True
+            elif uid in self.uid_prison and not tier.spent:
+                self.unleash(actions, uid)
+        elif uid in self.uid_prison and not tier.spent and uid_slack[uid] < 0.99 * threshold:
+            self.unleash(actions, uid)
+        return False
+
+    def grade(self, uid, slack_left, fraction):
+        """True if the UID is forecast to use up slack_left within the
+        horizon; its pre-emptive rate is then the one that makes the
+        slack last the horizon.  A graded UID is let go only once its
+        forecast is back beyond twice the horizon."""
+        horizon = self.forecast_horizon
+        if uid in self.uid_graded:
+            horizon *= 2
+        if self.forecaster.eta(uid, slack_left, fraction) >= horizon:
+            return False
+        self.uid_graded[uid] = slack_left / (fraction * self.forecast_horizon)
+        return True
+
+    def allocate(self, actions, fg_uid, leash):
+        """Leash `leash` and re-rate the leashed UIDs at their fair share.
+
+        The leashed UIDs want unbounded rates; the other recent writers
+        are served their averaged rate first.  UIDs idle for long don't
+        dilute the shares.
+        """
+        if not leash and not self.uid_prison:
+            return
+        b_tag = self.fg_tier.b_tag if self.is_phone_active else self.bg_tier.b_tag
+        demands = self.writers.current()
+        weights = {}
+        for uid in leash:
+            demands[uid] = None
+        for uid in self.uid_prison:
+            demands[uid] = None
+        for uid in demands:
+            weights[uid] = self.fair_weight_fg if self.is_fg_uid(uid, fg_uid) else self.fair_weight_bg
+        shares = water_fill(b_tag, demands, weights)
+        for uid in leash:
+            self.leash(actions, uid, max(shares[uid], self.uid_graded.get(uid, 0)) * 1024)
+        for uid, rate in self.uid_prison.items():
+            new_rate = max(shares[uid], self.uid_graded.get(uid, 0)) * 1024
+            if uid not in leash and int(new_rate) != int(rate):
+                self.uid_prison[uid] = new_rate
+                actions.append((uid, new_rate))
+
+    def step(self, now, uid_throughput, fg_uid, dt=1):
+        starts = (self.fg_tier.start, self.bg_tier.start)
+        self.budget.advance(now, self.log)
+        self.rollover = ((ROLLOVER_FG if self.fg_tier.start != starts[0] else 0) |
+            (ROLLOVER_BG if self.bg_tier.start != starts[1] else 0))
+
+        self.tick += 1
+        self.dt = dt
+        if self.services is not None:
+            self.services.tick(fg_uid, dt)
+        if self.forecaster is not None:
+            self.forecaster.tick(dt)
+        self.writers.tick(dt)
+        for uid, throughput in uid_throughput.items():
+            if throughput > 0:
+                self.writers.observe(uid, throughput, dt)
+            if uid not in self.uid_present:
+                self.uid_present.add(uid)
+                if uid not in self.uid_seen:
+                    self.uid_seen.add(uid)
+                    self.num_uniq_uid += 1
+
+        active = dict(uid_throughput)
+        for uid in self.uid_active:
+            if uid not in active and self.holds(uid):
+                active[uid] = 0
+        self.uid_active = active
+
+        self.total = sum(uid_throughput.values())
+        self.total_fg = 0
+        self.total_bg = 0
+
+        fg_tier = self.fg_tier
+        bg_tier = self.bg_tier
+        self.tick_state = (fg_tier.slack, bg_tier.slack, fg_tier.threshold, bg_tier.threshold)
+
+        actions = []
+        leash = []
+        self.is_phone_active = self.is_fg_present(fg_uid)
+        for uid, throughput in active.items():
+            if self.forecaster is not None:
+                self.forecaster.observe(uid, throughput, dt)
+            if throughput >= BURST_KIB and self.services is not None:
+                self.services.observe(uid, throughput, fg_uid, dt)
+            if self.is_fg_uid(uid, fg_uid):
+                # Foreground app
+                self.log("Foreground %s %s" % (uid, fg_uid))
+                self.total_fg += throughput
+                if self.charge(actions, uid, throughput, fg_tier):
+                    leash.append(uid)
+            else:
+                # background app
+                self.total_bg += throughput
+                if self.charge(actions, uid, throughput, bg_tier):
+                    leash.append(uid)
+        self.allocate(actions, fg_uid, leash)
+
+        if self.is_phone_active:
+            self.log("Phone active: %s" % (fg_uid))
+        self.budget.charge(FG if self.is_phone_active else BG, self.total, dt)
+
+        return actions
+
+    def trace_tick(self, trace, now, fg_uid, uid_throughput, uid_sectors, uids=None):
+        """Append this tick to a TraceWriter in the monitor's layout.
+
+        Only the active UIDs are recorded unless `uids` says otherwise;
+        uid_sectors has to have them all, idle ones included.
+        """
+        fg_uid_int = int(fg_uid) if fg_uid.lstrip('-').isdigit() else -1
+        if uids is None:
+            uids = self.uid_active
+        trace.add_tick((self.tick, now, fg_uid_int, self.total, self.total_fg, self.total_bg)
+            + self.tick_state + (self.w_left, self.rollover),
+            [(int(uid), uid_throughput.get(uid, 0), uid_sectors.get(uid, 0),
+                self.uid_slack_fg.get(uid, 0), self.uid_slack_bg.get(uid, 0),
+                self.uid_prison.get(uid, -1))
+                for uid in uids])
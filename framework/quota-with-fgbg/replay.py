@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import json
+import time
+from trace_log import TraceReader
+from trace_log import TraceWriter
+from quota_policy import QuotaPolicy
+
+# Trace meta keys -> QuotaPolicy arguments
+META_PARAMS = {
+    'W_max': 'W_max',
+    'life_sec': 'life_sec',
+    'slk_rate': 'slk_rate',
+    'quota_period_fg': 'quota_period_fg',
+    'quota_period_bg': 'quota_period_bg',
+    'ratelimit_threshold_rate_fg': 'threshold_rate_fg',
+    'ratelimit_threshold_rate_bg': 'threshold_rate_bg',
+    'fair_weight_fg': 'fair_weight_fg',
+    'fair_weight_bg': 'fair_weight_bg',
+    'share_tau': 'share_tau',
+    'forecast_horizon': 'forecast_horizon',
+    'service_learning': 'service_learning',
+    'quota_tiers': 'tiers',
+    'tiers': 'tiers',
+}
+
+class FgTimeline:
+    """Foreground UID over time from [[time, uid], ...] change points."""
+
+    def __init__(self, changes):
+        changes = sorted(changes)
+        self.times = [t for t, _ in changes]
+        self.uids = [str(uid) for _, uid in changes]
+
+    def at(self, now):
+        i = bisect.bisect_right(self.times, now) - 1
+        return self.uids[i] if i >= 0 else '-1'
+
+# Monitor constant names accepted as parameter overrides
+MONITOR_PARAMS = {
+    'W_MAX': 'W_max',
+    'LIFE_SEC': 'life_sec',
+    'SLK_RATE': 'slk_rate',
+    'QUOTA_PERIOD_FG': 'quota_period_fg',
+    'QUOTA_PERIOD_BG': 'quota_period_bg',
+    'RATELIMIT_THRESHOLD_RATE_FG': 'threshold_rate_fg',
+    'RATELIMIT_THRESHOLD_RATE_BG': 'threshold_rate_bg',
+    'FAIR_WEIGHT_FG': 'fair_weight_fg',
+    'FAIR_WEIGHT_BG': 'fair_weight_bg',
+    'SHARE_TAU': 'share_tau',
+    'FORECAST_HORIZON': 'forecast_horizon',
+    'SERVICE_LEARNING': 'service_learning',
+    'QUOTA_TIERS': 'tiers',
+    'DELAY_UPDATE_FG_UID': 'fg_delay',
+}
+
+def trace_params(meta):
+    return {arg: meta[key] for key, arg in META_PARAMS.items() if key in meta}
+
+def replay(path, params=None, fg_timeline=None, out=None, enforce=False, check=False,
+        service_table=None, attackers=()):
+    """Run QuotaPolicy over a recorded trace as fast as possible.
+
+    path may also be an open TraceReader, which is left open.  params
+    override the policy parameters recorded in the trace; fg_delay models
+    polling the fg UID every that many ticks.  With enforce, leashed UIDs
+    only get min(recorded, limit) through, as the kernel would have let
+    them; with check, the replayed limits are compared with the recorded
+    ones.  Returns a summary dict with the policy, its decisions, the
+    seconds from the start to each UID's first leash, the KiB the
+    `attackers` got written and the seconds other UIDs spent leashed
+    (fg_throttled counts those in the foreground only).
+    """
+    if isinstance(path, TraceReader):
+        reader = path
+    else:
+        reader = TraceReader(path)
+    params = dict((MONITOR_PARAMS.get(k, k), v) for k, v in (params or {}).items())
+    fg_delay = params.pop('fg_delay', 0)
+    interval = reader.meta.get('interval', 1)
+    # Older monitors stepped the policy by one second per tick
+    monotonic = reader.meta.get('clock') == 'monotonic'
+    policy_params = trace_params(reader.meta)
+    # Traces from before service learning only had the static table
+    policy_params.setdefault('service_learning', 0)
+    policy_params.update(params)
+    if service_table is None:
+        service_table = reader.meta.get('service_table')
+    policy = QuotaPolicy(service_table=service_table, **policy_params)
+    writer = None
+    if out is not None:
+        writer = TraceWriter(out, dict(reader.meta, replay_of=str(path), **params))
+
+    uid_str = {}
+    # Sparse traces leave out idle UIDs, whose sectors stay as they were
+    uid_sectors = {}
+    decisions = []
+    written = 0
+    mismatches = 0
+    start_time = None
+    last_time = None
+    first_leash = {}
+    fg_throttled = 0
+    benign_throttled = 0
+    attacker_written = 0
+    fg_uid = '-1'
+    fg_refresh = 0
+    attackers = set(str(uid) for uid in attackers)
+    started = time.perf_counter()
+    for ticks, recs in reader.chunks():
+        t_time = ticks['time'].tolist()
+        t_fg = ticks['fg_uid'].tolist()
+        t_n = ticks['n_uids'].tolist()
+        r_uid = recs['uid'].tolist()
+        r_bw = recs['bw'].tolist()
+        r_sectors = recs['sectors'].tolist()
+        r_limit = recs['limit'].tolist()
+        pos = 0
+        for i in range(len(t_time)):
+            now = t_time[i]
+            end = pos + t_n[i]
+            uid_throughput = {}
+            for j in range(pos, end):
+                uid = uid_str.get(r_uid[j])
+                if uid is None:
+                    uid = uid_str[r_uid[j]] = str(r_uid[j])
+                bw = r_bw[j]
+                if enforce and uid in policy.uid_prison:
+                    bw = min(bw, policy.uid_prison[uid] / 1024)
+                uid_throughput[uid] = bw
+                uid_sectors[uid] = r_sectors[j]
+
+            if start_time is None:
+                start_time = now
+            if not monotonic:
+                dt = 1
+            elif last_time is None:
+                dt = interval
+            else:
+                dt = now - last_time
+            last_time = now
+            if fg_refresh > 0:
+                fg_refresh -= 1
+            else:
+                if fg_timeline is not None:
+                    fg_uid = fg_timeline.at(now)
+                else:
+                    fg_uid = uid_str.get(t_fg[i]) or str(t_fg[i])
+                fg_refresh = fg_delay
+
+            for uid, rate in policy.step(now, uid_throughput, fg_uid, dt):
+                decisions.append((policy.tick, uid, rate))
+                if rate >= 0 and uid not in first_leash:
+                    first_leash[uid] = now - start_time
+            written += policy.total * dt
+
+            for uid in attackers:
+                attacker_written += uid_throughput.get(uid, 0) * dt
+            for uid in policy.uid_prison:
+                if uid not in attackers and uid in uid_throughput:
+                    benign_throttled += dt
+                    if policy.is_fg_uid(uid, fg_uid):
+                        fg_throttled += dt
+
+            if check:
+                for j in range(pos, end):
+                    recorded = r_limit[j] >= 0
+                    if recorded != (uid_str[r_uid[j]] in policy.uid_prison):
+                        mismatches += 1
+            if writer is not None:
+                policy.trace_tick(writer, now, fg_uid, uid_throughput, uid_sectors)
+            pos = end
+
+    elapsed = time.perf_counter() - started
+    if reader is not path:
+        reader.close()
+    if writer is not None:
+        writer.close()
+    return {
+        'policy': policy,
+        'decisions': decisions,
+        'ticks': policy.tick,
+        'written': written,
+        'mismatches': mismatches,
+        'first_leash': first_leash,
+        'fg_throttled': fg_throttled,
+        'benign_throttled': benign_throttled,
+        'attacker_written': attacker_written,
+        'elapsed': elapsed,
+    }
+
+def parse_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a trace log through the quota policy")
+    parser.add_argument('trace')
+    parser.add_argument('-p', '--param', action='append', default=[],
+        help="policy parameter override, e.g. quota_period_fg=43200")
+    parser.add_argument('-f', '--fg-timeline',
+        help="JSON [[time, uid], ...] replacing the recorded fg UID")
+    parser.add_argument('-o', '--out', help="write the replayed run as a trace log")
+    parser.add_argument('--enforce', action='store_true',
+        help="cap leashed UIDs at their limit")
+    parser.add_argument('--check', action='store_true',
+        help="compare limits with the recorded run")
+    args = parser.parse_args()
+
+    params = {}
+    for param in args.param:
+        name, value = param.split('=', 1)
+        params[name] = parse_value(value)
+    fg_timeline = None
+    if args.fg_timeline:
+        json_file = open(args.fg_timeline, 'r')
+        fg_timeline = FgTimeline(json.load(json_file))
+        json_file.close()
+
+    result = replay(args.trace, params, fg_timeline, args.out, args.enforce, args.check)
+    print("ticks %d written %.2f KiB decisions %d leashed %d elapsed %.3fs (%.0f ticks/s)"
+        % (result['ticks'], result['written'], len(result['decisions']),
+            len(result['policy'].hist_uid_limit), result['elapsed'],
+            result['ticks'] / max(result['elapsed'], 1e-9)))
+    if args.check:
+        print("limit mismatches %d" % result['mismatches'])
+
+if __name__ == '__main__':
+    main()
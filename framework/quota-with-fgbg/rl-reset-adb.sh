@@ -1,5 +1,5 @@
 #!/bin/bash
 
-adb shell "su -c 'echo > /proc/diskstats_uid_global'"
+${ADB:-adb} shell "su -c 'echo > /proc/diskstats_uid_global'"
 
-adb shell "su -c 'echo "-1 0" > /proc/ratelimit_uid'"
+${ADB:-adb} shell "su -c 'echo "-1 0" > /proc/ratelimit_uid'"
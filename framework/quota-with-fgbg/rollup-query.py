@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+# What a monitor saw over a window, from its saved rollups: fg/bg writes,
+# watermarks and, per UID, KiB written, max and p99 rates and the seconds
+# it spent leashed.  Times are wall-clock seconds, or negative for that
+# long before the last tick.
+#
+#	./rollup-query.py quota_rollups.json -f -3600
+#	./rollup-query.py quota_rollups.json -f 1560000000 -t 1560086400 -u 10123
+
+import argparse
+import time
+from rollup import Rollups
+
+GIB = 1024 * 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a monitor's rollups over a window")
+    parser.add_argument('rollups', help="quota_rollups.json saved by the monitor")
+    parser.add_argument('-f', '--start', type=float, default=-3600,
+        help="window start (default: an hour before the last tick)")
+    parser.add_argument('-t', '--end', type=float, help="window end (default: the last tick)")
+    parser.add_argument('-u', '--uid', action='append', default=[], help="only these UIDs")
+    parser.add_argument('-n', '--top', type=int, default=10, help="UIDs listed, by KiB written")
+    args = parser.parse_args()
+
+    rollups = Rollups()
+    if not rollups.load(args.rollups):
+        parser.error("cannot read %s" % args.rollups)
+    if rollups.ticks:
+        last = rollups.ticks[-1][0]
+    elif rollups.minute is not None:
+        last = rollups.minute.start + rollups.minute.span
+    else:
+        parser.error("%s is empty" % args.rollups)
+    start = last + args.start if args.start < 0 else args.start
+    end = last if args.end is None else (last + args.end if args.end < 0 else args.end)
+
+    tier, bucket = rollups.query(start, end)
+    print("%s - %s from %s buckets: %.0fs covered" % (time.ctime(start), time.ctime(end),
+        tier, bucket.secs))
+    print("written fg %.3f GiB bg %.3f GiB, max %.2f KiB/s, watermark fg %.2f bg %.2f, w_left %.2f GiB"
+        % (bucket.fg_kib / GIB, bucket.bg_kib / GIB, bucket.max_total, bucket.watermark_fg,
+        bucket.watermark_bg, bucket.w_left / GIB))
+    uids = args.uid or sorted(bucket.uids, key=lambda uid: -bucket.uids[uid][0])[:args.top]
+    print("%8s %12s %10s %10s %10s" % ('uid', 'KiB', 'max KiB/s', 'p99 KiB/s', 'leashed s'))
+    for uid in uids:
+        kib, rate_max, leashed, _ = bucket.uids.get(uid, (0, 0, 0, None))
+        print("%8s %12.0f %10.1f %10.1f %10.0f" % (uid, kib, rate_max,
+            bucket.percentile(uid, 0.99), leashed))
+
+if __name__ == '__main__':
+    main()
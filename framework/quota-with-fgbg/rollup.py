@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import collections
+import json
+import os
+import threading
+
+# Retention: seconds of full-resolution ticks, then minute and hour buckets
+KEEP_SECONDS = 600
+KEEP_MINUTES = 24 * 60
+KEEP_HOURS = 2 * 365 * 24
+
+MINUTE = 60
+HOUR = 3600
+
+def rate_bucket(rate):
+    """Log2 bucket of a KiB/s rate: [2^(i-1), 2^i), 0 under 1 KiB/s."""
+    return int(rate).bit_length()
+
+class Bucket:
+    """Aggregates of the ticks in [start, start + span).
+
+    fg/bg KiB, the highest total rate and the last watermarks and w_left;
+    per UID the KiB written, the highest rate, the seconds leashed and a
+    log2 histogram of its rates in seconds, idle seconds left implicit.
+    Histograms add up, so buckets merge without losing their p99.
+    """
+
+    def __init__(self, start, span):
+        self.start = start
+        self.span = span
+        self.secs = 0
+        self.fg_kib = 0
+        self.bg_kib = 0
+        self.max_total = 0
+        self.watermark_fg = 0
+        self.watermark_bg = 0
+        self.w_left = 0
+        # uid -> [KiB, max KiB/s, seconds leashed, {log2 bucket: seconds}]
+        self.uids = {}
+
+    def add(self, dt, total_fg, total_bg, watermark_fg, watermark_bg, w_left, uid_rates, leashed):
+        self.secs += dt
+        self.fg_kib += total_fg * dt
+        self.bg_kib += total_bg * dt
+        if total_fg + total_bg > self.max_total:
+            self.max_total = total_fg + total_bg
+        self.watermark_fg = watermark_fg
+        self.watermark_bg = watermark_bg
+        self.w_left = w_left
+        for uid, rate in uid_rates.items():
+            if rate <= 0:
+                continue
+            u = self.uids.get(uid)
+            if u is None:
+                u = self.uids[uid] = [0, 0, 0, {}]
+            u[0] += rate * dt
+            if rate > u[1]:
+                u[1] = rate
+            b = rate_bucket(rate)
+            u[3][b] = u[3].get(b, 0) + dt
+        for uid in leashed:
+            u = self.uids.get(uid)
+            if u is None:
+                u = self.uids[uid] = [0, 0, 0, {}]
+            u[2] += dt
+
+    def merge(self, other):
+        """Fold in a later bucket."""
+        self.secs += other.secs
+        self.fg_kib += other.fg_kib
+        self.bg_kib += other.bg_kib
+        self.max_total = max(self.max_total, other.max_total)
+        self.watermark_fg = other.watermark_fg
+        self.watermark_bg = other.watermark_bg
+        self.w_left = other.w_left
+        for uid, o in other.uids.items():
+            u = self.uids.get(uid)
+            if u is None:
+                u = self.uids[uid] = [0, 0, 0, {}]
+            u[0] += o[0]
+            u[1] = max(u[1], o[1])
+            u[2] += o[2]
+            for b, secs in o[3].items():
+                u[3][b] = u[3].get(b, 0) + secs
+
+    def percentile(self, uid, p):
+        """Upper bound of the rate bucket holding the p-th fraction of
+        the seconds, in KiB/s."""
+        u = self.uids.get(uid)
+        if u is None or not self.secs:
+            return 0
+        rank = p * self.secs
+        seen = self.secs - sum(u[3].values())
+        if seen >= rank:
+            return 0
+        for b in sorted(u[3]):
+            seen += u[3][b]
+            if seen >= rank:
+                return min(1 << b, u[1])
+        return u[1]
+
+    def to_dict(self):
+        return {'start': self.start, 'span': self.span, 'secs': self.secs,
+            'fg_kib': self.fg_kib, 'bg_kib': self.bg_kib, 'max_total': self.max_total,
+            'watermark_fg': self.watermark_fg, 'watermark_bg': self.watermark_bg,
+            'w_left': self.w_left, 'uids': self.uids}
+
+    def copy(self):
+        bucket = Bucket(self.start, self.span)
+        for key in ('secs', 'fg_kib', 'bg_kib', 'max_total', 'watermark_fg', 'watermark_bg',
+                'w_left'):
+            setattr(bucket, key, getattr(self, key))
+        bucket.uids = {uid: [u[0], u[1], u[2], dict(u[3])] for uid, u in self.uids.items()}
+        return bucket
+
+    @classmethod
+    def from_dict(cls, data):
+        bucket = cls(data['start'], data['span'])
+        for key in ('secs', 'fg_kib', 'bg_kib', 'max_total', 'watermark_fg', 'watermark_bg',
+                'w_left'):
+            setattr(bucket, key, data[key])
+        # JSON keys are strings
+        bucket.uids = {uid: [u[0], u[1], u[2], {int(b): s for b, s in u[3].items()}]
+            for uid, u in data['uids'].items()}
+        return bucket
+
+class Rollups:
+    """Monitor history at three resolutions in bounded memory.
+
+    add() keeps the last keep_seconds of ticks as they are and folds each
+    into the current minute bucket; a finished minute goes to a ring of
+    keep_minutes and into the current hour, a finished hour to a ring of
+    keep_hours.  A tick costs O(UIDs in it), a minute rollover O(UIDs in
+    the minute).  query() answers a window from the finest tier that
+    still reaches back to its start, rounded out to that tier's buckets.
+    """
+
+    def __init__(self, keep_seconds=KEEP_SECONDS, keep_minutes=KEEP_MINUTES,
+            keep_hours=KEEP_HOURS):
+        self.keep_seconds = keep_seconds
+        # (time, dt, Bucket.add() arguments...)
+        self.ticks = collections.deque()
+        self.minutes = collections.deque(maxlen=keep_minutes)
+        self.hours = collections.deque(maxlen=keep_hours)
+        self.minute = None
+        self.hour = None
+        self.write_lock = threading.Lock()
+        self.snapshots = 0
+        # Newest snapshot() on disk; an older one finishing later is dropped
+        self.written = 0
+
+    def add(self, now, dt, total_fg, total_bg, watermark_fg, watermark_bg, w_left,
+            uid_rates, leashed):
+        """One tick ending at now; uid_rates in KiB/s, leashed UIDs."""
+        tick = (now, dt, total_fg, total_bg, watermark_fg, watermark_bg, w_left,
+            dict(uid_rates), list(leashed))
+        self.ticks.append(tick)
+        while self.ticks and self.ticks[0][0] <= now - self.keep_seconds:
+            self.ticks.popleft()
+        start = now - now % MINUTE
+        if self.minute is not None and self.minute.start != start:
+            self.close_minute()
+        if self.minute is None:
+            self.minute = Bucket(start, MINUTE)
+        self.minute.add(*tick[1:])
+
+    def close_minute(self):
+        minute = self.minute
+        self.minute = None
+        self.minutes.append(minute)
+        start = minute.start - minute.start % HOUR
+        if self.hour is not None and self.hour.start != start:
+            self.hours.append(self.hour)
+            self.hour = None
+        if self.hour is None:
+            self.hour = Bucket(start, HOUR)
+        self.hour.merge(minute)
+
+    def query(self, start, end):
+        """(tier, Bucket) of [start, end)."""
+        if self.ticks and self.ticks[0][0] - self.ticks[0][1] <= start:
+            bucket = Bucket(start, end - start)
+            for tick in self.ticks:
+                if start < tick[0] <= end:
+                    bucket.add(*tick[1:])
+            return 'second', bucket
+        minutes = list(self.minutes) + [self.minute]
+        hours = list(self.hours) + [self.hour, self.minute]
+        tier, buckets = 'hour', hours
+        if self.minutes and self.minutes[0].start <= start:
+            tier, buckets = 'minute', minutes
+        bucket = Bucket(start, end - start)
+        for b in buckets:
+            if b is not None and b.start < end and b.start + b.span > start:
+                bucket.merge(b)
+        return tier, bucket
+
+    def sizes(self):
+        return {'ticks': len(self.ticks), 'minutes': len(self.minutes), 'hours': len(self.hours)}
+
+    def snapshot(self):
+        """The rollups as they are now, for state() or write() elsewhere.
+
+        Ticks and finished buckets never change once added, so only the
+        open minute and hour are copied: O(UIDs in them), not O(history).
+        """
+        self.snapshots += 1
+        return (self.snapshots, list(self.ticks), list(self.minutes), list(self.hours),
+            self.minute.copy() if self.minute is not None else None,
+            self.hour.copy() if self.hour is not None else None)
+
+    def state(self, snapshot=None):
+        _, ticks, minutes, hours, minute, hour = snapshot or self.snapshot()
+        return {'ticks': ticks,
+            'minutes': [b.to_dict() for b in minutes],
+            'hours': [b.to_dict() for b in hours],
+            'minute': minute.to_dict() if minute is not None else None,
+            'hour': hour.to_dict() if hour is not None else None}
+
+    def restore(self, state):
+        self.ticks.clear()
+        self.ticks.extend(tuple(tick) for tick in state['ticks'])
+        self.minutes.clear()
+        self.minutes.extend(Bucket.from_dict(b) for b in state['minutes'])
+        self.hours.clear()
+        self.hours.extend(Bucket.from_dict(b) for b in state['hours'])
+        self.minute = Bucket.from_dict(state['minute']) if state['minute'] else None
+        self.hour = Bucket.from_dict(state['hour']) if state['hour'] else None
+
+    def save(self, path):
+        """Atomically replace `path` with the rollups as JSON."""
+        self.write(self.snapshot(), path)
+
+    def write(self, snapshot, path):
+        """save() of a snapshot(); safe to run on another thread."""
+        state = self.state(snapshot)
+        with self.write_lock:
+            if snapshot[0] < self.written:
+                return
+            self.written = snapshot[0]
+            tmp = "%s.tmp" % path
+            json_file = open(tmp, 'w')
+            json.dump(state, json_file)
+            json_file.close()
+            os.replace(tmp, path)
+
+    def load(self, path):
+        """Resume from a save(); False if there is none."""
+        try:
+            json_file = open(path, 'r')
+        except IOError:
+            return False
+        self.restore(json.load(json_file))
+        json_file.close()
+        return True
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import asyncio
+import collections
+import time
+
+# Recent lateness samples kept for percentiles
+LATENESS_WINDOW = 1024
+
+class TickScheduler:
+    """Fixed-rate ticks on monotonic deadlines.
+
+    Deadlines are start + n * interval, so the time spent working in a
+    tick does not push the next one out and intervals below a second
+    don't accumulate drift.  When a tick overruns past one or more
+    deadlines those slots are counted as missed and skipped rather than
+    run back to back.
+    """
+
+    def __init__(self, interval, clock=time.monotonic, sleep=time.sleep):
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.slot = 0
+        self.ticks = 0
+        self.missed = 0
+        self.lateness_sum = 0
+        self.lateness_max = 0
+        self.lateness = collections.deque(maxlen=LATENESS_WINDOW)
+
+    def deadline(self):
+        return self.start + self.slot * self.interval
+
+    def advance(self):
+        """Move to the next deadline; returns how long to sleep until it."""
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+            return 0
+        self.slot += 1
+        behind = int((now - self.deadline()) // self.interval)
+        if behind > 0:
+            self.missed += behind
+            self.slot += behind
+        return self.deadline() - now
+
+    def arrived(self):
+        """Account the wake-up; returns the monotonic wake time."""
+        now = self.clock()
+        late = max(now - self.deadline(), 0)
+        self.ticks += 1
+        self.lateness_sum += late
+        self.lateness_max = max(self.lateness_max, late)
+        self.lateness.append(late)
+        return now
+
+    def wait(self):
+        """Sleep until the next deadline; returns the monotonic wake time."""
+        delay = self.advance()
+        if delay > 0:
+            self.sleep(delay)
+        return self.arrived()
+
+    async def wait_async(self):
+        delay = self.advance()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.arrived()
+
+    def miss(self):
+        """Count the current tick as missed, e.g. when it had no sample."""
+        self.missed += 1
+
+    def stats(self):
+        recent = sorted(self.lateness)
+        def pct(p):
+            return recent[min(int(p * len(recent)), len(recent) - 1)] if recent else 0
+        return {
+            'interval': self.interval,
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'lateness_mean': self.lateness_sum / self.ticks if self.ticks else 0,
+            'lateness_p50': pct(0.5),
+            'lateness_p99': pct(0.99),
+            'lateness_max': self.lateness_max,
+        }
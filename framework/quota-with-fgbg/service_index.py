@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import json
+
+# UIDs below this are system services (AID_APP)
+FIRST_APPLICATION_UID = 10000
+PER_USER_RANGE = 100000
+# A service writing at least this many KiB/s is bursting
+BURST_KIB = 64
+# Seconds of bursts with an app in the foreground before the service is
+# attributed to it, halved for hinted services
+MIN_BURST_SECS = 30
+# How much likelier the service bursts with the app in the foreground
+# than overall; attributions are dropped below half of it
+MIN_LIFT = 3
+# All counts are halved after this many seconds, so old habits fade
+HALF_LIFE = 7 * 24 * 3600
+
+# app-list.json names of services that write on an app's behalf
+HINTED_SERVICES = ('MEDIA', 'MEDIA_RW', 'MEDIA_EX', 'MEDIA_CODEC', 'MEDIA_AUDIO',
+    'MEDIA_VIDEO', 'MEDIA_IMAGE', 'MEDIA_DRM', 'DRM', 'CAMERA', 'CAMERASERVER',
+    'AUDIOSERVER', 'SDCARD_RW', 'SDCARD_PICS', 'SDCARD_AV', 'SDCARD_ALL', 'MTP')
+# Packages whose app UIDs act as services (media and download providers)
+HINTED_PACKAGES = ('com.android.providers.', 'com.google.android.providers.',
+    'com.android.externalstorage', 'com.android.mtp')
+
+def load_app_list(path):
+    """uid -> name from extract-apps.py's app-list.json or a packages.list;
+    empty if there is none."""
+    try:
+        f = open(path, 'r')
+    except IOError:
+        return {}
+    if path.endswith('.json'):
+        app_list = {str(uid): name for uid, name in json.load(f).items()}
+    else:
+        app_list = {}
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2 and fields[1].isdigit():
+                app_list.setdefault(fields[1], fields[0])
+    f.close()
+    return app_list
+
+class ServiceIndex:
+    """Which service UIDs write on behalf of which foreground apps.
+
+    Learned from co-occurrence: for every service UID the seconds it
+    bursts (writes BURST_KIB/s or more) are counted, overall and per
+    foreground app, next to the seconds each app spends in the
+    foreground.  A service bursting MIN_LIFT times likelier while an app
+    is in the foreground than overall is attributed to that app once
+    there are MIN_BURST_SECS of evidence.  table maps fg UID -> set of
+    service UIDs, pinned entries included, so the policy's lookup is two
+    dict/set probes.  Only the pairs of a bursting service are
+    re-evaluated, on each of its bursts; counts are halved every
+    HALF_LIFE seconds.  hints (uid -> name, see load_app_list()) mark
+    media, camera and storage services and provider packages as likely
+    services and halve the evidence they need.
+    """
+
+    def __init__(self, pinned=None, hints=None, verbose=False):
+        self.pinned = {fg: set(uids) for fg, uids in (pinned or {}).items()}
+        self.table = {fg: set(uids) for fg, uids in self.pinned.items()}
+        self.hints = hints or {}
+        self.verbose = verbose
+        # uid -> None (not a service), False (service) or True (hinted)
+        self.kind = {}
+        self.total = 0
+        self.age = 0
+        # fg uid -> seconds in the foreground
+        self.fg_time = {}
+        # service uid -> burst seconds, overall and per fg uid
+        self.bursts = {}
+        self.co = {}
+
+    def hint_packages(self, packages):
+        """Take package names -> uid (FgTracker.packages) as hints too."""
+        for name, uid in packages.items():
+            self.hints.setdefault(str(uid), name)
+
+    def classify(self, uid):
+        name = self.hints.get(uid)
+        if name is None:
+            name = self.hints.get(str(int(uid) % PER_USER_RANGE), '')
+        if name in HINTED_SERVICES or name.startswith(HINTED_PACKAGES):
+            kind = True
+        elif int(uid) % PER_USER_RANGE < FIRST_APPLICATION_UID:
+            kind = False
+        else:
+            kind = None
+        self.kind[uid] = kind
+        return kind
+
+    def tick(self, fg_uid, dt):
+        """Account dt seconds of fg_uid in the foreground."""
+        self.total += dt
+        if fg_uid != '-1':
+            self.fg_time[fg_uid] = self.fg_time.get(fg_uid, 0) + dt
+        self.age += dt
+        if self.age >= HALF_LIFE:
+            self.decay()
+
+    def observe(self, uid, throughput, fg_uid, dt):
+        """One UID's throughput (KiB/s) this tick; cheap for non-services."""
+        if throughput < BURST_KIB:
+            return
+        kind = self.kind.get(uid, -1)
+        if kind == -1:
+            kind = self.classify(uid)
+        if kind is None:
+            return
+        self.bursts[uid] = self.bursts.get(uid, 0) + dt
+        if fg_uid == '-1' or fg_uid == uid:
+            return
+        co = self.co.get(uid)
+        if co is None:
+            co = self.co[uid] = {}
+        co[fg_uid] = co.get(fg_uid, 0) + dt
+        self.evaluate(uid)
+
+    def lift(self, uid, fg_uid):
+        fg_time = self.fg_time.get(fg_uid, 0)
+        if fg_time <= 0:
+            return 0
+        return self.co[uid][fg_uid] * self.total / (fg_time * self.bursts[uid])
+
+    def evaluate(self, uid):
+        need = MIN_BURST_SECS / 2 if self.kind[uid] else MIN_BURST_SECS
+        for fg_uid, secs in self.co[uid].items():
+            services = self.table.get(fg_uid)
+            attributed = services is not None and uid in services
+            lift = self.lift(uid, fg_uid)
+            if not attributed and secs >= need and lift >= MIN_LIFT:
+                if services is None:
+                    services = self.table[fg_uid] = set()
+                services.add(uid)
+                self.log("Service %s writes for %s (lift %.1f over %.0fs)" % (uid, fg_uid, lift, secs))
+            elif attributed and lift < MIN_LIFT / 2 and uid not in self.pinned.get(fg_uid, ()):
+                services.discard(uid)
+                self.log("Service %s no longer writes for %s (lift %.1f)" % (uid, fg_uid, lift))
+
+    def decay(self):
+        self.age = 0
+        self.total /= 2
+        for counts in [self.fg_time, self.bursts] + list(self.co.values()):
+            for key in counts:
+                counts[key] /= 2
+        for uid in self.co:
+            self.evaluate(uid)
+
+    def learned(self):
+        """fg uid -> sorted service UIDs, pinned ones left out."""
+        learned = {}
+        for fg_uid, services in self.table.items():
+            uids = sorted(services - self.pinned.get(fg_uid, set()))
+            if uids:
+                learned[fg_uid] = uids
+        return learned
+
+    def state(self):
+        return {'total': self.total, 'age': self.age, 'fg_time': dict(self.fg_time),
+            'bursts': dict(self.bursts), 'co': {uid: dict(co) for uid, co in self.co.items()},
+            'learned': self.learned()}
+
+    def restore(self, state):
+        self.total = state.get('total', 0)
+        self.age = state.get('age', 0)
+        self.fg_time = dict(state.get('fg_time', {}))
+        self.bursts = dict(state.get('bursts', {}))
+        self.co = {uid: dict(co) for uid, co in state.get('co', {}).items()}
+        # In place, the policy holds on to the table
+        self.table.clear()
+        self.table.update((fg, set(uids)) for fg, uids in self.pinned.items())
+        for fg_uid, uids in state.get('learned', {}).items():
+            self.table.setdefault(fg_uid, set()).update(uids)
+        for uid in self.co:
+            if uid not in self.kind:
+                self.classify(uid)
+
+    def log(self, msg):
+        if self.verbose:
+            print(msg)
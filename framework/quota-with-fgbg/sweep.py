@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from replay import replay
+from replay import parse_value
+from trace_log import TraceReader
+
+# Per-worker readers; the traces are mmapped, so all workers share the
+# same page-cache copy read-only
+readers = {}
+
+def init_worker(traces):
+    for path in traces:
+        readers[path] = TraceReader(path)
+
+def run_point(task):
+    point, path, params, attackers = task
+    result = replay(readers[path], params, enforce=True, attackers=attackers)
+    first = [result['first_leash'][uid] for uid in attackers if uid in result['first_leash']]
+    return {
+        'point': point,
+        'trace': path,
+        'written_kib': result['written'],
+        'attacker_written_kib': result['attacker_written'],
+        'attacker_first_throttle_s': min(first) if first else '',
+        'benign_fg_throttled_s': result['fg_throttled'],
+        'benign_throttled_s': result['benign_throttled'],
+        'leashed_uids': len(result['policy'].hist_uid_limit),
+        'elapsed_s': result['elapsed'],
+    }
+
+def expand_grid(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep quota policy parameters over recorded traces")
+    parser.add_argument('traces', nargs='+')
+    parser.add_argument('-g', '--grid', action='append', default=[],
+        help="NAME=V1,V2,... (monitor or QuotaPolicy parameter names)")
+    parser.add_argument('-G', '--grid-file', help="JSON {NAME: [values]}")
+    parser.add_argument('-a', '--attacker', action='append', default=[],
+        help="attacker UID, excluded from benign throttling")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('-o', '--out', help="CSV results table (default stdout)")
+    args = parser.parse_args()
+
+    grid = {}
+    if args.grid_file:
+        json_file = open(args.grid_file, 'r')
+        grid.update(json.load(json_file))
+        json_file.close()
+    for item in args.grid:
+        name, values = item.split('=', 1)
+        grid[name] = [parse_value(v) for v in values.split(',')]
+
+    points = expand_grid(grid)
+    tasks = [(i, path, params, args.attacker)
+        for i, params in enumerate(points) for path in args.traces]
+    print("%d grid points x %d traces on %d workers" % (len(points), len(args.traces), args.jobs),
+        file=sys.stderr)
+
+    started = time.perf_counter()
+    results = []
+    with Pool(args.jobs, init_worker, (args.traces,)) as pool:
+        for row in pool.imap_unordered(run_point, tasks, chunksize=max(1, len(tasks) // (args.jobs * 8))):
+            results.append(row)
+    results.sort(key=lambda row: (row['point'], row['trace']))
+    print("%d runs in %.1fs" % (len(results), time.perf_counter() - started), file=sys.stderr)
+
+    out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    names = sorted(grid)
+    writer = csv.writer(out)
+    writer.writerow(names + ['trace', 'written_kib', 'attacker_written_kib',
+        'attacker_first_throttle_s', 'benign_fg_throttled_s', 'benign_throttled_s',
+        'leashed_uids', 'elapsed_s'])
+    for row in results:
+        writer.writerow([points[row['point']][n] for n in names] + [row['trace'],
+            '%.2f' % row['written_kib'], '%.2f' % row['attacker_written_kib'],
+            row['attacker_first_throttle_s'], row['benign_fg_throttled_s'],
+            row['benign_throttled_s'], row['leashed_uids'], '%.3f' % row['elapsed_s']])
+    if out is not sys.stdout:
+        out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import importlib.util
+import os
+import sys
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+def load_script(name):
+    """Import one of the hyphenated scripts as a module."""
+    path = os.path.join(HERE, name)
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_')[:-3], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,64 @@
+from actuator import HYSTERESIS
+from actuator import UNLEASH_HOLD
+from actuator import ProcBackend
+from actuator import RateActuator
+
+class RecordingBackend:
+    def __init__(self):
+        self.calls = []
+
+    def apply(self, changes):
+        self.calls.append(list(changes))
+
+def test_small_changes_are_suppressed():
+    backend = RecordingBackend()
+    actuator = RateActuator(backend)
+    assert actuator.sync({'10001': 10000}) == [('10001', 10000)]
+    # Within 10% of what is applied: left alone
+    assert actuator.sync({'10001': 10000 * (1 + HYSTERESIS)}) == []
+    assert actuator.sync({'10001': 10000 * (1 - HYSTERESIS)}) == []
+    assert actuator.applied['10001'] == 10000
+    assert actuator.sync({'10001': 11500}) == [('10001', 11500)]
+    assert actuator.sync({'10001': 8000}) == [('10001', 8000)]
+    # One apply() per tick with changes
+    assert backend.calls == [[('10001', 10000)], [('10001', 11500)], [('10001', 8000)]]
+    assert actuator.calls == 3 and actuator.entries == 3
+
+def test_unleash_is_held():
+    backend = RecordingBackend()
+    actuator = RateActuator(backend)
+    actuator.sync({'10001': 4096, '10002': 4096})
+    for _ in range(UNLEASH_HOLD - 1):
+        assert actuator.sync({'10002': 4096}) == []
+    assert actuator.sync({'10002': 4096}) == [('10001', -1)]
+    assert actuator.applied == {'10002': 4096}
+
+def test_back_in_prison_resets_the_hold():
+    actuator = RateActuator(RecordingBackend())
+    actuator.sync({'10001': 4096})
+    assert actuator.sync({}) == []
+    # Leashed again before the hold ran out: nothing to send
+    assert actuator.sync({'10001': 4096}) == []
+    for _ in range(UNLEASH_HOLD - 1):
+        assert actuator.sync({}) == []
+    assert actuator.sync({}) == [('10001', -1)]
+
+def test_retry_resends_on_the_next_diff():
+    actuator = RateActuator(RecordingBackend())
+    changes = actuator.plan({'10001': 4096})
+    actuator.retry(changes)
+    assert actuator.plan({'10001': 4096}) == [('10001', 4096)]
+    actuator.plan({})
+    actuator.plan({})
+    changes = actuator.plan({})
+    assert changes == [('10001', -1)]
+    actuator.retry(changes)
+    # A failed unleash goes out again on the very next diff
+    assert actuator.plan({}) == [('10001', -1)]
+    assert actuator.applied == {}
+
+def test_proc_backend_writes_one_pair_per_write(tmp_path):
+    path = tmp_path / 'ratelimit_uid'
+    path.write_text('')
+    ProcBackend(str(path)).apply([('10001', 4096), ('-1', -1)])
+    assert path.read_text() == "10001 4096\n-1 -1\n"
@@ -0,0 +1,87 @@
+import os
+import time
+import pytest
+import adb_stream
+from adb_stream import AdbStream
+from adb_stream import StatsSampler
+from adb_stream import FRAME_END
+from conftest import HERE
+
+@pytest.fixture
+def fake_adb(tmp_path, monkeypatch):
+    """fake-adb.sh on a device root in tmp_path, with short backoffs."""
+    monkeypatch.setattr(adb_stream, 'ADB', os.path.join(HERE, 'fake-adb.sh'))
+    monkeypatch.setenv('FAKE_ADB_ROOT', str(tmp_path))
+    monkeypatch.delenv('ANDROID_SERIAL', raising=False)
+    monkeypatch.setattr(adb_stream, 'RECONNECT_DELAY_MIN', 0.05)
+    monkeypatch.setattr(adb_stream, 'RECONNECT_DELAY_MAX', 0.4)
+    return tmp_path
+
+def wait_for(cond, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+def connect_gaps(command, connects):
+    times = []
+    lines = []
+    stream = AdbStream(command, lines.append, on_connect=lambda: times.append(time.monotonic()))
+    stream.start()
+    try:
+        wait_for(lambda: len(times) >= connects)
+    finally:
+        stream.stop()
+    return [b - a for a, b in zip(times, times[1:])], lines
+
+def test_reconnect_backs_off(fake_adb):
+    gaps, lines = connect_gaps('echo up', 5)
+    assert lines[:2] == ['up\n', 'up\n']
+    # 0.05, 0.1, 0.2, then capped at RECONNECT_DELAY_MAX
+    for gap, delay in zip(gaps, [0.05, 0.1, 0.2, 0.4]):
+        assert delay <= gap < delay + 0.15
+
+def test_backoff_resets_after_a_long_connection(fake_adb):
+    # Each channel outlives RECONNECT_DELAY_MAX, so every retry waits the minimum
+    gaps, _ = connect_gaps('echo up; sleep 0.5', 4)
+    for gap in gaps:
+        assert 0.55 <= gap < 0.55 + 0.15
+
+def test_restart_respawns(fake_adb):
+    connected = []
+    # exec: no grandchild keeps the pipe open once the "adb" is killed
+    stream = AdbStream('echo up; exec sleep 30', lambda line: None,
+        on_connect=lambda: connected.append(1))
+    stream.start()
+    wait_for(lambda: stream.proc is not None)
+    stream.restart()
+    wait_for(lambda: len(connected) == 2)
+    stream.stop()
+    assert not stream.thread.is_alive()
+
+def test_sampler_frames(fake_adb):
+    (fake_adb / 'proc').mkdir()
+    stats = '0 10 1 count 1 / 4000 [sane]\n\t10001 8 8\n\t-1 8\n'
+    (fake_adb / 'proc' / 'diskstats_uid_global').write_text(stats)
+    frames = []
+    sampler = StatsSampler('/proc/diskstats_uid_global', 0.05,
+        on_frame=lambda lines, arrival: frames.append(lines))
+    sampler.start()
+    try:
+        lines = sampler.read(timeout=10)
+        wait_for(lambda: len(frames) >= 2)
+    finally:
+        sampler.stop()
+    assert ''.join(lines) == stats
+    assert ''.join(frames[1]) == stats
+
+def test_sampler_drops_half_frame_on_reconnect():
+    sampler = StatsSampler('/proc/diskstats_uid_global', 1)
+    sampler._on_line('0 10 1 count 1 / 4000 [sane]\n')
+    sampler._on_connect()
+    sampler._on_line('1 11 1 count 0 / 4000 [sane]\n')
+    sampler._on_line('\t-1 0\n')
+    sampler._on_line(FRAME_END + '\n')
+    assert sampler.read(timeout=0) == ['1 11 1 count 0 / 4000 [sane]\n', '\t-1 0\n']
+    assert sampler.read(timeout=0) is None
@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+from subprocess import run
+from subprocess import PIPE
+from conftest import HERE
+from conftest import load_script
+
+bench = load_script('bench-monitor.py')
+
+def test_app_mix():
+    names = bench.app_mix(25, 2)
+    assert names[:2] == ['malicious', 'malicious']
+    assert names[2:] == (bench.BENIGN_MIX * 2)[:23]
+
+def test_compare_flags_regressions(capsys):
+    old = {'commit': 'a', 'scenarios': [{'uids': 10, 'ticks_per_s': 1000,
+        'cpu_per_tick_s': {'mean': 0.001, 'p99': 0.002}, 'max_rss_kib': 100}]}
+    new = {'commit': 'b', 'scenarios': [{'uids': 10, 'ticks_per_s': 900,
+        'cpu_per_tick_s': {'mean': 0.001, 'p99': 0.0015}, 'max_rss_kib': 104},
+        {'uids': 100, 'ticks_per_s': 50}]}
+    bench.compare(new, old)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'b vs a'
+    rows = {line.split()[2]: line for line in lines[1:]}
+    # Only the scenario both runs have, only the metrics both have
+    assert sorted(rows) == ['cpu_per_tick_s.mean', 'cpu_per_tick_s.p99', 'max_rss_kib', 'ticks_per_s']
+    assert rows['ticks_per_s'].endswith('worse')
+    assert not rows['cpu_per_tick_s.p99'].endswith('worse')
+    # Within 5%
+    assert not rows['max_rss_kib'].endswith('worse')
+
+def test_scenario_run_and_compare(tmp_path):
+    out = str(tmp_path / 'bench.json')
+    done = run([sys.executable, os.path.join(HERE, 'bench-monitor.py'), '-u', '10', '-t', '120',
+        '-o', out], cwd=HERE, stdout=PIPE)
+    assert done.returncode == 0
+    with open(out) as f:
+        result = json.load(f)
+    assert result['params']['ticks'] == 120
+    scenario, = result['scenarios']
+    assert scenario['uids'] == 10
+    assert scenario['ticks'] == 120
+    assert scenario['ticks_per_s'] > 0
+    # The attacker starts a quarter in and is leashed
+    assert scenario['attackers'] == 1
+    assert scenario['leash_latency_s']['leashed'] == 1
+    assert {'parse', 'policy'} <= set(scenario['phases'])
+
+    done = run([sys.executable, os.path.join(HERE, 'bench-monitor.py'), '-u', '10', '-t', '120',
+        '-o', str(tmp_path / 'again.json'), '-c', out], cwd=HERE, stdout=PIPE)
+    assert done.returncode == 0
+    assert '10 uids    ticks_per_s' in done.stdout.decode('utf-8')
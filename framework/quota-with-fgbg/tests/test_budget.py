@@ -0,0 +1,118 @@
+import json
+import pytest
+from budget import Budget
+from quota_policy import QuotaPolicy
+
+# A 1000 s life of 100 s fg "days" over 10 s bg "hours"
+TIERS = [('day', 100, 0.5, 'fg'), ('hour', 10, 0.5, 'bg')]
+
+def budget(tiers=TIERS):
+    return Budget(10000, 1000, 0.5, tiers)
+
+def test_tiers_must_cover_fg_and_bg():
+    with pytest.raises(ValueError):
+        Budget(10000, 1000, 0.5, [('day', 100, 0.5, 'fg'), ('hour', 10, 0.5, 'fg')])
+    with pytest.raises(ValueError):
+        Budget(10000, 1000, 0.5, [('day', 100, 0.5, 'fg'), ('hour', 10, 0.5, None)])
+
+def test_uncharged_tiers_sit_above_a_charged_one():
+    Budget(10000, 1000, 0.5, [('week', 500, 0.5, None)] + TIERS)
+    Budget(10000, 1000, 0.5, [TIERS[0], ('quarter', 25, 0.5, None), TIERS[1]])
+    with pytest.raises(ValueError):
+        Budget(10000, 1000, 0.5, TIERS + [('minute', 1, 0.5, None)])
+
+def test_first_rollover_splits_the_slack_down():
+    b = budget()
+    b.advance(0)
+    day, hour = b.tiers
+    # Half of W_max over ten days, and a tenth of the day for the hour
+    assert (day.start, day.periods_left) == (0, 10)
+    assert day.pool + hour.slack == pytest.approx(500)
+    assert day.slack == pytest.approx(450)
+    assert (hour.start, hour.periods_left, hour.slack) == (0, 10, pytest.approx(50))
+    assert hour.threshold == pytest.approx(25)
+    assert b.slack_left == pytest.approx(4500)
+    assert b.next_rollover == 10
+
+def test_only_due_tiers_roll_over():
+    b = budget()
+    b.advance(0)
+    day, hour = b.tiers
+    b.advance(9.5)
+    assert hour.start == 0
+    hour.uid_slack['10001'] = 3
+    b.advance(10)
+    assert (day.start, hour.start) == (0, 10)
+    assert hour.uid_slack == {}
+    # The next hour gets an even share of what is left of the day's pool
+    assert hour.periods_left == 9
+    assert hour.slack == pytest.approx(50)
+    assert day.pool == pytest.approx(400)
+    assert b.next_rollover == 20
+    b.advance(100)
+    assert (day.start, hour.start) == (100, 100)
+    assert day.periods_left == 9
+    assert b.next_rollover == 110
+
+def test_recycle():
+    # The hour's unspent 50 goes back to the day before the next is drawn
+    for recycle, expected in ((True, 450), (False, 400)):
+        b = budget([('day', 100, 0.5, 'fg'), ('hour', 10, 0.5, 'bg', recycle)])
+        b.advance(0)
+        b.advance(10)
+        assert b.tiers[0].slack == pytest.approx(expected)
+
+def test_charge_goes_to_the_activity_tier():
+    b = budget()
+    b.advance(0)
+    day, hour = b.tiers
+    b_tag = hour.b_tag
+    assert b.charge('bg', b_tag + 2, 1) is hour
+    assert hour.slack == pytest.approx(48)
+    assert day.slack == pytest.approx(450)
+    assert b.w_left == pytest.approx(10000 - b_tag - 2)
+    # Writing under b_tag grows the slack and half of it the watermark
+    b.charge('fg', day.b_tag - 4, 2)
+    assert day.slack == pytest.approx(458)
+    assert day.threshold == pytest.approx(250 + 4)
+    assert b.written == pytest.approx(b_tag + 2 + 2 * (day.b_tag - 4))
+
+def run(b, start, end):
+    for t in range(start, end):
+        b.advance(t)
+        b.charge('fg' if t % 30 < 10 else 'bg', 3 + t % 7, 1)
+
+def test_restore_carries_on_identically():
+    b = budget()
+    run(b, 0, 135)
+    saved = json.loads(json.dumps(b.state()))
+    resumed = budget()
+    resumed.restore(saved)
+    run(b, 135, 260)
+    run(resumed, 135, 260)
+    assert json.dumps(resumed.state(), sort_keys=True) == json.dumps(b.state(), sort_keys=True)
+
+def test_uid_is_leashed_at_its_tier_watermark():
+    policy = QuotaPolicy(W_max=10000, life_sec=1000, slk_rate=0.5,
+        tiers=[('week', 500, 0.5, None)] + TIERS, service_learning=0)
+    week, day, hour = policy.budget.tiers
+    # A writer at b_tag is never charged slack
+    for t in range(5):
+        policy.step(t, {'10001': 5, '10002': 0}, '-1')
+    assert hour.b_tag == pytest.approx(5)
+    assert hour.uid_slack['10001'] == 0
+    # Over it, a bg writer is charged (10 - 5) per second against the
+    # hour's watermark of 25 (the week's 2500 over 5 days over 10 hours,
+    # halved)
+    assert hour.threshold == pytest.approx(25)
+    for t in range(5, 9):
+        policy.step(t, {'10002': 10}, '-1')
+    assert policy.uid_prison == {}
+    assert [uid for uid, rate in policy.step(9, {'10002': 10}, '-1')] == ['10002']
+    assert hour.uid_slack['10002'] == pytest.approx(25)
+    # In the foreground it is charged to the day instead, far under the
+    # day's watermark, and let go
+    assert policy.step(10, {'10002': 10}, '10002') == [('10002', -1)]
+    assert day.uid_slack['10002'] == pytest.approx(5)
+    assert day.threshold == pytest.approx(250)
+    assert week.uid_slack == {}
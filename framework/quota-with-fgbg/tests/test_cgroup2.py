@@ -0,0 +1,78 @@
+import shutil
+import pytest
+from cgroup2 import Cgroup2Controller
+
+class FakeProc:
+    """A /proc tree with only what the index reads: PID/status Uid: lines."""
+
+    def __init__(self, root):
+        self.root = root
+        root.mkdir()
+
+    def spawn(self, pid, uid):
+        path = self.root / str(pid)
+        path.mkdir(exist_ok=True)
+        (path / 'status').write_text("Name:\tapp\nUid:\t%s\t%s\t%s\t%s\n" % ((uid,) * 4))
+
+    def exit(self, pid):
+        shutil.rmtree(str(self.root / str(pid)))
+
+@pytest.fixture
+def cg2(tmp_path):
+    proc = FakeProc(tmp_path / 'proc')
+    proc.spawn(101, 10001)
+    proc.spawn(102, 10001)
+    proc.spawn(201, 10002)
+    controller = Cgroup2Controller(str(tmp_path / 'cg2'), '179:0', str(proc.root))
+    return controller, proc, tmp_path / 'cg2'
+
+def procs(root, uid):
+    path = root / ('rl-%s' % uid) / 'cgroup.procs'
+    return path.read_text().split() if path.exists() else []
+
+def test_leash_moves_the_uids_processes(cg2):
+    controller, proc, root = cg2
+    controller.apply([('10001', 4096)])
+    assert (root / 'rl-10001' / 'io.max').read_text() == "179:0 wbps=4096\n"
+    assert sorted(procs(root, '10001')) == ['101', '102']
+    assert procs(root, '10002') == []
+    # A re-rate only rewrites io.max
+    controller.apply([('10001', 2048)])
+    assert (root / 'rl-10001' / 'io.max').read_text() == "179:0 wbps=2048\n"
+    assert sorted(procs(root, '10001')) == ['101', '102']
+
+def test_poll_catches_forks_and_uid_changes(cg2):
+    controller, proc, root = cg2
+    controller.apply([('10001', 4096)])
+    assert controller.poll() == 0
+    proc.spawn(103, 10001)
+    proc.spawn(202, 10002)
+    # A zygote child that took the leashed UID after the fork
+    proc.spawn(201, 10001)
+    assert controller.poll() == 2
+    assert sorted(procs(root, '10001')) == ['101', '102', '103', '201']
+    assert controller.poll() == 0
+    assert sorted(procs(root, '10001')) == ['101', '102', '103', '201']
+
+def test_reused_pid_is_not_taken_for_the_old_process(cg2):
+    controller, proc, root = cg2
+    controller.apply([('10001', 4096)])
+    proc.exit(102)
+    proc.spawn(102, 10002)
+    assert controller.poll() == 0
+    assert controller.index.pid_uid['102'] == '10002'
+    assert controller.moved['10001'] == {'101'}
+    # and the PID is moved again if it comes back under the leashed UID
+    proc.exit(102)
+    proc.spawn(102, 10001)
+    assert controller.poll() == 1
+    assert controller.moved['10001'] == {'101', '102'}
+
+def test_unleash(cg2):
+    controller, proc, root = cg2
+    controller.apply([('10001', 4096)])
+    controller.apply([('10001', -1)])
+    assert (root / 'rl-10001' / 'io.max').read_text() == "179:0 wbps=max\n"
+    assert controller.limits == {}
+    proc.spawn(104, 10001)
+    assert controller.poll() == 0
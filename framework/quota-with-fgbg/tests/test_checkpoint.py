@@ -0,0 +1,83 @@
+import copy
+import json
+import checkpoint
+from checkpoint import Checkpoint
+from checkpoint import apply_diff
+from checkpoint import diff_state
+
+def states(n):
+    """A policy-like state per save, with UIDs coming, changing and going."""
+    for i in range(n):
+        yield {
+            'time': 1000 + i,
+            'policy': {'w_left': 5e6 - i, 'prison': {str(10000 + j): 100 * j
+                for j in range(i % 4)}},
+            'deltas': {'seq': i, 'sectors': {'10001': 8 * i}},
+        }
+
+def test_diff_round_trip():
+    old = {'a': 1, 'nested': {'x': 1, 'y': {'z': 2}}, 'gone': [1]}
+    new = {'a': 1, 'nested': {'x': 2, 'y': {}}, 'added': {'k': None}}
+    sets, dels = diff_state(old, new)
+    assert sorted(sets) == [(('added',), {'k': None}), (('nested', 'x'), 2)]
+    assert sorted(dels) == [('gone',), ('nested', 'y', 'z')]
+    state = copy.deepcopy(old)
+    apply_diff(state, sets, dels)
+    assert state == new
+
+def test_journal_replay(tmp_path):
+    path = str(tmp_path / 'state.json')
+    saver = Checkpoint(path)
+    for state in states(10):
+        saver.save(state)
+    saver.close()
+    assert saver.compactions == 1
+    assert len(open(path + '.journal').readlines()) == 9
+    loader = Checkpoint(path)
+    assert loader.load() == json.loads(json.dumps(state))
+
+def test_torn_last_line_ends_replay(tmp_path):
+    path = str(tmp_path / 'state.json')
+    saver = Checkpoint(path)
+    saved = list(states(5))
+    for state in saved:
+        saver.save(state)
+    saver.close()
+    with open(path + '.journal', 'a') as f:
+        f.write('{"gen": 1, "set": [[["time"], 99')
+    assert Checkpoint(path).load() == json.loads(json.dumps(saved[-1]))
+
+def test_stale_journal_after_a_crashed_compaction(tmp_path):
+    path = str(tmp_path / 'state.json')
+    saver = Checkpoint(path)
+    for state in states(5):
+        saver.save(state)
+    saver.close()
+    # The new snapshot made it, the journal was not started over yet
+    newer = {'time': 5000, 'policy': {}, 'deltas': None}
+    with open(path, 'w') as f:
+        json.dump({'gen': saver.gen + 1, 'state': newer}, f)
+    loader = Checkpoint(path)
+    assert loader.load() == newer
+    # and the next save compacts, dropping the stale lines
+    loader.save(newer)
+    loader.close()
+    assert loader.compactions == 1
+    assert open(path + '.journal').read() == ''
+
+def test_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'MIN_JOURNAL_BYTES', 512)
+    path = str(tmp_path / 'state.json')
+    saver = Checkpoint(path)
+    for state in states(200):
+        saver.save(state)
+    saver.close()
+    assert saver.compactions > 2
+    assert saver.journal_size <= max(saver.snapshot_size, 512) + 200
+    assert Checkpoint(path).load() == json.loads(json.dumps(state))
+
+def test_missing_or_unreadable(tmp_path):
+    path = tmp_path / 'state.json'
+    assert Checkpoint(str(path)).load() is None
+    path.write_text('{"gen": 1, "sta')
+    assert Checkpoint(str(path)).load() is None
@@ -0,0 +1,37 @@
+import json
+import os
+import sys
+from subprocess import run
+from subprocess import PIPE
+from conftest import HERE
+
+def closed_loop(tmp_path, *args):
+    out = str(tmp_path / 'summary.json')
+    done = run([sys.executable, os.path.join(HERE, 'closed-loop.py'), '-d', '0.25',
+        '-o', out] + list(args), cwd=HERE, stdout=PIPE)
+    assert done.returncode == 0
+    with open(out) as f:
+        return json.load(f)
+
+def test_attacker_is_leashed_and_trace_replays(tmp_path):
+    trace = str(tmp_path / 'run.qtr')
+    summary = closed_loop(tmp_path, '-t', trace)
+    assert summary['ticks'] == 6 * 3600
+    assert summary['guarantee_held']
+    assert summary['written_gib'] <= summary['pro_rata_gib']
+    # default_mix() puts the malicious app first, at the first app UID
+    assert '10100' in summary['leashed']
+    malicious = summary['profiles']['malicious']
+    assert malicious['delivered_kib'] < 0.05 * malicious['demand_kib']
+    social = summary['profiles']['social']
+    assert social['fg_delivered_kib'] > 0.99 * social['fg_demand_kib']
+    assert summary['actuation_calls'] > 0
+
+    done = run([sys.executable, os.path.join(HERE, 'replay.py'), '--check', trace],
+        cwd=HERE, stdout=PIPE)
+    assert done.returncode == 0
+    assert done.stdout.decode('utf-8').splitlines()[-1] == 'limit mismatches 0'
+
+def test_wear_replans(tmp_path):
+    summary = closed_loop(tmp_path, '-E', '1e5')
+    assert summary['wear_replans'] > 0
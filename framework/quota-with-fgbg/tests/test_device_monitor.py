@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import metrics
+from device_model import DeviceModel
+from device_model import ModelBackend
+from device_monitor import DeviceMonitor
+
+GIB = 1024 * 1024
+# Small enough a lifetime budget that the attacker is leashed within minutes
+POLICY = {'W_max': 88 * GIB / 365, 'life_sec': 2 * 86400}
+NAMES = ['malicious', 'low-rate', 'low-rate', 'social', 'game']
+ATTACKER = '10100'
+
+def model_monitor(model, **kwargs):
+    return DeviceMonitor('model', 1, policy_params=POLICY,
+        sample=lambda: (model.read_stats(), model.now), fg_uid=model.fg_uid,
+        backend=ModelBackend(model), clock=lambda: model.now, start_time=model.now,
+        trace=False, **kwargs)
+
+async def drive(model, monitor, ticks):
+    for _ in range(ticks):
+        model.advance(1)
+        assert await monitor.tick()
+
+def test_model_run_leashes_the_attacker(tmp_path):
+    model = DeviceModel(NAMES, seed=1)
+    monitor = model_monitor(model, whitelist=['10104'], uid_written={})
+    asyncio.run(drive(model, monitor, 300))
+    assert monitor.ticks == 300
+    assert ATTACKER in monitor.policy.uid_prison
+    # Applied straight to the model without start()
+    assert model.ratelimits[int(ATTACKER)] == int(monitor.actuator.applied[ATTACKER])
+    # Whitelisted UIDs are counted as written but never charged
+    assert monitor.uid_written['10104'] > 0
+    assert '10104' not in monitor.policy.uid_present
+    written = float(model.delivered_kib.sum())
+    assert abs(sum(monitor.uid_written.values()) - written) < 0.01 * written
+
+def test_empty_frame_is_skipped():
+    model = DeviceModel(NAMES, seed=1)
+    monitor = model_monitor(model)
+    assert not monitor.process([], model.now)
+    assert monitor.missed == 1
+    asyncio.run(drive(model, monitor, 2))
+    assert monitor.ticks == 2
+
+def test_checkpoint_resume(tmp_path):
+    path = str(tmp_path / 'state.json')
+    model = DeviceModel(NAMES, seed=1)
+    monitor = model_monitor(model, checkpoint=path, uid_written={})
+    asyncio.run(drive(model, monitor, 120))
+    monitor.stop()
+    prison = dict(monitor.policy.uid_prison)
+    assert ATTACKER in prison
+
+    # Down for a minute; the first tick charges what was written meanwhile
+    written = float(model.delivered_kib.sum())
+    model.advance(60)
+    resumed = model_monitor(model, checkpoint=path, uid_written={})
+    assert resumed.restored_time == 120
+    assert resumed.policy.uid_prison == prison
+    assert resumed.uid_written == monitor.uid_written
+    w_left = resumed.policy.w_left
+    asyncio.run(drive(model, resumed, 1))
+    assert resumed.last_tick_time == 181
+    gap_written = float(model.delivered_kib.sum()) - written
+    assert abs(w_left - resumed.policy.w_left - gap_written) < 0.01 * gap_written
+
+class RecordingBackend:
+    def __init__(self):
+        self.applied = []
+
+    def apply(self, changes):
+        self.applied.append(list(changes))
+
+def test_started_monitor_actuates_off_the_tick():
+    model = DeviceModel(NAMES, seed=1)
+    backend = RecordingBackend()
+    monitor = DeviceMonitor('model', 1, policy_params=POLICY,
+        sample=lambda: (model.read_stats(), model.now), fg_uid=model.fg_uid,
+        backend=backend, clock=lambda: model.now, start_time=0, trace=False)
+
+    async def run():
+        await monitor.start()
+        await drive(model, monitor, 300)
+        # The actuation task drains the queue on its stage thread
+        for _ in range(100):
+            if backend.applied:
+                break
+            await asyncio.sleep(0.01)
+        monitor.stop()
+
+    asyncio.run(run())
+    assert [ATTACKER in dict(changes) for changes in backend.applied].count(True) >= 1
+    assert monitor.actuator.calls == len(backend.applied)
+
+def test_metrics_are_per_device():
+    models = [DeviceModel(NAMES, seed=1), DeviceModel(NAMES[:2], seed=2)]
+    monitors = [model_monitor(model) for model in models]
+    phases = dict(metrics.phases)
+    for model, monitor, ticks in zip(models, monitors, (30, 20)):
+        asyncio.run(drive(model, monitor, ticks))
+    assert monitors[0].stats.phases['policy'].count == 30
+    assert monitors[1].stats.phases['policy'].count == 20
+    assert monitors[0].stats.counters['uids'] > monitors[1].stats.counters['uids']
+    assert metrics.phases == phases
+    summary = monitors[1].summary()['metrics']
+    assert summary['phases']['parse']['count'] == 20
+
+def test_started_monitor_checkpoints_off_the_loop(tmp_path):
+    path = str(tmp_path / 'state.json')
+    model = DeviceModel(NAMES, seed=1)
+    monitor = model_monitor(model, checkpoint=path, checkpoint_interval=0)
+    monitor.actuator.backend = RecordingBackend()
+    threads = []
+    save = monitor.checkpoint.save
+
+    def recording_save(state):
+        threads.append(threading.current_thread().name)
+        save(state)
+    monitor.checkpoint.save = recording_save
+
+    async def run():
+        await monitor.start()
+        for _ in range(5):
+            await drive(model, monitor, 1)
+            # A save still running skips the next one
+            await monitor.checkpoint_task
+        monitor.stop()
+
+    asyncio.run(run())
+    # All but the last save, which stop() makes, ran on the stage's thread
+    assert len(threads) == 6
+    assert set(threads[:-1]) == {'checkpoint-model'}
+    assert threads[-1] == threading.main_thread().name
+    resumed = model_monitor(model, checkpoint=path)
+    assert resumed.restored_time == monitor.last_tick_time
+    assert resumed.policy.uid_prison == monitor.policy.uid_prison
@@ -0,0 +1,101 @@
+import json
+import pytest
+from diskstats import parse_snapshot
+from diskstats import DeltaEngine
+
+def stats(seq, uptime, rows, ts_diff=1):
+    """diskstats_uid_global text for [(uid, sectors, diff), ...]."""
+    lines = ["%u %lu %lu count %d / 4001 [sane]\n" % (seq, uptime, ts_diff, len(rows))]
+    lines += ["\t%d %lu %lu\n" % row for row in rows]
+    lines.append("\t-1 %lu\n" % sum(row[1] for row in rows))
+    return "".join(lines)
+
+def test_parse():
+    snap = parse_snapshot(stats(3, 100, [(10001, 8, 2), (1000, 4, 0)]).splitlines(True))
+    assert (snap.seq, snap.uptime, snap.ts_diff, snap.count, snap.sane) == (3, 100, 1, 2, True)
+    assert snap.uids.tolist() == [10001, 1000]
+    assert snap.sectors.tolist() == [8, 4]
+    assert snap.diffs.tolist() == [2, 0]
+    assert snap.total == 12
+
+@pytest.mark.parametrize('text', [
+    # cut off before the trailer
+    "1 10 1 count 2 / 4001 [sane]\n\t10001 8 2\n\t1000 4 0\n",
+    # cut off inside a row
+    "1 10 1 count 2 / 4001 [sane]\n\t10001 8 2\n\t1000 4",
+    # more rows than the header's count
+    "1 10 1 count 1 / 4001 [sane]\n\t10001 8 2\n\t1000 4 0\n\t-1 12\n",
+    # a row lost in between
+    "1 10 1 count 2 / 4001 [sane]\n\t10001 8 2\n\t-1 12\n",
+    "garbage\n",
+])
+def test_parse_rejects_torn(text):
+    with pytest.raises(ValueError):
+        parse_snapshot(text)
+
+@pytest.mark.parametrize('data', [[], '', ['\n'], ['\n', '\t-1 0\n']])
+def test_parse_rejects_empty(data):
+    # What StatsSampler frames when cat fails between two markers
+    with pytest.raises(ValueError):
+        parse_snapshot(data)
+
+def test_first_takes_kernel_diffs():
+    deltas = DeltaEngine()
+    delta = deltas.update(parse_snapshot(stats(1, 10, [(10001, 100, 6), (10002, 50, 0)])))
+    assert deltas.status == 'first'
+    assert delta.tolist() == [6, 0]
+    assert deltas.active_rows(delta).tolist() == [0, 1]
+
+def test_ok_and_new_uid():
+    deltas = DeltaEngine()
+    deltas.update(parse_snapshot(stats(1, 10, [(10001, 100, 0), (10002, 50, 0)])))
+    # A new UID and the kernel's slots in a different order
+    delta = deltas.update(parse_snapshot(stats(2, 11, [(10003, 7, 7), (10002, 50, 0),
+        (10001, 130, 30)])))
+    assert deltas.status == 'ok'
+    assert delta.tolist() == [7, 0, 30]
+    assert deltas.new_rows.tolist() == [0]
+    assert deltas.active_rows(delta).tolist() == [0, 2]
+    # Same layout again takes the fast path
+    delta = deltas.update(parse_snapshot(stats(3, 12, [(10003, 7, 0), (10002, 58, 8),
+        (10001, 130, 0)])))
+    assert delta.tolist() == [0, 8, 0]
+    assert deltas.active_rows(delta).tolist() == [1]
+
+def test_gap_loses_nothing():
+    deltas = DeltaEngine()
+    deltas.update(parse_snapshot(stats(1, 10, [(10001, 100, 0)])))
+    delta = deltas.update(parse_snapshot(stats(5, 14, [(10001, 140, 10)])))
+    assert deltas.status == 'gap'
+    assert deltas.gaps == 1
+    assert delta.tolist() == [40]
+
+def test_reset_counts_everything_since():
+    deltas = DeltaEngine()
+    deltas.update(parse_snapshot(stats(7, 100, [(10001, 1000, 0), (10002, 500, 0)])))
+    delta = deltas.update(parse_snapshot(stats(1, 2, [(10002, 30, 30)])))
+    assert deltas.status == 'reset'
+    assert deltas.resets == 1
+    assert delta.tolist() == [30]
+    assert deltas.active_rows(delta).tolist() == [0]
+
+def test_wrap_and_uid_reset():
+    deltas = DeltaEngine(wrap_bits=16)
+    deltas.update(parse_snapshot(stats(1, 10, [(10001, 65530, 0), (10002, 1000, 0)])))
+    delta = deltas.update(parse_snapshot(stats(2, 11, [(10001, 5, 5), (10002, 20, 20)])))
+    assert deltas.status == 'ok'
+    # 10001 went round the 16 bit counter; 10002 would have had to write
+    # most of the range to wrap, so that UID was reset
+    assert delta.tolist() == [11, 20]
+    assert deltas.wraps == 1
+
+def test_restore_covers_the_time_since():
+    deltas = DeltaEngine()
+    deltas.update(parse_snapshot(stats(1, 10, [(10002, 50, 0), (10001, 100, 0)])))
+    saved = json.loads(json.dumps(deltas.state()))
+    resumed = DeltaEngine()
+    resumed.restore(saved)
+    delta = resumed.update(parse_snapshot(stats(9, 18, [(10002, 90, 0), (10001, 100, 0)])))
+    assert resumed.status == 'gap'
+    assert delta.tolist() == [40, 0]
+    assert resumed.active_rows(delta).tolist() == [0]
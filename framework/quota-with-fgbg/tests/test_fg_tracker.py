@@ -0,0 +1,64 @@
+import pytest
+import fg_tracker
+from fg_tracker import FgTracker
+
+PACKAGES = ["com.android.chrome 10087 0 /data/user/0/com.android.chrome default:targetSdkVersion=29 3003\n",
+    "com.whatsapp 10123 0 /data/user/0/com.whatsapp default 3003\n"]
+
+@pytest.fixture
+def tracker(monkeypatch):
+    """An FgTracker that never spawns adb; fetches are counted."""
+    tracker = FgTracker(initial_uid='10087')
+    tracker.fetches = 0
+
+    def fetch_packages():
+        tracker.fetches += 1
+        tracker.fetch_time = fg_tracker.time.monotonic()
+        tracker.unknown = set()
+    monkeypatch.setattr(tracker, 'fetch_packages', fetch_packages)
+    tracker.load_packages(PACKAGES)
+    return tracker
+
+@pytest.mark.parametrize('payload, uid', [
+    # Android 7 and before
+    ("[0,com.whatsapp/.Main]", '10123'),
+    # Android 8+: a reason after the component
+    ("[0,com.whatsapp/.Main,appDied]", '10123'),
+    ("[10,com.android.chrome/com.google.android.apps.chrome.Main,resumeTopActivity]", '1010087'),
+    # am_resume_activity: token and task id before the component
+    ("[0,184739201,42,com.whatsapp/.HomeActivity]", '10123'),
+    ("[0,no component]", None),
+    ("[system,com.whatsapp/.Main]", None),
+])
+def test_component_uid(tracker, payload, uid):
+    assert tracker.component_uid(payload) == uid
+
+def test_unknown_package_refetch_is_rate_limited(tracker, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(fg_tracker.time, 'monotonic', lambda: clock[0])
+    assert tracker.component_uid("[0,org.new.app/.Main]") is None
+    assert tracker.component_uid("[0,org.new.app/.Main]") is None
+    assert tracker.fetches == 1
+    clock[0] += fg_tracker.PACKAGES_REFETCH_INTERVAL
+    assert tracker.component_uid("[0,org.new.app/.Main]") is None
+    assert tracker.fetches == 2
+
+def test_events_move_the_focus(tracker):
+    assert tracker.current() == '10087'
+    tracker._on_line("I/am_focused_activity(  875): [0,com.whatsapp/.Main,appDied]")
+    assert tracker.current() == '10123'
+    tracker._on_line("I/screen_toggled(  875): 0")
+    assert tracker.current() == '-1'
+    tracker._on_line("I/screen_toggled(  875): 1")
+    assert tracker.current() == '10123'
+    # Not an event line
+    tracker._on_line("--------- beginning of events")
+    assert tracker.events == 3
+
+def test_unknown_probe_waits_for_an_event():
+    tracker = FgTracker(initial_uid='\n')
+    tracker.load_packages(PACKAGES)
+    assert tracker.screen_on is None and tracker.current() == '-1'
+    tracker._on_line("I/am_resume_activity(  875): [0,184739201,42,com.android.chrome/.Main]")
+    assert tracker.screen_on
+    assert tracker.current() == '10087'
@@ -0,0 +1,84 @@
+import pytest
+from forecast import BurstForecaster
+from quota_policy import QuotaPolicy
+
+GIB = 1024 * 1024
+
+def feed(forecaster, uid, rate, seconds):
+    for _ in range(seconds):
+        forecaster.tick(1)
+        forecaster.observe(uid, rate, 1)
+
+def test_fast_average_catches_a_burst():
+    forecaster = BurstForecaster(fast_tau=5, slow_tau=120)
+    feed(forecaster, '10001', 10, 600)
+    assert forecaster.forecast('10001') == pytest.approx(10)
+    feed(forecaster, '10001', 100, 5)
+    # Most of the way to the burst rate in one fast time constant
+    assert forecaster.forecast('10001') > 60
+
+def test_slow_average_holds_through_a_pause():
+    forecaster = BurstForecaster(fast_tau=5, slow_tau=120)
+    feed(forecaster, '10001', 10, 600)
+    feed(forecaster, '10001', 0, 30)
+    # The fast average is all but gone
+    assert forecaster.rates['10001'][0] < 0.05
+    assert forecaster.forecast('10001') == pytest.approx(10 * 0.7788, rel=0.01)
+
+def test_idle_uids_age_as_if_fed_zeros():
+    fed = BurstForecaster()
+    idle = BurstForecaster()
+    for forecaster in (fed, idle):
+        feed(forecaster, '10001', 50, 60)
+    feed(fed, '10001', 0, 45)
+    for _ in range(45):
+        idle.tick(1)
+    assert idle.forecast('10001') == pytest.approx(fed.forecast('10001'))
+    feed(fed, '10001', 20, 1)
+    feed(idle, '10001', 20, 1)
+    assert idle.rates['10001'][:2] == pytest.approx(fed.rates['10001'][:2])
+
+def test_eta():
+    forecaster = BurstForecaster()
+    assert forecaster.eta('10001', 100, 1) == float('inf')
+    feed(forecaster, '10001', 10, 1)
+    assert forecaster.eta('10001', 100, 0.5) == pytest.approx(20)
+    assert forecaster.eta('10001', -5, 0.5) == 0
+
+def test_state_round_trip():
+    forecaster = BurstForecaster()
+    feed(forecaster, '10001', 10, 30)
+    restored = BurstForecaster()
+    restored.restore(forecaster.state())
+    assert restored.forecast('10001') == forecaster.forecast('10001')
+
+def first_leash(forecast_horizon, rate=20):
+    """Tick of the first leash of a steady bg writer, and the policy."""
+    policy = QuotaPolicy(W_max=88 * GIB / 365, life_sec=2 * 86400,
+        forecast_horizon=forecast_horizon, service_learning=0)
+    for tick in range(3600):
+        if policy.step(tick, {'10001': rate}, '-1'):
+            return tick, policy
+    raise AssertionError("never leashed")
+
+def test_graded_before_the_watermark():
+    tick, policy = first_leash(0)
+    tier = policy.bg_tier
+    assert tier.uid_slack['10001'] >= 0.99 * tier.threshold
+    assert not policy.uid_graded
+
+    graded_tick, policy = first_leash(600)
+    assert graded_tick < tick
+    tier = policy.bg_tier
+    slack_left = 0.99 * tier.threshold - tier.uid_slack['10001']
+    assert slack_left > 0
+    # The rate that makes the slack left last the horizon
+    fraction = (20 - tier.b_tag) / 20
+    assert policy.uid_graded['10001'] == pytest.approx(slack_left / (fraction * 600))
+    assert policy.uid_prison['10001'] == pytest.approx(policy.uid_graded['10001'] * 1024)
+
+def test_graded_uid_let_go_when_it_stops():
+    tick, policy = first_leash(600)
+    actions = policy.step(tick + 1, {}, '-1')
+    assert actions == [('10001', -1)]
+    assert not policy.uid_graded
@@ -0,0 +1,54 @@
+import json
+import metrics
+from metrics import Histogram
+from metrics import RateLimiter
+
+def test_histogram_buckets():
+    hist = Histogram()
+    for us in (0.5, 1, 3, 3, 100, 1000):
+        hist.observe(us / 1000000)
+    # [2^(i-1), 2^i) us in bucket i, under 1 us in bucket 0
+    assert hist.buckets[0] == 1
+    assert hist.buckets[1] == 1
+    assert hist.buckets[2] == 2
+    assert hist.buckets[7] == 1
+    assert hist.buckets[10] == 1
+    assert hist.count == 6
+    assert hist.percentile(0.5) == 4 / 1000000
+    # Capped at the largest seen
+    assert hist.percentile(1) == 0.001
+    assert Histogram().percentile(0.5) == 0
+
+def test_histogram_overflow_bucket():
+    hist = Histogram()
+    hist.observe(1e6)
+    assert hist.buckets[metrics.BUCKETS - 1] == 1
+    assert hist.to_dict()['max'] == 1e6
+
+def test_lap_and_dump(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'phases', {})
+    monkeypatch.setattr(metrics, 'counters', metrics.collections.Counter())
+    t = metrics.now()
+    t = metrics.lap('parse', t)
+    metrics.lap('parse', t)
+    metrics.counters['spawns'] += 2
+    path = str(tmp_path / 'metrics.json')
+    metrics.dump(path, ticks=7)
+    with open(path) as f:
+        data = json.load(f)
+    assert data['phases']['parse']['count'] == 2
+    assert data['counters'] == {'spawns': 2}
+    assert data['ticks'] == 7
+    assert not (tmp_path / 'metrics.json.tmp').exists()
+
+def test_rate_limiter(monkeypatch):
+    clock = [10.0]
+    monkeypatch.setattr(metrics.time, 'monotonic', lambda: clock[0])
+    limiter = RateLimiter(5)
+    assert limiter.ready()
+    clock[0] += 4.9
+    assert not limiter.ready()
+    clock[0] += 0.1
+    assert limiter.ready()
+    assert limiter.suppressed == 1
+    assert all(RateLimiter(0).ready() for _ in range(3))
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+import pytest
+import metrics
+from actuator import RateActuator
+from pipeline import Latest
+from pipeline import Stage
+from pipeline import drain_actuations
+
+class FlakyBackend:
+    """Raises on the first apply(), records the ones after."""
+
+    def __init__(self):
+        self.applied = []
+
+    def apply(self, changes):
+        if not self.applied:
+            self.applied.append(None)
+            raise ValueError("bad rate")
+        self.applied.append(list(changes))
+
+async def drain(actuator, batches):
+    """Queue each batch once the one before is applied or failed."""
+    queue = asyncio.Queue()
+    stage = Stage('test-actuate', 5)
+    task = asyncio.create_task(drain_actuations(queue, stage, actuator))
+    failures = metrics.counters['actuation_failures']
+    for i, changes in enumerate(batches):
+        queue.put_nowait(actuator.plan(changes))
+        while actuator.calls + metrics.counters['actuation_failures'] - failures <= i:
+            await asyncio.sleep(0.01)
+    task.cancel()
+
+def test_drain_survives_a_failing_backend():
+    backend = FlakyBackend()
+    actuator = RateActuator(backend)
+    failures = metrics.counters['actuation_failures']
+    asyncio.run(drain(actuator, [{'10001': 4096}, {'10002': 8192}]))
+    assert metrics.counters['actuation_failures'] == failures + 1
+    # The failed change went back to the actuator, the later one went through
+    assert '10001' not in actuator.applied
+    assert backend.applied[1] == [('10002', 8192)]
+    assert actuator.applied['10002'] == 8192
+    assert actuator.calls == 1
+
+def test_stage_runs_off_the_loop():
+    stage = Stage('test-stage', 1)
+
+    async def main():
+        ticks = 0
+        call = asyncio.ensure_future(stage.call(time.sleep, 0.1))
+        while not call.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks
+    # The loop kept going while the call slept in its thread
+    assert asyncio.run(main()) > 3
+    assert stage.calls == 1 and not stage.busy
+
+def test_stage_refuses_calls_while_stuck():
+    stage = Stage('test-stuck', 0.05)
+    release = threading.Event()
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await stage.call(release.wait)
+        # The hung call still holds its thread
+        with pytest.raises(asyncio.TimeoutError):
+            await stage.call(time.sleep, 0)
+        release.set()
+        while stage.busy:
+            await asyncio.sleep(0.01)
+        return await stage.call(sum, [1, 2])
+    assert asyncio.run(main()) == 3
+    assert stage.timeouts == 2
+    assert stage.calls == 2
+
+def test_stage_raises_what_the_call_raised():
+    stage = Stage('test-error', 1)
+    with pytest.raises(ValueError):
+        asyncio.run(stage.call(int, 'x'))
+    assert not stage.busy
+
+def test_latest_skips_to_the_newest():
+    latest = Latest()
+
+    async def main():
+        latest.publish('a')
+        latest.publish('b')
+        value, version = await latest.wait_newer(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await latest.wait_newer(version, 0.01)
+        return value, version
+    assert asyncio.run(main()) == ('b', 2)
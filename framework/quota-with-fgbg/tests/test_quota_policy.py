@@ -0,0 +1,66 @@
+import random
+import pytest
+from actuator import NullBackend
+from actuator import RateActuator
+from quota_policy import QuotaPolicy
+from quota_policy import SHARE_TAU
+from quota_policy import water_fill
+
+GIB = 1024 * 1024
+ATTACKER = '10100'
+
+def test_unbounded_split_by_weight():
+    shares = water_fill(90, {'a': None, 'b': None}, {'a': 2, 'b': 1})
+    assert shares == pytest.approx({'a': 60, 'b': 30})
+
+def test_light_writers_leave_the_rest_to_heavy_ones():
+    demands = {'light': 5, 'heavy': None, 'fg': None}
+    shares = water_fill(100, demands, {'light': 1, 'heavy': 1, 'fg': 2})
+    assert shares['light'] == 5
+    # 95 left, split 1:2
+    assert shares == pytest.approx({'light': 5, 'heavy': 95 / 3, 'fg': 190 / 3})
+    assert sum(shares.values()) == pytest.approx(100)
+
+def test_demands_under_capacity_are_met():
+    shares = water_fill(100, {'a': 10, 'b': 20}, {'a': 1, 'b': 1})
+    assert shares == {'a': 10, 'b': 20}
+
+def test_max_min_fair():
+    # Each capped writer gets its demand, the rest share equally
+    shares = water_fill(60, {'a': 5, 'b': 30, 'c': 40, 'd': None},
+        {'a': 1, 'b': 1, 'c': 1, 'd': 1})
+    assert shares == pytest.approx({'a': 5, 'b': 55 / 3, 'c': 55 / 3, 'd': 55 / 3})
+
+def test_no_capacity():
+    assert water_fill(-10, {'a': None, 'b': 3}, {'a': 1, 'b': 1}) == {'a': 0, 'b': 0}
+    assert water_fill(10, {}, {}) == {}
+
+def rerates(share_tau, ticks=3600):
+    """Re-rates of leashed UIDs by the actuator under a steady mix: an
+    attacker at full rate over writers like device_model's low-rate and
+    social apps."""
+    rng = random.Random(0)
+    policy = QuotaPolicy(W_max=88 * GIB / 365, life_sec=2 * 86400, share_tau=share_tau)
+    actuator = RateActuator(NullBackend())
+    count = 0
+    for tick in range(ticks):
+        applied = actuator.applied.get(ATTACKER)
+        uid_throughput = {ATTACKER: 1000 if applied is None else min(1000, applied / 1024)}
+        for i in range(10):
+            if rng.random() < 0.01:
+                uid_throughput[str(10001 + i)] = 1
+        if rng.random() < 0.9:
+            uid_throughput['10020'] = 0.2
+        policy.step(tick, uid_throughput, '-1')
+        was = dict(actuator.applied)
+        for uid, rate in actuator.sync(policy.uid_prison):
+            if rate >= 0 and uid in was and was[uid] >= 0:
+                count += 1
+    assert ATTACKER in policy.hist_uid_limit
+    return count
+
+def test_shares_hold_still_under_a_steady_load():
+    # Writers that join once the hour's slack is spent re-rate the rest
+    assert rerates(SHARE_TAU) <= 60
+    # Shares from each tick's writers alone move past the hysteresis
+    assert rerates(1e-6) > 200
@@ -0,0 +1,40 @@
+import json
+from rollup import Rollups
+
+def fill(rollups, start, minutes):
+    for t in range(start, start + minutes * 60, 10):
+        rollups.add(t + 10, 10, 1, 2, 0, 0, 100 - t / 1000, {'10001': t % 7 + 1}, ['10001'])
+
+def test_snapshot_is_unaffected_by_later_ticks(tmp_path):
+    rollups = Rollups()
+    fill(rollups, 0, 90)
+    snapshot = rollups.snapshot()
+    expected = json.loads(json.dumps(rollups.state()))
+    # Carries on into the open minute and hour and rolls both over
+    fill(rollups, 90 * 60, 61)
+    path = str(tmp_path / 'rollups.json')
+    rollups.write(snapshot, path)
+    with open(path) as f:
+        assert json.load(f) == expected
+
+def test_older_snapshot_does_not_overwrite_newer(tmp_path):
+    rollups = Rollups()
+    fill(rollups, 0, 5)
+    old = rollups.snapshot()
+    fill(rollups, 5 * 60, 5)
+    path = str(tmp_path / 'rollups.json')
+    rollups.save(path)
+    # A background write that finishes after the final save
+    rollups.write(old, path)
+    resumed = Rollups()
+    assert resumed.load(path)
+    assert resumed.state()['minutes'] == rollups.state()['minutes']
+    assert len(resumed.minutes) == 10
+
+def test_no_seconds_kept():
+    rollups = Rollups(0)
+    fill(rollups, 0, 3)
+    assert rollups.sizes() == {'ticks': 0, 'minutes': 3, 'hours': 0}
+    tier, bucket = rollups.query(60, 120)
+    assert tier == 'minute'
+    assert bucket.secs == 60
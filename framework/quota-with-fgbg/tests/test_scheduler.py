@@ -0,0 +1,65 @@
+import asyncio
+from scheduler import TickScheduler
+
+class FakeClock:
+    """Monotonic time that only moves when slept on or worked in."""
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_deadlines_do_not_drift():
+    clock = FakeClock()
+    scheduler = TickScheduler(0.25, clock=clock, sleep=clock.sleep)
+    wakes = []
+    for _ in range(9):
+        wakes.append(scheduler.wait())
+        # Work in the tick doesn't push the next one out
+        clock.now += 0.1
+    assert wakes == [100.0 + i * 0.25 for i in range(9)]
+    assert scheduler.missed == 0
+    assert scheduler.stats()['lateness_max'] == 0
+
+def test_overrun_skips_missed_slots():
+    clock = FakeClock()
+    scheduler = TickScheduler(1, clock=clock, sleep=clock.sleep)
+    scheduler.wait()
+    clock.now += 2.5
+    # Slot 1 passed while working and is skipped, slot 2 runs late
+    assert scheduler.wait() == 102.5
+    assert scheduler.missed == 1
+    assert scheduler.stats()['lateness_max'] == 0.5
+    # Back on the grid
+    assert scheduler.wait() == 103.0
+    assert scheduler.ticks == 3
+    scheduler.miss()
+    assert scheduler.stats()['missed'] == 2
+
+def test_lateness_is_measured():
+    clock = FakeClock()
+
+    def oversleep(seconds):
+        clock.now += seconds + 0.01
+    scheduler = TickScheduler(1, clock=clock, sleep=oversleep)
+    for _ in range(5):
+        scheduler.wait()
+    stats = scheduler.stats()
+    # The first tick starts the schedule on time
+    assert abs(stats['lateness_mean'] - 0.04 / 5) < 1e-9
+    assert abs(stats['lateness_max'] - 0.01) < 1e-9
+    assert stats['ticks'] == 5
+
+def test_wait_async():
+    scheduler = TickScheduler(0.02)
+
+    async def ticks():
+        return [await scheduler.wait_async() for _ in range(4)]
+    wakes = asyncio.run(ticks())
+    assert all(b > a for a, b in zip(wakes, wakes[1:]))
+    assert wakes[-1] - wakes[0] >= 3 * 0.02 - 0.005
+    assert scheduler.ticks == 4
@@ -0,0 +1,84 @@
+from service_index import ServiceIndex
+from service_index import BURST_KIB
+from service_index import MIN_BURST_SECS
+
+APP_A = '10050'
+APP_B = '10060'
+MEDIA = '1013'
+
+def drive(index, seconds, fg_of, bursting_of):
+    """Tick the index for `seconds`: fg_of(t) in the fg, bursting_of(t)
+    UIDs writing BURST_KIB."""
+    for t in range(seconds):
+        fg_uid = fg_of(t)
+        index.tick(fg_uid, 1)
+        for uid in bursting_of(t):
+            index.observe(uid, BURST_KIB, fg_uid, 1)
+
+def alternating(t):
+    """A and B take turns in the fg a minute each, with the screen off in
+    between every other time."""
+    return [APP_A, '-1', APP_B, '-1'][(t // 60) % 4]
+
+def media_for_a(t):
+    # The media server writes while A records, 10 s out of each minute
+    return [MEDIA] if alternating(t) == APP_A and t % 60 < 10 else []
+
+def test_service_attributed_to_the_app_it_writes_for():
+    index = ServiceIndex()
+    drive(index, 240, alternating, media_for_a)
+    # 10 s of evidence, not enough yet
+    assert index.table == {}
+    drive(index, 480, alternating, media_for_a)
+    assert index.bursts[MEDIA] == 30
+    assert index.table == {APP_A: {MEDIA}}
+    # A over 1/4 of the time, the media bursts all in A
+    assert index.lift(MEDIA, APP_A) == 4
+    assert index.learned() == {APP_A: [MEDIA]}
+
+def test_hints_halve_the_evidence():
+    plain = ServiceIndex()
+    hinted = ServiceIndex(hints={MEDIA: 'MEDIA'})
+    for index in (plain, hinted):
+        drive(index, 480, alternating, media_for_a)
+    # 20 s of evidence
+    assert MIN_BURST_SECS / 2 <= plain.bursts[MEDIA] < MIN_BURST_SECS
+    assert plain.table == {}
+    assert hinted.table == {APP_A: {MEDIA}}
+
+def test_hinted_provider_package():
+    index = ServiceIndex()
+    index.hint_packages({'com.android.providers.media.module': 10031})
+    assert index.classify('10031') is True
+    assert index.classify('1010031') is True
+    # Other apps never count as services, system UIDs do
+    assert index.classify('10099') is None
+    assert index.classify('1000') is False
+
+def test_apps_are_not_attributed():
+    index = ServiceIndex()
+    drive(index, 960, alternating, lambda t: [APP_B] if alternating(t) == APP_A else [])
+    assert APP_B not in index.bursts
+    assert index.table == {}
+
+def test_steady_writer_is_dropped():
+    index = ServiceIndex(pinned={APP_B: ['1000']})
+    drive(index, 720, alternating, lambda t: media_for_a(t) + (['1000'] if t % 60 < 10 else []))
+    assert index.table == {APP_A: {MEDIA}, APP_B: {'1000'}}
+    # Now the media server writes whatever is in the fg
+    drive(index, 4800, alternating, lambda t: [MEDIA, '1000'] if t % 2 else [])
+    assert index.lift(MEDIA, APP_A) < 1.5
+    assert MEDIA not in index.table[APP_A]
+    # Pinned entries stay
+    assert index.table[APP_B] == {'1000'}
+
+def test_state_round_trip_keeps_the_table():
+    index = ServiceIndex(hints={MEDIA: 'MEDIA'})
+    drive(index, 720, alternating, media_for_a)
+    restored = ServiceIndex(pinned={APP_B: ['1000']})
+    table = restored.table
+    restored.restore(index.state())
+    assert restored.table is table
+    assert table == {APP_A: {MEDIA}, APP_B: {'1000'}}
+    assert restored.learned() == {APP_A: [MEDIA]}
+    assert restored.bursts == index.bursts
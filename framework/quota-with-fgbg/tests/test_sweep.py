@@ -0,0 +1,41 @@
+import csv
+import json
+import os
+import sys
+from subprocess import run
+from subprocess import PIPE
+from conftest import HERE
+from sweep import expand_grid
+
+ATTACKER = '10100'
+
+def test_expand_grid():
+    points = expand_grid({'SLK_RATE': [0.5, 0.25], 'fg_delay': [0, 5, 10]})
+    assert len(points) == 6
+    assert points[0] == {'SLK_RATE': 0.5, 'fg_delay': 0}
+    assert points[-1] == {'SLK_RATE': 0.25, 'fg_delay': 10}
+    assert expand_grid({}) == [{}]
+
+def test_sweep_over_a_recorded_trace(tmp_path):
+    trace = str(tmp_path / 'run.qtr')
+    # An hour of a two-day lifetime, so the slack matters
+    done = run([sys.executable, os.path.join(HERE, 'closed-loop.py'), '-d', '0.05',
+        '-L', '172800', '-t', trace], cwd=HERE, stdout=PIPE)
+    assert done.returncode == 0
+    grid = str(tmp_path / 'grid.json')
+    with open(grid, 'w') as f:
+        json.dump({'fg_delay': [0, 30]}, f)
+    out = str(tmp_path / 'sweep.csv')
+    done = run([sys.executable, os.path.join(HERE, 'sweep.py'), trace, '-G', grid,
+        '-g', 'SLK_RATE=0.5,0.01', '-a', ATTACKER, '-j', '2', '-o', out], cwd=HERE)
+    assert done.returncode == 0
+    with open(out) as f:
+        rows = list(csv.DictReader(f))
+    # One row per grid point and trace, in grid order
+    assert [(row['SLK_RATE'], row['fg_delay']) for row in rows] == [
+        ('0.5', '0'), ('0.5', '30'), ('0.01', '0'), ('0.01', '30')]
+    assert all(row['trace'] == trace for row in rows)
+    assert all(row['attacker_first_throttle_s'] for row in rows)
+    by_slack = {row['SLK_RATE']: float(row['attacker_written_kib']) for row in rows}
+    # Less slack lets the attacker write less
+    assert by_slack['0.01'] < by_slack['0.5']
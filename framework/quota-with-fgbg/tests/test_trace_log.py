@@ -0,0 +1,72 @@
+import numpy
+from conftest import load_script
+from quota_policy import QuotaPolicy
+from trace_log import TraceReader
+from trace_log import TraceWriter
+
+# An hour of fg periods over 10 s bg periods, thresholds no UID reaches
+TIERS = [('hour', 60, 100, 'fg'), ('minute', 10, 100, 'bg')]
+
+def record(path_sparse, path_dense, ticks=45):
+    """Run a policy over a writer that goes idle with slack left, tracing
+    it sparse (the active UIDs) and dense (every UID, as the monitor
+    used to)."""
+    policy = QuotaPolicy(W_max=50000, life_sec=1000, tiers=TIERS, forecast_horizon=0,
+        service_learning=0)
+    sparse = TraceWriter(path_sparse, {})
+    dense = TraceWriter(path_dense, {})
+    sectors = {'10001': 0, '10002': 0}
+    for t in range(ticks):
+        throughput = {'10002': 5}
+        # 10001 writes in the fg, then in the bg, then stays idle
+        if t < 5:
+            throughput['10001'] = 50
+        elif 12 < t < 15:
+            throughput['10001'] = 40
+        fg_uid = '10001' if t < 5 else '-1'
+        for uid, bw in throughput.items():
+            sectors[uid] += int(bw * 2)
+        policy.step(t, throughput, fg_uid)
+        policy.trace_tick(sparse, t, fg_uid, throughput, sectors)
+        policy.trace_tick(dense, t, fg_uid, throughput, sectors, uids=sorted(policy.uid_present))
+    sparse.close()
+    dense.close()
+
+def test_sparse_series_match_dense(tmp_path):
+    record(str(tmp_path / 'sparse.qtr'), str(tmp_path / 'dense.qtr'))
+    sparse = TraceReader(str(tmp_path / 'sparse.qtr'))
+    dense = TraceReader(str(tmp_path / 'dense.qtr'))
+    # The idle writer drops out of the sparse trace with slack left
+    recs, rows = sparse.records()
+    idle = rows[recs['uid'] == 10001]
+    assert len(idle) < len(sparse)
+    for field in ('bw', 'sectors', 'slack_fg', 'slack_bg', 'limit'):
+        fill = -1 if field == 'limit' else 0
+        want = dense.uid_series(field, fill)
+        got = sparse.uid_series(field, fill)
+        assert sorted(got) == sorted(want)
+        for uid in want:
+            numpy.testing.assert_array_equal(got[uid], want[uid], err_msg="%s %s" % (field, uid))
+    slack_bg = dense.uid_series('slack_bg')['10001']
+    # Held through idle ticks, then cleared by the next bg period
+    assert slack_bg[16] > 0 and slack_bg[16] == slack_bg[19]
+    assert slack_bg[25] == 0
+    assert dense.uid_series('slack_fg')['10001'][30] > 0
+    sparse.close()
+    dense.close()
+
+def test_report_columns_match_dense(tmp_path):
+    report = load_script('quota-report.py')
+    record(str(tmp_path / 'sparse.qtr'), str(tmp_path / 'dense.qtr'))
+    fields = ('bw', 'slack_fg', 'slack_bg', 'sectors')
+    for width in (45, 9, 7, 2):
+        sparse = TraceReader(str(tmp_path / 'sparse.qtr'))
+        dense = TraceReader(str(tmp_path / 'dense.qtr'))
+        got = report.reduce_minmax(sparse, width, (), fields)
+        want = report.reduce_minmax(dense, width, (), fields)
+        for field in fields:
+            for uid, (x, y) in want['uids'][field].items():
+                numpy.testing.assert_array_equal(got['uids'][field][uid][1], y,
+                    err_msg="%s %s width %d" % (field, uid, width))
+        sparse.close()
+        dense.close()
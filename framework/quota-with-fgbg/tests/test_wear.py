@@ -0,0 +1,77 @@
+import pytest
+from quota_policy import QuotaPolicy
+from wear import AdbWearSource
+from wear import FileWearSource
+from wear import LEVEL_EXCEEDED
+from wear import PRE_EOL_LEFT
+from wear import WearEstimate
+from wear import parse_health
+
+W_MAX = 1000000
+
+def test_parse_health():
+    assert parse_health("0x02 0x03\n", "0x01\n") == (3, 1)
+    assert parse_health("0x0b", "0x02") == (11, 2)
+    assert parse_health("", "") == (0, 0)
+    with pytest.raises(ValueError):
+        parse_health("worn", "0x01")
+
+def test_file_source(tmp_path):
+    source = FileWearSource(('/life_time',), '/pre_eol_info', root=str(tmp_path))
+    assert source.read() is None
+    (tmp_path / 'life_time').write_text("0x01 0x02\n")
+    (tmp_path / 'pre_eol_info').write_text("0x01\n")
+    assert source.read() == (2, 1)
+
+def test_adb_source_command_numbers_each_file():
+    source = AdbWearSource(life_time=('/a', '/b'), pre_eol='/eol')
+    assert source.command == ('echo "0=$(cat /a 2>/dev/null)"; echo "1=$(cat /b 2>/dev/null)"; '
+        'echo "2=$(cat /eol 2>/dev/null)"')
+
+def test_no_estimate_before_two_steps():
+    wear = WearEstimate(W_MAX)
+    assert wear.observe((0, 0), 0, W_MAX) is None
+    assert wear.observe((1, 1), 0, W_MAX) is None
+    # The first step up only marks where the level changed
+    assert wear.observe((2, 1), 50000, W_MAX) is None
+
+def test_steps_measure_the_cost_of_wear():
+    wear = WearEstimate(W_MAX)
+    wear.observe((1, 1), 0, W_MAX)
+    wear.observe((2, 1), 50000, W_MAX)
+    # 80000 KiB a step; stepping up to level 3, 2 are used and 8 left,
+    # less what was written since
+    assert wear.observe((3, 1), 130000, W_MAX) == pytest.approx(8 * 80000)
+    assert wear.observe((3, 1), 170000, W_MAX) == pytest.approx(7.5 * 80000)
+    assert wear.observe((LEVEL_EXCEEDED, 1), 180000, W_MAX) == 0
+
+def test_pre_eol_warning_caps_the_estimate():
+    wear = WearEstimate(W_MAX)
+    # No steps measured: the budget's own KiB left are capped
+    assert wear.observe((1, 2), 0, W_MAX) == PRE_EOL_LEFT[2] * W_MAX
+    assert wear.observe((1, 2), 0, 10000) == 10000
+    assert wear.observe((1, 3), 0, W_MAX) == PRE_EOL_LEFT[3] * W_MAX
+
+def test_state_round_trip():
+    wear = WearEstimate(W_MAX)
+    for reading, written in (((1, 1), 0), ((2, 1), 50000), ((3, 1), 130000)):
+        wear.observe(reading, written, W_MAX)
+    restored = WearEstimate(W_MAX)
+    restored.restore(wear.state())
+    assert restored.observe((3, 1), 170000, W_MAX) == wear.observe((3, 1), 170000, W_MAX)
+
+def test_policy_replans_on_a_pre_eol_warning():
+    policy = QuotaPolicy(W_max=W_MAX, life_sec=86400, wear_planning=1, service_learning=0)
+    for tick in range(10):
+        policy.step(tick, {'10001': 1}, '-1')
+    b_tag = policy.bg_tier.b_tag
+    assert policy.observe_wear((1, 1), 10) is None
+    assert policy.observe_wear((1, 2), 10) == PRE_EOL_LEFT[2] * W_MAX
+    assert policy.budget.w_left == PRE_EOL_LEFT[2] * W_MAX
+    # The root's slack shrinks along, b_tag follows right away
+    assert policy.bg_tier.b_tag < b_tag * PRE_EOL_LEFT[2] * 1.1
+    assert policy.budget.written == 10
+    # Without wear planning readings are ignored
+    static = QuotaPolicy(W_max=W_MAX, life_sec=86400, service_learning=0)
+    assert static.observe_wear((1, 2), 0) is None
+    assert static.w_left == W_MAX
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+from trace_log import export_json
+
+if len(sys.argv) < 2:
+    print("Usage:\n\t%s TRACE [JSON_PREFIX]" % sys.argv[0])
+    sys.exit(1)
+
+if len(sys.argv) > 2:
+    JSON_PREFIX="%s-" % (sys.argv[2])
+else:
+    JSON_PREFIX=""
+
+export_json(sys.argv[1], JSON_PREFIX, "%.0f" % time.time())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+import numpy
+
+# File layout:
+#   header   MAGIC, u32 meta length, meta JSON
+#   chunk*   CHUNK_MAGIC, u32 ticks, u32 records, u32 payload length,
+#            u32 crc32, payload = TICK_DTYPE[ticks] + REC_DTYPE[records]
+#   footer   INDEX_MAGIC, u32 chunks, INDEX_DTYPE[chunks],
+#            u64 footer offset, END_MAGIC
+# A log without footer (crash) is recovered by scanning the chunks and
+# stopping at the first torn one.  Ticks only have records for the UIDs
+# the policy charged; a UID without a record was idle: bw 0, not leashed,
+# its sectors and slack unchanged, except that a tick's rollover bits say
+# which tiers started a new period and so cleared every UID's slack.
+#
+# This log is the monitor's only history: it keeps no per-UID series in
+# memory.  uid_series() builds the dense (tick x UID) columns from the
+# records on demand, for export_json() and quota-report.py.
+MAGIC = b'QTRACE2\0'
+OLD_MAGIC = b'QTRACE1\0'
+CHUNK_MAGIC = b'QCHK'
+INDEX_MAGIC = b'QIDX'
+END_MAGIC = b'QTRACEND'
+
+HEADER = struct.Struct('<8sI')
+CHUNK_HEADER = struct.Struct('<4sIIII')
+INDEX_HEADER = struct.Struct('<4sI')
+TRAILER = struct.Struct('<Q8s')
+
+TICK_DTYPE = numpy.dtype([
+    ('tick', '<u4'),
+    ('time', '<f8'),
+    ('fg_uid', '<i4'),
+    ('n_uids', '<u4'),
+    ('total_bw', '<f4'),
+    ('total_bw_fg', '<f4'),
+    ('total_bw_bg', '<f4'),
+    ('slack_period_fg', '<f8'),
+    ('slack_period_bg', '<f8'),
+    ('watermark_fg', '<f8'),
+    ('watermark_bg', '<f8'),
+    ('w_left', '<f8'),
+    ('rollover', 'u1'),
+])
+
+# Tick rollover bits: the fg / bg charged tier started a new period
+ROLLOVER_FG = 1
+ROLLOVER_BG = 2
+
+REC_DTYPE = numpy.dtype([
+    ('uid', '<i4'),
+    ('bw', '<f4'),
+    ('sectors', '<u8'),
+    ('slack_fg', '<f4'),
+    ('slack_bg', '<f4'),
+    ('limit', '<f4'),
+])
+
+# Fields a missing record holds the last value of, until a tick with
+# the given rollover bits (0: for good)
+HELD_FIELDS = {'sectors': 0, 'slack_fg': ROLLOVER_FG, 'slack_bg': ROLLOVER_BG}
+
+INDEX_DTYPE = numpy.dtype([
+    ('offset', '<u8'),
+    ('first_tick', '<u4'),
+    ('ticks', '<u4'),
+    ('records', '<u4'),
+])
+
+class TraceWriter:
+    """Append-only chunked log of per-tick policy state and UID samples."""
+
+    def __init__(self, path, meta=None, chunk_ticks=10, fsync_interval=30):
+        self.path = path
+        self.chunk_ticks = chunk_ticks
+        self.fsync_interval = fsync_interval
+        self.f = open(path, 'wb')
+        meta_json = json.dumps(meta or {}).encode('utf-8')
+        self.f.write(HEADER.pack(MAGIC, len(meta_json)))
+        self.f.write(meta_json)
+        self.index = []
+        self.ticks = []
+        self.records = []
+        self.last_fsync = time.monotonic()
+
+    def add_tick(self, state, records):
+        """state: values in TICK_DTYPE order minus n_uids.
+        records: (uid, bw, sectors, slack_fg, slack_bg, limit) tuples."""
+        state = tuple(state)
+        self.ticks.append(state[:3] + (len(records),) + state[3:])
+        self.records.extend(records)
+        if len(self.ticks) >= self.chunk_ticks:
+            self.flush()
+
+    def flush(self):
+        if not self.ticks:
+            return
+        payload = (numpy.array(self.ticks, TICK_DTYPE).tobytes() +
+            numpy.array(self.records, REC_DTYPE).tobytes())
+        offset = self.f.tell()
+        self.f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(self.ticks), len(self.records),
+            len(payload), zlib.crc32(payload)))
+        self.f.write(payload)
+        self.index.append((offset, self.ticks[0][0], len(self.ticks), len(self.records)))
+        self.ticks = []
+        self.records = []
+        self.f.flush()
+        now = time.monotonic()
+        if now - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.f.fileno())
+            self.last_fsync = now
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.flush()
+        footer = self.f.tell()
+        self.f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(self.index)))
+        self.f.write(numpy.array(self.index, INDEX_DTYPE).tobytes())
+        self.f.write(TRAILER.pack(footer, END_MAGIC))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+class TraceReader:
+    """Memory-mapped view of a trace log; chunks are decoded on access."""
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_len = HEADER.unpack_from(self.buf, 0)
+        if magic == OLD_MAGIC:
+            raise ValueError("%s is a trace log from before rollover marks" % path)
+        if magic != MAGIC:
+            raise ValueError("%s is not a trace log" % path)
+        self.meta = json.loads(bytes(self.buf[HEADER.size:HEADER.size + meta_len]))
+        self.data_start = HEADER.size + meta_len
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = self._scan_chunks()
+
+    def close(self):
+        try:
+            self.buf.close()
+        except BufferError:
+            # Arrays handed out still view the mapping, it goes with them
+            pass
+        self.f.close()
+
+    def __len__(self):
+        return int(self.index['ticks'].sum())
+
+    def _read_index(self):
+        if len(self.buf) < self.data_start + TRAILER.size:
+            return None
+        footer, end = TRAILER.unpack_from(self.buf, len(self.buf) - TRAILER.size)
+        if end != END_MAGIC:
+            return None
+        magic, count = INDEX_HEADER.unpack_from(self.buf, footer)
+        if magic != INDEX_MAGIC:
+            return None
+        return numpy.frombuffer(self.buf, INDEX_DTYPE, count, footer + INDEX_HEADER.size).copy()
+
+    def _scan_chunks(self):
+        index = []
+        offset = self.data_start
+        while offset + CHUNK_HEADER.size <= len(self.buf):
+            magic, ticks, records, length, crc = CHUNK_HEADER.unpack_from(self.buf, offset)
+            start = offset + CHUNK_HEADER.size
+            if magic != CHUNK_MAGIC or start + length > len(self.buf):
+                break
+            if zlib.crc32(self.buf[start:start + length]) != crc:
+                break
+            first_tick = numpy.frombuffer(self.buf, TICK_DTYPE, 1, start)['tick'][0]
+            index.append((offset, first_tick, ticks, records))
+            offset = start + length
+        return numpy.array(index, INDEX_DTYPE)
+
+    def chunk(self, i):
+        """(ticks, records) structured arrays backed by the mapping."""
+        offset, _, ticks, records = self.index[i]
+        start = int(offset) + CHUNK_HEADER.size
+        tick_arr = numpy.frombuffer(self.buf, TICK_DTYPE, int(ticks), start)
+        rec_arr = numpy.frombuffer(self.buf, REC_DTYPE, int(records),
+            start + int(ticks) * TICK_DTYPE.itemsize)
+        return tick_arr, rec_arr
+
+    def chunks(self):
+        for i in range(len(self.index)):
+            yield self.chunk(i)
+
+    def ticks(self):
+        return numpy.concatenate([t for t, _ in self.chunks()] or
+            [numpy.zeros(0, TICK_DTYPE)])
+
+    def records(self):
+        """All records plus the row (tick position) each belongs to."""
+        recs = []
+        rows = []
+        row = 0
+        for ticks, chunk_recs in self.chunks():
+            recs.append(chunk_recs)
+            rows.append(numpy.repeat(numpy.arange(row, row + len(ticks)), ticks['n_uids']))
+            row += len(ticks)
+        if not recs:
+            return numpy.zeros(0, REC_DTYPE), numpy.zeros(0, numpy.int64)
+        return numpy.concatenate(recs), numpy.concatenate(rows)
+
+    def uid_series(self, field, fill=0):
+        """{uid: dense array over all ticks}, `fill` where a UID was absent
+        (for HELD_FIELDS, the last value up to the next clearing rollover)."""
+        hold = field in HELD_FIELDS
+        recs, rows = self.records()
+        n = len(self)
+        resets = numpy.zeros(0, numpy.int64)
+        if hold and HELD_FIELDS[field]:
+            resets = numpy.flatnonzero(self.ticks()['rollover'] & HELD_FIELDS[field])
+        uids, inv = numpy.unique(recs['uid'], return_inverse=True)
+        order = numpy.argsort(inv, kind='stable')
+        bounds = numpy.searchsorted(inv[order], numpy.arange(len(uids) + 1))
+        series = {}
+        for j, uid in enumerate(uids):
+            sel = order[bounds[j]:bounds[j + 1]]
+            col = numpy.full(n, fill, recs.dtype[field])
+            col[rows[sel]] = recs[field][sel]
+            if hold:
+                # The last record or clearing rollover at or before each tick
+                last = numpy.full(n, -1)
+                last[resets] = resets
+                last[rows[sel]] = rows[sel]
+                last = numpy.maximum.accumulate(last)
+                recorded = numpy.zeros(n, bool)
+                recorded[rows[sel]] = True
+                held = (last >= 0) & recorded[numpy.maximum(last, 0)]
+                col = numpy.where(held, col[numpy.maximum(last, 0)], fill).astype(recs.dtype[field])
+            series[str(uid)] = col
+        return series
+
+def export_json(path, prefix, timestamp):
+    """Write the monitor's legacy hist_*.json files from a trace log."""
+    reader = TraceReader(path)
+    ticks = reader.ticks()
+    outputs = {
+        'hist_bw': {uid: s.tolist() for uid, s in reader.uid_series('bw').items()},
+        'hist_total_bw': ticks['total_bw'].tolist(),
+        'hist_total_bw_fg': ticks['total_bw_fg'].tolist(),
+        'hist_total_bw_bg': ticks['total_bw_bg'].tolist(),
+        'hist_stats': {uid: (s / 2).tolist() for uid, s in reader.uid_series('sectors').items()},
+        'hist_uid_slack_fg': {uid: s.tolist() for uid, s in reader.uid_series('slack_fg').items()},
+        'hist_uid_slack_bg': {uid: s.tolist() for uid, s in reader.uid_series('slack_bg').items()},
+        'hist_slack_period_fg': ticks['slack_period_fg'].tolist(),
+        'hist_slack_period_bg': ticks['slack_period_bg'].tolist(),
+        'hist_watermark_fg': ticks['watermark_fg'].tolist(),
+        'hist_watermark_bg': ticks['watermark_bg'].tolist(),
+    }
+    hist_uid_limit = {}
+    for uid, limit in reader.uid_series('limit', fill=-1).items():
+        limited = numpy.flatnonzero(limit >= 0)
+        if len(limited) > 0:
+            hist_uid_limit[uid] = int(ticks['tick'][limited[0]])
+    outputs['hist_uid_limit'] = hist_uid_limit
+    reader.close()
+
+    for name, data in outputs.items():
+        print('Outputing %s...' % name)
+        json_file = open("%s%s-%s.json" % (prefix, name, timestamp), 'w')
+        json.dump(data, json_file)
+        json_file.close()
+    print('done')
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import os
+from subprocess import run
+from subprocess import PIPE
+from subprocess import DEVNULL
+import metrics
+from adb_stream import adb_cmd
+
+# eMMC device health (JESD84-B51 EXT_CSD): life time estimates A and B in
+# one file, pre-EOL info in the other
+EMMC_LIFE_TIME = '/sys/class/mmc_host/mmc0/mmc0:0001/life_time'
+EMMC_PRE_EOL = '/sys/class/mmc_host/mmc0/mmc0:0001/pre_eol_info'
+# UFS health descriptor, same encodings
+UFS_HEALTH = '/sys/devices/platform/soc/1d84000.ufshc/health_descriptor'
+UFS_LIFE_TIME = (UFS_HEALTH + '/life_time_estimation_a', UFS_HEALTH + '/life_time_estimation_b')
+UFS_PRE_EOL = UFS_HEALTH + '/eol_info'
+
+# Life time estimate levels: 1 is 0-10% of the rated endurance used, 10
+# is 90-100%, 11 past it; 0 is not reported
+LEVEL_STEPS = 10
+LEVEL_EXCEEDED = 11
+# Pre-EOL info: reserved blocks normal, 80% (warning) and 90% (urgent)
+# consumed.  Once it warns, at most this fraction of W_max is taken to
+# be left, whatever the life time estimate says.
+PRE_EOL_LEFT = {2: 0.2, 3: 0.1}
+
+def parse_health(life_time, pre_eol):
+    """(level, pre_eol) from the text of the health files; level is the
+    larger of the type A and B estimates."""
+    levels = [int(field, 16) for field in life_time.split()]
+    fields = pre_eol.split()
+    return max(levels or [0]), int(fields[0], 16) if fields else 0
+
+class FileWearSource:
+    """Health files readable on this host (or a local stand-in tree)."""
+
+    def __init__(self, life_time=(EMMC_LIFE_TIME,), pre_eol=EMMC_PRE_EOL, root=''):
+        self.life_time = [root + path for path in life_time]
+        self.pre_eol = root + pre_eol
+
+    def read(self):
+        """(level, pre_eol), None if the device doesn't report them."""
+        try:
+            life_time = " ".join(open(path).read() for path in self.life_time)
+            pre_eol = open(self.pre_eol).read()
+        except IOError:
+            return None
+        return parse_health(life_time, pre_eol)
+
+class AdbWearSource:
+    """The same files on a phone, in one adb round-trip."""
+
+    def __init__(self, serial=None, life_time=(EMMC_LIFE_TIME,), pre_eol=EMMC_PRE_EOL):
+        self.serial = serial
+        self.paths = list(life_time) + [pre_eol]
+        # One "i=contents" line per file, empty if it can't be read, so a
+        # missing file can't shift the others into its place
+        self.command = "; ".join('echo "%d=$(cat %s 2>/dev/null)"' % (i, path)
+            for i, path in enumerate(self.paths))
+
+    def read(self):
+        metrics.counters['spawns'] += 1
+        out = run(adb_cmd(self.serial) + ['shell', self.command],
+            stdout=PIPE, stderr=DEVNULL).stdout.decode('utf-8', 'replace')
+        values = {}
+        for line in out.splitlines():
+            key, sep, value = line.partition('=')
+            if sep and key.strip().isdigit():
+                values[int(key)] = value.strip()
+        fields = [values.get(i, '') for i in range(len(self.paths))]
+        if not all(fields):
+            return None
+        # The life time files, then pre-EOL
+        try:
+            return parse_health(" ".join(fields[:-1]), fields[-1])
+        except ValueError:
+            return None
+
+def wear_source(spec, serial=None):
+    """'adb' (eMMC), 'adb-ufs', or a local root the eMMC paths are under."""
+    if spec == 'adb':
+        return AdbWearSource(serial)
+    if spec == 'adb-ufs':
+        return AdbWearSource(serial, UFS_LIFE_TIME, UFS_PRE_EOL)
+    return FileWearSource(root=os.path.abspath(spec))
+
+class WearEstimate:
+    """KiB left to write, from the device's own wear indicator.
+
+    The life time estimate steps up every LEVEL_STEPS-th of the rated
+    endurance, so the KiB written between two steps measure what a step
+    costs on this device, write amplification included.  From the second
+    step on, the KiB left are the steps left at that cost; before that
+    there is no estimate and the static W_max stands.  A pre-EOL warning
+    caps the estimate at PRE_EOL_LEFT of W_max, past the rated endurance
+    it is 0.  O(1) per reading; only the step points are kept.
+    """
+
+    def __init__(self, W_max):
+        self.W_max = W_max
+        self.level = None
+        self.pre_eol = 0
+        # (level, KiB written) where the estimate stepped up
+        self.first = None
+        self.last = None
+
+    def observe(self, reading, written, w_left):
+        """Take a (level, pre_eol) reading with the KiB written so far
+        and the KiB the budget has left; the KiB left or None."""
+        level, pre_eol = reading
+        if level <= 0:
+            return None
+        if self.level is not None and level > self.level:
+            self.last = (level, written)
+            if self.first is None:
+                self.first = self.last
+        self.level = level
+        self.pre_eol = pre_eol
+
+        left = None
+        if self.level >= LEVEL_EXCEEDED:
+            left = 0
+        elif self.first is not None and self.last[0] > self.first[0] and self.last[1] > self.first[1]:
+            per_step = (self.last[1] - self.first[1]) / (self.last[0] - self.first[0])
+            # At a step up, level - 1 steps are used
+            steps_left = LEVEL_STEPS - (self.last[0] - 1) - (written - self.last[1]) / per_step
+            left = max(steps_left, 0) * per_step
+        if pre_eol in PRE_EOL_LEFT:
+            left = min(w_left if left is None else left, PRE_EOL_LEFT[pre_eol] * self.W_max)
+        return left
+
+    def state(self):
+        return {'level': self.level, 'pre_eol': self.pre_eol, 'first': self.first,
+            'last': self.last}
+
+    def restore(self, state):
+        self.level = state.get('level')
+        self.pre_eol = state.get('pre_eol', 0)
+        self.first = tuple(state['first']) if state.get('first') else None
+        self.last = tuple(state['last']) if state.get('last') else None